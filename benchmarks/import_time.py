@@ -0,0 +1,110 @@
+"""Measure CLI startup time and which heavy modules each entry point imports.
+
+Run from the repository root:
+    python3 -m benchmarks.import_time
+    python3 -m benchmarks.import_time --repeats 10 --top 15
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import time
+
+# Modules that must only be imported by the stage that needs them
+HEAVY_MODULES = ("torch", "whisper", "pypdf", "langchain_classic", "chromadb")
+
+# Entry point -> command, timed end to end in a fresh interpreter
+SCENARIOS = {
+    "main.py --help": [sys.executable, "main.py", "--help"],
+    "import main": [sys.executable, "-c", "import main"],
+    "import retrieve.retrieve": [sys.executable, "-c", "import retrieve.retrieve"],
+    "import embed.embed": [sys.executable, "-c", "import embed.embed"],
+    "import source_to_text.video_to_text": [sys.executable, "-c", "import source_to_text.video_to_text"],
+}
+
+# Retrieval-only entry points that must never load Whisper/torch
+RETRIEVAL_ONLY = ("main.py --help", "import main", "import retrieve.retrieve")
+
+
+def time_command(command: list[str], repeats: int) -> list[float]:
+    """Wall-clock seconds of each run of a command"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def loaded_heavy_modules(command: list[str]) -> list[str]:
+    """Heavy modules present in sys.modules after running the scenario's import"""
+    if command[1] != "-c":
+        # Scripts are checked through the equivalent import
+        code = "import main"
+    else:
+        code = command[2]
+    probe = f"{code}\nimport sys\nprint(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=False)
+    if result.returncode != 0:
+        return [f"<import failed: {result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'unknown'}>"]
+    output = result.stdout.strip().splitlines()
+    return [m for m in output[-1].split(",") if m] if output else []
+
+
+def top_imports(module: str, top: int) -> list[tuple[str, float]]:
+    """Slowest imports (cumulative ms) reported by python -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=False
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, _, fields = line.partition(":")
+        self_us, cumulative_us, name = [field.strip() for field in fields.split("|")]
+        entries.append((name, int(cumulative_us) / 1000))
+    return sorted(entries, key=lambda entry: entry[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CLI startup and import time")
+    parser.add_argument("--repeats", type=int, default=5, help="runs per scenario")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list for main.py")
+    parser.add_argument("--json", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'scenario':<40}{'median':>10}{'min':>10}  heavy modules loaded")
+    for name, command in SCENARIOS.items():
+        timings = time_command(command, args.repeats)
+        heavy = loaded_heavy_modules(command)
+        results[name] = {
+            "median_s": statistics.median(timings),
+            "min_s": min(timings),
+            "heavy_modules": heavy
+        }
+        print(f"{name:<40}{statistics.median(timings):>9.3f}s{min(timings):>9.3f}s  {', '.join(heavy) or '-'}")
+
+    print(f"\nSlowest imports for `import main` (cumulative ms):")
+    for module, cumulative_ms in top_imports("main", args.top):
+        print(f"  {cumulative_ms:>9.1f}  {module}")
+
+    leaks = {name: results[name]["heavy_modules"] for name in RETRIEVAL_ONLY
+             if {"torch", "whisper"} & set(results[name]["heavy_modules"])}
+    if leaks:
+        print(f"\n❌ Retrieval-only entry points load Whisper/torch: {leaks}")
+    else:
+        print("\n✓ Retrieval-only entry points do not load Whisper/torch")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+        print(f"Results written to {args.json}")
+
+    sys.exit(1 if leaks else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Compare the NumPy MMR re-ranker with the langchain_chroma MMR path.
+
+Run from the repository root:
+    python3 -m benchmarks.mmr_benchmark
+    python3 -m benchmarks.mmr_benchmark --corpus 20000 --repeats 50
+"""
+import json
+import argparse
+import statistics
+import time
+
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_chroma.vectorstores import maximal_marginal_relevance as langchain_mmr
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from retrieve.mmr_retriever import MMRRetriever
+from utils.mmr_utils import max_marginal_relevance
+from config import (RETRIEVER_K, RETRIEVER_LAMBDA_MULT)
+
+FETCH_KS = (10, 100, 1000)
+DIMENSIONS = 768  # nomic-embed-text
+
+
+def median_ms(function, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def benchmark_selection(fetch_k: int, repeats: int, rng: np.random.Generator) -> dict:
+    """MMR selection alone on a random candidate matrix"""
+    query = rng.standard_normal(DIMENSIONS).astype(np.float32)
+    candidates = rng.standard_normal((fetch_k, DIMENSIONS)).astype(np.float32)
+
+    current = langchain_mmr(query, candidates, lambda_mult=RETRIEVER_LAMBDA_MULT, k=RETRIEVER_K)
+    vectorized = max_marginal_relevance(query, candidates, RETRIEVER_K, RETRIEVER_LAMBDA_MULT)
+    return {
+        "current_ms": median_ms(
+            lambda: langchain_mmr(query, candidates, lambda_mult=RETRIEVER_LAMBDA_MULT, k=RETRIEVER_K), repeats),
+        "vectorized_ms": median_ms(
+            lambda: max_marginal_relevance(query, candidates, RETRIEVER_K, RETRIEVER_LAMBDA_MULT), repeats),
+        "same_selection": current == vectorized
+    }
+
+
+def build_collection(corpus_size: int) -> Chroma:
+    """In-memory Chroma collection of fake-embedded chunks"""
+    vector_db = Chroma(collection_name="mmr_benchmark", embedding_function=DeterministicFakeEmbedding(size=DIMENSIONS))
+    for start in range(0, corpus_size, 1000):
+        positions = range(start, min(start + 1000, corpus_size))
+        vector_db.add_texts([f"search_document: synthetic chunk {i}" for i in positions],
+                            ids=[f"chunk:{i}" for i in positions])
+    return vector_db
+
+
+def benchmark_end_to_end(vector_db: Chroma, fetch_k: int, repeats: int) -> dict:
+    """Query embedding, candidate fetch and MMR, as the retriever runs them"""
+    query = "search_query: synthetic question"
+    retriever = MMRRetriever(vector_store=vector_db, k=RETRIEVER_K, fetch_k=fetch_k, lambda_mult=RETRIEVER_LAMBDA_MULT)
+    return {
+        "current_ms": median_ms(lambda: vector_db.max_marginal_relevance_search(
+            query, k=RETRIEVER_K, fetch_k=fetch_k, lambda_mult=RETRIEVER_LAMBDA_MULT), repeats),
+        "vectorized_ms": median_ms(lambda: retriever.invoke(query), repeats)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MMR re-ranking")
+    parser.add_argument("--corpus", type=int, default=5000, help="chunks in the synthetic collection")
+    parser.add_argument("--repeats", type=int, default=20, help="runs per measurement")
+    parser.add_argument("--json", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    results = {"selection": {}, "end_to_end": {}}
+
+    print(f"MMR selection only (k={RETRIEVER_K}, dim={DIMENSIONS}, median of {args.repeats} runs)")
+    print(f"{'fetch_k':>8}{'current':>12}{'vectorized':>12}{'speedup':>10}  same selection")
+    for fetch_k in FETCH_KS:
+        result = benchmark_selection(fetch_k, args.repeats, rng)
+        results["selection"][fetch_k] = result
+        print(f"{fetch_k:>8}{result['current_ms']:>10.2f}ms{result['vectorized_ms']:>10.2f}ms"
+              f"{result['current_ms'] / result['vectorized_ms']:>9.1f}x  {'✓' if result['same_selection'] else '✗'}")
+
+    print(f"\nBuilding in-memory collection with {args.corpus:,} chunks...")
+    vector_db = build_collection(args.corpus)
+
+    print(f"End to end retrieval (query embedding + Chroma query + MMR)")
+    print(f"{'fetch_k':>8}{'current':>12}{'vectorized':>12}{'speedup':>10}")
+    for fetch_k in FETCH_KS:
+        result = benchmark_end_to_end(vector_db, min(fetch_k, args.corpus), args.repeats)
+        results["end_to_end"][fetch_k] = result
+        print(f"{fetch_k:>8}{result['current_ms']:>10.2f}ms{result['vectorized_ms']:>10.2f}ms"
+              f"{result['current_ms'] / result['vectorized_ms']:>9.1f}x")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
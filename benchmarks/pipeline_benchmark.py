@@ -0,0 +1,258 @@
+"""Time every pipeline stage end to end on a synthetic corpus of PDFs and transcripts.
+
+Fake deterministic embedding and chat models stand in for Ollama (MODEL_BACKEND = "fake"),
+so the benchmark runs offline. Each stage runs in a fresh process, which gives it its own
+peak memory reading.
+
+Run from the repository root:
+    python3 -m benchmarks.pipeline_benchmark
+    python3 -m benchmarks.pipeline_benchmark --pdfs 50 --pages 20 --transcripts 20 --json results.json
+    python3 -m benchmarks.pipeline_benchmark --json new.json --compare results.json
+"""
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import resource
+import statistics
+import contextlib
+import tempfile
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+
+STAGES = ("extract", "chunk", "embed", "retrieve")
+WORDS_PER_PAGE = 450
+WORDS_PER_LINE = 12
+
+# Common words plus domain terms, so BM25 and the query generator have something to match
+VOCABULARY = (
+    "the of and to in is that for on with as by this are from at be an which it can model data "
+    "retrieval generation vector embedding chunk document query answer context token index search "
+    "language transformer attention layer training inference latency throughput memory cache batch "
+    "pipeline stage source page transcript video audio segment window overlap score rank fusion "
+    "similarity relevance diversity prompt system user evaluation benchmark dataset corpus passage"
+).split()
+TOPICS = ("ColPali", "PaliGemma-3B", "nomic-embed-text", "llama3", "Chroma", "BM25", "Whisper", "MMR")
+
+
+def synthetic_text(rng: random.Random, words: int) -> str:
+    """Sentences of random vocabulary words with an occasional topic name"""
+    sentences = []
+    while words > 0:
+        length = min(words, rng.randint(8, 20))
+        sentence = [rng.choice(TOPICS) if rng.random() < 0.05 else rng.choice(VOCABULARY) for _ in range(length)]
+        sentences.append(" ".join(sentence).capitalize() + ".")
+        words -= length
+    return " ".join(sentences)
+
+
+def pdf_string(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: list[str]) -> None:
+    """Minimal text-only PDF with one Helvetica text block per page"""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{4 + 2 * i} 0 R' for i in range(len(pages)))}] /Count {len(pages)} >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(pages):
+        words = text.split()
+        lines = [" ".join(words[start:start + WORDS_PER_LINE]) for start in range(0, len(words), WORDS_PER_LINE)]
+        stream = "BT /F1 10 Tf 12 TL 50 760 Td " + " ".join(f"({pdf_string(line)}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    data, offsets = b"%PDF-1.4\n", []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    data += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def generate_corpus(workdir: str, pdfs: int, pages: int, transcripts: int, transcript_words: int,
+                    seed: int) -> dict:
+    """Write synthetic PDFs to sources/ and transcripts to the transcript dir; returns the corpus sizes"""
+    rng = random.Random(seed)
+    sources_dir = os.path.join(workdir, os.path.dirname(config.PDF_PATTERN))
+    transcript_dir = os.path.join(workdir, config.VIDEO_TRANSCRIPT_DIR)
+    os.makedirs(sources_dir, exist_ok=True)
+    os.makedirs(transcript_dir, exist_ok=True)
+
+    for i in range(pdfs):
+        write_pdf(os.path.join(sources_dir, f"paper_{i:04d}.pdf"),
+                  [synthetic_text(rng, WORDS_PER_PAGE) for _ in range(pages)])
+    for i in range(transcripts):
+        with open(os.path.join(transcript_dir, f"lecture_{i:04d}_transcript.txt"), "w", encoding="utf-8") as f:
+            f.write(synthetic_text(rng, transcript_words))
+
+    return {"pdfs": pdfs, "pages": pdfs * pages, "transcripts": transcripts,
+            "transcript_words": transcripts * transcript_words}
+
+
+def generate_queries(count: int, seed: int) -> list[str]:
+    rng = random.Random(seed + 1)
+    return [f"What does the corpus say about {rng.choice(TOPICS)} and {rng.choice(VOCABULARY[20:])}?"
+            for _ in range(count)]
+
+
+def peak_rss_mb(who: int) -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_stage(stage: str, workdir: str, options: dict) -> dict:
+    """Run one stage in the benchmark working directory (executes in a fresh process)"""
+    os.chdir(workdir)
+    config.MODEL_BACKEND = "fake"
+    config.ANSWER_CACHE_ENABLED = False  # Every query must go through retrieval and generation
+    config.RETRIEVER_TYPE = options["retriever"]
+
+    output = contextlib.nullcontext() if options["verbose"] else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with output:
+        if stage == "extract":
+            from source_to_text.pdf_to_text import extract_text_from_pdfs
+            baseline = peak_rss_mb(resource.RUSAGE_SELF)
+            start = time.perf_counter()
+            extract_text_from_pdfs(config.PDF_PATTERN, config.PDF_PAGES_DIR, workers=options["workers"])
+            result = {"seconds": time.perf_counter() - start, "items": options["pages"], "unit": "pages"}
+
+        elif stage == "chunk":
+            from chunking.recursive_chunker import chunk_recursive
+            baseline = peak_rss_mb(resource.RUSAGE_SELF)
+            start = time.perf_counter()
+            successful, _ = chunk_recursive(config.VIDEO_TRANSCRIPT_DIR, config.PDF_PAGES_DIR, config.CHUNKED_DIR,
+                                            workers=options["workers"])
+            result = {"seconds": time.perf_counter() - start, "items": sum(count for *_, count in successful),
+                      "unit": "chunks"}
+
+        elif stage == "embed":
+            from embed.embed import embed_chunks_to_db
+            baseline = peak_rss_mb(resource.RUSAGE_SELF)
+            start = time.perf_counter()
+            stored = embed_chunks_to_db(full_rebuild=True)
+            result = {"seconds": time.perf_counter() - start, "items": sum(len(ids) for ids in stored.values()),
+                      "unit": "chunks"}
+
+        else:
+            from retrieve.retrieve import build_rag_chain
+            baseline = peak_rss_mb(resource.RUSAGE_SELF)
+            start = time.perf_counter()
+            rag_chain, _ = build_rag_chain()
+            load_seconds = time.perf_counter() - start
+            latencies = []
+            for query in options["queries"]:
+                query_start = time.perf_counter()
+                rag_chain.invoke({"input": f"search_query: {query}"})
+                latencies.append(time.perf_counter() - query_start)
+            result = {"seconds": time.perf_counter() - start, "items": len(latencies), "unit": "queries",
+                      "load_seconds": load_seconds, "query_seconds": sum(latencies),
+                      "p50_ms": statistics.median(latencies) * 1000,
+                      "p95_ms": statistics.quantiles(latencies, n=20)[-1] * 1000 if len(latencies) > 1 else None}
+
+    # Queries/s is over the queries alone, the other stages over their whole run
+    busy_seconds = result.get("query_seconds", result["seconds"])
+    result["per_second"] = result["items"] / busy_seconds if busy_seconds else None
+    result["baseline_rss_mb"] = baseline
+    result["peak_rss_mb"] = peak_rss_mb(resource.RUSAGE_SELF)
+    result["workers_peak_rss_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    return result
+
+
+def print_results(results: dict, baseline: dict = None) -> None:
+    print(f"\n{'stage':<10}{'seconds':>10}{'throughput':>20}{'peak RSS':>12}{'workers RSS':>13}"
+          + (f"{'vs baseline':>13}" if baseline else ""))
+    for stage, result in results["stages"].items():
+        throughput = f"{result['per_second']:.1f} {result['unit']}/s" if result["per_second"] else "-"
+        line = (f"{stage:<10}{result['seconds']:>10.2f}{throughput:>20}{result['peak_rss_mb']:>10.0f}MB"
+                f"{result['workers_peak_rss_mb']:>11.0f}MB")
+        previous = (baseline or {}).get("stages", {}).get(stage)
+        if previous and previous["seconds"]:
+            line += f"{(result['seconds'] / previous['seconds'] - 1) * 100:>+12.1f}%"
+        print(line)
+
+    retrieve_result = results["stages"].get("retrieve")
+    if retrieve_result:
+        p95 = f", p95 {retrieve_result['p95_ms']:.1f}ms" if retrieve_result["p95_ms"] is not None else ""
+        print(f"\nretrieve: chain loaded in {retrieve_result['load_seconds']:.2f}s, "
+              f"query p50 {retrieve_result['p50_ms']:.1f}ms{p95}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on a synthetic corpus")
+    parser.add_argument("--pdfs", type=int, default=10, help="number of synthetic PDFs")
+    parser.add_argument("--pages", type=int, default=10, help="pages per PDF")
+    parser.add_argument("--transcripts", type=int, default=10, help="number of synthetic transcripts")
+    parser.add_argument("--transcript-words", type=int, default=5000, help="words per transcript")
+    parser.add_argument("--queries", type=int, default=20, help="queries answered in the retrieve stage")
+    parser.add_argument("--workers", type=int, default=1, help="extraction and chunking processes")
+    parser.add_argument("--retriever", default=config.RETRIEVER_TYPE, choices=("similarity", "mmr", "hybrid"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=STAGES,
+                        help="stages to time (earlier stages still run, untimed, when needed)")
+    parser.add_argument("--workdir", help="keep the corpus and outputs in this directory instead of a temp dir")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    parser.add_argument("--json", help="write results to this JSON file")
+    parser.add_argument("--compare", help="earlier results JSON to compare stage times against")
+    args = parser.parse_args()
+
+    if args.workdir and os.path.isdir(args.workdir) and os.listdir(args.workdir):
+        parser.error(f"--workdir {args.workdir} is not empty")
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="rag_benchmark_")
+    # Stages run with workdir as the current directory, so the pipeline modules are found through sys.path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    print(f"Generating synthetic corpus in {workdir}...")
+    corpus = generate_corpus(workdir, args.pdfs, args.pages, args.transcripts, args.transcript_words, args.seed)
+    print(f"  {corpus['pdfs']} PDFs ({corpus['pages']} pages), {corpus['transcripts']} transcripts "
+          f"({corpus['transcript_words']:,} words)")
+
+    options = {"workers": args.workers, "retriever": args.retriever, "verbose": args.verbose,
+               "pages": corpus["pages"], "queries": generate_queries(args.queries, args.seed)}
+    results = {"corpus": corpus, "settings": {"workers": args.workers, "retriever": args.retriever,
+                                              "queries": args.queries, "seed": args.seed,
+                                              "chunk_size": config.CHUNK_SIZE,
+                                              "embed_batch_size": config.EMBED_BATCH_SIZE},
+               "stages": {}}
+
+    # Each stage needs the outputs of the ones before it, so all of them run up to the last requested one
+    last_stage = max(STAGES.index(stage) for stage in args.stages)
+    context = multiprocessing.get_context("spawn")
+    try:
+        for stage in STAGES[:last_stage + 1]:
+            print(f"Running {stage}...")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(run_stage, stage, workdir, options).result()
+            if stage in args.stages:
+                results["stages"][stage] = result
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
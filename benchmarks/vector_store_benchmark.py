@@ -0,0 +1,216 @@
+"""Recall, latency and memory of the memmap vector store against exact float32 search.
+
+Synthetic embeddings (Gaussian clusters on the unit sphere, like document embeddings of a
+corpus with a few hundred topics) are written to a memmap store per storage dtype, without
+and with the IVF index. Each store is opened and queried in a fresh process, which gives it
+its own open time and memory growth over the imports. Recall@k is measured against exact float32
+brute-force search over the same vectors. --chroma adds the same vectors in a Chroma
+collection (HNSW) as a baseline.
+
+Run from the repository root:
+    python3 -m benchmarks.vector_store_benchmark
+    python3 -m benchmarks.vector_store_benchmark --vectors 500000 --nprobe 8 16 32 --json results.json
+    python3 -m benchmarks.vector_store_benchmark --vectors 20000 --chroma
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import resource
+import statistics
+import tempfile
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import config
+from utils.memmap_store import MemmapStoreWriter, STORAGE_DTYPES
+
+PAGE_SIZE = 10_000  # Vectors generated and written per step
+CHROMA_BATCH_SIZE = 5000
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def rss_mb() -> float:
+    """Current resident memory, including the mapped store pages that were read; the peak where /proc is missing"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        return peak_rss_mb()
+
+
+def cluster_centers(clusters: int, dimension: int, seed: int) -> np.ndarray:
+    centers = np.random.default_rng(seed).standard_normal((clusters, dimension)).astype(np.float32)
+    return centers / np.linalg.norm(centers, axis=1, keepdims=True)
+
+
+def synthetic_vectors(centers: np.ndarray, count: int, spread: float, rng: np.random.Generator) -> np.ndarray:
+    """Unit vectors scattered around random cluster centers"""
+    noise = rng.standard_normal((count, centers.shape[1])).astype(np.float32) * spread / np.sqrt(centers.shape[1])
+    vectors = centers[rng.integers(len(centers), size=count)] + noise
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def iter_pages(options: dict):
+    """The corpus in pages of (start row, vectors); regenerated identically on every call"""
+    centers = cluster_centers(options["clusters"], options["dimension"], options["seed"])
+    rng = np.random.default_rng(options["seed"] + 1)
+    for start in range(0, options["vectors"], PAGE_SIZE):
+        yield start, synthetic_vectors(centers, min(PAGE_SIZE, options["vectors"] - start), options["spread"], rng)
+
+
+def make_queries(options: dict) -> np.ndarray:
+    centers = cluster_centers(options["clusters"], options["dimension"], options["seed"])
+    return synthetic_vectors(centers, options["queries"], options["spread"], np.random.default_rng(options["seed"] + 2))
+
+
+def exact_neighbors(options: dict, queries: np.ndarray) -> list[set[str]]:
+    """IDs of the k nearest vectors of every query by exact float32 cosine similarity"""
+    k = options["k"]
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    for start, vectors in iter_pages(options):
+        scores = np.concatenate([best_scores, queries @ vectors.T], axis=1)
+        rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(vectors)), (len(queries),
+                                                                                                     len(vectors)))],
+                              axis=1)
+        top = np.argsort(-scores, axis=1)[:, :k]
+        best_scores, best_rows = np.take_along_axis(scores, top, axis=1), np.take_along_axis(rows, top, axis=1)
+    return [{f"v{row}" for row in rows} for rows in best_rows]
+
+
+def write_store(store_dir: str, dtype: str, ivf: bool, options: dict) -> float:
+    """Write the corpus to a memmap store; returns the seconds it took"""
+    start_time = time.perf_counter()
+    with MemmapStoreWriter(store_dir, options["vectors"], options["dimension"], dtype) as writer:
+        for start, vectors in iter_pages(options):
+            ids = [f"v{row}" for row in range(start, start + len(vectors))]
+            writer.append(ids, vectors, [""] * len(ids), [{}] * len(ids))
+        writer.finish(ivf, seed=options["seed"])
+    return time.perf_counter() - start_time
+
+
+def write_chroma(persist_dir: str, options: dict) -> float:
+    import chromadb
+    start_time = time.perf_counter()
+    collection = chromadb.PersistentClient(path=persist_dir).create_collection(
+        "vector_store_benchmark", metadata={"hnsw:space": "cosine"})
+    for start, vectors in iter_pages(options):
+        for offset in range(0, len(vectors), CHROMA_BATCH_SIZE):
+            batch = vectors[offset:offset + CHROMA_BATCH_SIZE]
+            collection.add(ids=[f"v{row}" for row in range(start + offset, start + offset + len(batch))],
+                           embeddings=batch)
+    return time.perf_counter() - start_time
+
+
+def measure(kind: str, path: str, nprobe: int, queries: np.ndarray, truth: list[set[str]], k: int) -> dict:
+    """Open a store and answer every query (executes in a fresh process)"""
+    baseline = rss_mb()
+    start = time.perf_counter()
+    if kind == "chroma":
+        import chromadb
+        collection = chromadb.PersistentClient(path=path).get_collection("vector_store_benchmark")
+
+        def search(query):
+            return collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])["ids"][0]
+    else:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        from utils.memmap_store import MemmapVectorStore
+        store = MemmapVectorStore(path, DeterministicFakeEmbedding(size=queries.shape[1]), nprobe=nprobe)
+
+        def search(query):
+            return [doc.id for doc in store.similarity_search_by_vector(query, k)]
+    open_ms = (time.perf_counter() - start) * 1000
+
+    latencies, recalls = [], []
+    for query, expected in zip(queries, truth):
+        query_start = time.perf_counter()
+        found = search(query)
+        latencies.append((time.perf_counter() - query_start) * 1000)
+        recalls.append(len(expected.intersection(found)) / k)
+
+    return {"open_ms": open_ms, "first_query_ms": latencies[0], "p50_ms": statistics.median(latencies),
+            "p95_ms": float(np.percentile(latencies, 95)), "recall": statistics.mean(recalls),
+            "baseline_rss_mb": baseline, "rss_mb": rss_mb(), "peak_rss_mb": peak_rss_mb()}
+
+
+def directory_mb(path: str) -> float:
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names) / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall, latency and memory of the memmap vector store")
+    parser.add_argument("--vectors", type=int, default=100_000, help="corpus size")
+    parser.add_argument("--dimension", type=int, default=768, help="768 for nomic-embed-text")
+    parser.add_argument("--clusters", type=int, default=500, help="topics the synthetic vectors are drawn around")
+    parser.add_argument("--spread", type=float, default=1.5, help="noise around the cluster centers")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10, help="recall@k")
+    parser.add_argument("--dtypes", nargs="+", default=list(STORAGE_DTYPES), choices=list(STORAGE_DTYPES))
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[config.MEMMAP_IVF_NPROBE],
+                        help="IVF lists scanned per query, one run per value")
+    parser.add_argument("--no-ivf", action="store_true", help="only benchmark brute-force search")
+    parser.add_argument("--chroma", action="store_true", help="also benchmark a Chroma collection (slow to build)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    options = {"vectors": args.vectors, "dimension": args.dimension, "clusters": args.clusters,
+               "spread": args.spread, "queries": args.queries, "k": args.k, "seed": args.seed}
+    workdir = tempfile.mkdtemp(prefix="vector_store_benchmark_")
+    context = multiprocessing.get_context("spawn")
+    runs = []
+
+    try:
+        print(f"Computing exact float32 neighbors of {args.queries} queries over {args.vectors:,} vectors...")
+        queries = make_queries(options)
+        truth = exact_neighbors(options, queries)
+
+        for dtype in args.dtypes:
+            for ivf in (False,) if args.no_ivf else (False, True):
+                store_dir = os.path.join(workdir, f"{dtype}{'_ivf' if ivf else ''}")
+                print(f"Writing {dtype} store{' with IVF index' if ivf else ''}...")
+                build_seconds = write_store(store_dir, dtype, ivf, options)
+                for nprobe in args.nprobe if ivf else [None]:
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                        result = pool.submit(measure, "memmap", store_dir, nprobe, queries, truth, args.k).result()
+                    runs.append({"store": "memmap", "dtype": dtype,
+                                 "search": f"ivf nprobe={nprobe}" if ivf else "brute force",
+                                 "size_mb": directory_mb(store_dir), "build_seconds": build_seconds, **result})
+                shutil.rmtree(store_dir, ignore_errors=True)
+
+        if args.chroma:
+            chroma_dir = os.path.join(workdir, "chroma")
+            print("Writing Chroma collection...")
+            build_seconds = write_chroma(chroma_dir, options)
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(measure, "chroma", chroma_dir, None, queries, truth, args.k).result()
+            runs.append({"store": "chroma", "dtype": "float32", "search": "hnsw", "size_mb": directory_mb(chroma_dir),
+                         "build_seconds": build_seconds, **result})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{'store':<8}{'dtype':<9}{'search':<17}{'size':>9}{'open':>9}{'p50':>9}{'p95':>9}"
+          f"{f'recall@{args.k}':>11}{'RSS growth':>12}")
+    for run in runs:
+        print(f"{run['store']:<8}{run['dtype']:<9}{run['search']:<17}{run['size_mb']:>7.0f}MB"
+              f"{run['open_ms']:>7.1f}ms{run['p50_ms']:>7.2f}ms{run['p95_ms']:>7.2f}ms{run['recall']:>11.3f}"
+              f"{run['rss_mb'] - run['baseline_rss_mb']:>10.0f}MB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": options, "runs": runs}, f, indent=4)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,93 @@
-import json
+import argparse
 from pathlib import Path
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from config import (VIDEO_TRANSCRIPT_DIR, CHUNKED_DIR, CHUNK_SIZE, CHUNK_OVERLAP)
-from utils.chunking_utils import load_transcript_documents, validate_loaded_documents, split_documents_into_chunks, documents_to_dicts, save_chunks_to_json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from config import (VIDEO_TRANSCRIPT_DIR, PDF_PAGES_DIR, CHUNKED_DIR, CHUNK_WORKERS)
+from utils.chunking_utils import (create_text_splitter, load_transcript_document, load_page_documents,
+                                  add_segment_timestamps)
+from utils.chunk_store import write_chunk_file
+from utils.ingest_utils import chunks_path_for
 from utils.log_utils import print_chunking_summary
 
 
-def chunk_recursive(input_dir:str, output_dir:str):
+def iter_file_chunks(input_path: Path):
+    """Split one transcript or PDF page records file, page by page"""
+    text_splitter = create_text_splitter()
 
-    # 1. Initialize the text splitter
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE, 
-        chunk_overlap=CHUNK_OVERLAP, 
-        add_start_index=True
-    )
+    if input_path.suffix == ".txt":
+        document = load_transcript_document(input_path)
+        if document is None:
+            return
+        chunks = text_splitter.split_documents([document])
+        # Cite the time offset in the video for transcripts with saved segments
+        add_segment_timestamps(chunks, input_path.parent)
+        yield from chunks
+    else:
+        for page in load_page_documents(input_path):
+            yield from text_splitter.split_documents([page])
 
-    # 2. Setup paths and lists
-    transcript_folder = Path(input_dir)
-    output_folder = Path(output_dir)
-    output_folder.mkdir(exist_ok=True)
 
-    # Check if transcript folder exists
-    if not transcript_folder.exists():
-        print(f"Error: {transcript_folder} folder not found!")
-        return
+def chunk_file(input_path: str, output_dir: str) -> tuple[str, int]:
+    """Chunk one file into chunked_<name>.jsonl (runs in a worker process); returns output path and chunk count"""
+    output_path = chunks_path_for(input_path, output_dir)
+    return output_path, write_chunk_file(iter_file_chunks(Path(input_path)), output_path)
 
-    # 3. Load transcript documents
-    documents = load_transcript_documents(transcript_folder)
-    
-    # Validate loaded documents
-    if not validate_loaded_documents(documents):
-        return
 
-    # 4. Split all documents into chunks
-    all_splits = split_documents_into_chunks(text_splitter, documents)
+def chunk_files(input_paths: list[str], output_dir: str, workers: int = CHUNK_WORKERS):
+    """Chunk transcripts and PDF page records with the same splitter, across worker processes.
 
-    # 5. Show summary of chunking results
-    print_chunking_summary(all_splits)
-    
-    # 6. Convert Document objects to dicts for saving
-    docs_to_save = documents_to_dicts(all_splits)
+    Returns (input path, chunk file, chunk count) for every chunked file and
+    the input paths that failed.
+    """
+    Path(output_dir).mkdir(exist_ok=True)
+    successful, failed = [], []
 
-    # 7. Save chunks to JSON file
-    save_chunks_to_json(docs_to_save, output_folder)
+    def record(input_path, result):
+        output_path, chunk_count = result
+        print(f"  ✓ {Path(input_path).name} -> {Path(output_path).name} ({chunk_count} chunks)")
+        successful.append((input_path, output_path, chunk_count))
+
+    if workers > 1 and len(input_paths) > 1:
+        print(f"Chunking {len(input_paths)} files with {workers} worker processes...")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(chunk_file, input_path, output_dir): input_path for input_path in input_paths}
+            for future in as_completed(futures):
+                try:
+                    record(futures[future], future.result())
+                except Exception as e:
+                    print(f"  ❌ Error chunking {Path(futures[future]).name}: {e}")
+                    failed.append(futures[future])
+    else:
+        print(f"Chunking {len(input_paths)} files...")
+        for input_path in input_paths:
+            try:
+                record(input_path, chunk_file(input_path, output_dir))
+            except Exception as e:
+                print(f"  ❌ Error chunking {Path(input_path).name}: {e}")
+                failed.append(input_path)
+
+    print_chunking_summary({Path(output_path).name: count for _, output_path, count in successful})
+    return successful, failed
+
+
+def chunk_recursive(transcript_dir: str, pages_dir: str, output_dir: str, workers: int = CHUNK_WORKERS):
+    """Chunk every transcript and PDF page records file found on disk"""
+    input_paths = sorted(str(path) for path in Path(transcript_dir).glob("*.txt"))
+    input_paths += sorted(str(path) for path in Path(pages_dir).glob("*_pages.json"))
+
+    if not input_paths:
+        print("No transcripts or PDF page files found to chunk!")
+        return [], []
+
+    return chunk_files(input_paths, output_dir, workers)
 
 
 def main():
-    print("Starting transcript chunking process...")
-    chunk_recursive(input_dir=VIDEO_TRANSCRIPT_DIR, output_dir=CHUNKED_DIR)
+    parser = argparse.ArgumentParser(description="Chunk transcripts and extracted PDF pages")
+    parser.add_argument("--workers", type=int, default=CHUNK_WORKERS, help="number of chunking processes")
+    args = parser.parse_args()
+
+    print("Starting chunking process...")
+    chunk_recursive(VIDEO_TRANSCRIPT_DIR, PDF_PAGES_DIR, CHUNKED_DIR, workers=args.workers)
 
 if __name__ == "__main__":
-    main()   
+    main()
@@ -1,29 +1,115 @@
 # Database Configuration
 PERSIST_DIR = "./embed_db"
 COLLECTION_NAME = "embed_chunks"
+EMBED_MANIFEST_FILE = "./embed_db/embed_manifest.json"  # Chunk IDs already stored in the collection
+EMBED_REVISION_FILE = "./embed_db/collection_revision"  # Changes whenever chunks are added or deleted
+
+# Vector Store Configuration
+VECTOR_STORE = "chroma"  # "chroma", or "memmap" for a quantized, memory-mapped export of the collection
+MEMMAP_STORE_DIR = "./embed_db/memmap"  # Written by python3 -m embed.export_memmap, refreshed by the embed step
+MEMMAP_DTYPE = "int8"  # "int8" (1 byte per dimension), "float16" or "float32"
+MEMMAP_IVF_MIN_VECTORS = 200_000  # Exports this large get an IVF index; smaller ones are searched brute force
+MEMMAP_IVF_NPROBE = 16  # IVF lists scanned per query; higher is slower with better recall
+
+# Partition Configuration (one collection per partition; changing PARTITION_BY rebuilds the vector DB)
+PARTITION_BY = None  # None for one collection, "category" (PDFs apart from transcripts) or "source_file" (per chunk file)
+PARTITION_INDEX_FILE = "./embed_db/partitions.json"  # Collection, category and source of every chunk file
+PARTITION_SEARCH_WORKERS = 4  # Partitions searched in parallel when a query spans several
+
+# Embedding Pipeline Configuration
+EMBED_BATCH_SIZE = 64  # Chunks per embedding request
+EMBED_CONCURRENCY = 4  # Embedding requests in flight at once
+EMBED_QUEUE_SIZE = 8  # Batches buffered between load, embed and write stages
+EMBED_MAX_RETRIES = 3
+EMBED_RETRY_BACKOFF = 1.0  # Seconds, doubled after every failed attempt
+
+# Deduplication Configuration (chunks dropped before embedding)
+DEDUP_ENABLED = True
+DEDUP_JACCARD_THRESHOLD = 0.85  # Shingle Jaccard similarity at which a chunk counts as a near-duplicate
+DEDUP_NUM_PERM = 128  # MinHash permutations per signature
+DEDUP_SHINGLE_SIZE = 5  # Words per shingle
+DEDUP_INDEX_FILE = "./embed_db/dedup_index.npz"  # MinHash signatures of the embedded chunks
 
 # Extraction to text
 PDF_PATTERN = "./sources/*.pdf"
 VIDEO_PATTERN = "./sources/*.mp4"
 VIDEO_TRANSCRIPT_DIR = "./video_transcripts/"
 CHUNKED_DIR = "./chunked"
-CHUNKED_TRANSCRIPTS_FILE = "chunked_transcripts.json"
+PDF_PAGES_DIR = "./extracted_pages"  # Page records extracted from PDFs, split by the chunking stage
+TRANSCRIBE_WORKERS = 1  # Whisper processes, each with its own model (CPU-only boxes)
+TRANSCRIBE_WINDOW_SECONDS = 600  # Long videos are split into audio windows transcribed in parallel
+TRANSCRIBE_OVERLAP_SECONDS = 20  # Overlap between windows, cut at its midpoint when stitching
+INGEST_MANIFEST_FILE = "./ingest_manifest.json"  # Source fingerprints and the outputs each stage produced
+PDF_WORKERS = 1  # Extraction processes; override with --workers N
+PDF_PAGES_PER_TASK = 50  # Large PDFs are split into page ranges of this size across workers
+INGEST_QUEUE_SIZE = 4  # Sources waiting between ingestion stages; a full queue holds back the stage before it
 
 # Model Configuration
 EMBEDDING_MODEL = "nomic-embed-text"
 CHAT_MODEL = "llama3"
+WHISPER_MODEL = "small"
 TEMPERATURE = 0
+MODEL_BACKEND = "ollama"  # "ollama", or "fake" for deterministic offline models (benchmarks)
+
+# Embedding Cache Configuration
+EMBED_CACHE_ENABLED = True
+EMBED_CACHE_PATH = "./embed_cache/embeddings.sqlite"
+EMBED_CACHE_MAX_ENTRIES = 200_000  # LRU bound, ~3KB per 768-dim vector
+
+# Query Embedding Batching Configuration
+QUERY_EMBED_BATCH_WINDOW_MS = 5  # Concurrent queries arriving within this window share one embedding call; 0 disables
+QUERY_EMBED_MAX_BATCH = 16  # A full batch is sent without waiting for the window to close
+
+# Answer Cache Configuration
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_PATH = "./embed_cache/answers.sqlite"
+ANSWER_CACHE_MAX_ENTRIES = 1000  # LRU bound
+ANSWER_CACHE_TTL_SECONDS = 7 * 24 * 3600  # Cached answers expire after a week
+ANSWER_CACHE_SIMILARITY = 0.95  # Cosine similarity for a near-duplicate query to reuse an answer; None disables
 
 # Retrieval Configuration
-RETRIEVER_TYPE = "mmr"  # or "similarity"
+RETRIEVER_TYPE = "mmr"  # "similarity", "mmr" or "hybrid" (BM25 + vector search)
 RETRIEVER_K = 5  # Number of documents to retrieve
 RETRIEVER_FETCH_K = 10  # Fetch more candidates for diversity
 RETRIEVER_LAMBDA_MULT = 0.7  # Balance between relevance and diversity
+RETRIEVER_FILTER = None  # e.g. {"category": "video_transcript"} or {"source": ["a.pdf", "b.pdf"]}; --filter overrides
+STREAM_ANSWERS = True  # Print answer tokens as they are generated
+CONTEXT_TOKEN_BUDGET = 3000  # Prompt tokens for retrieved context, leaves room in llama3's 8K window for the answer
+CONTEXT_MAX_TOKENS_PER_DOC = 1200  # Longer chunks (whole PDF pages) are trimmed to their most relevant sentences
+
+# Hybrid Retrieval Configuration (RETRIEVER_TYPE = "hybrid")
+BM25_INDEX_DIR = "./embed_db/bm25_index"  # Built and updated by the embed step
+BM25_K1 = 1.2
+BM25_B = 0.75
+HYBRID_VECTOR_WEIGHT = 1.0  # Weights of the vector and BM25 rankings in reciprocal-rank fusion
+HYBRID_LEXICAL_WEIGHT = 1.0
+HYBRID_RRF_K = 60
+
+# Retrieval Server Configuration (python3 main.py --serve)
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+SERVER_MAX_CONCURRENCY = 2  # Queries answered at once, so the Ollama backend isn't overloaded
+SERVER_MAX_QUEUE = 32  # Queries allowed to wait for a slot before the server answers 503
+SERVER_REQUEST_TIMEOUT = 300  # Seconds the client waits for an answer
+
+# Async Query API Configuration (retrieve/async_chain.py)
+ASYNC_QUERY_TIMEOUT = 120  # Seconds before an awaited query is cancelled
+ASYNC_MAX_CONCURRENCY = 4  # Queries answered at once on one event loop; the others wait for a slot
+
+# Batch Query Configuration (python3 main.py --batch questions.jsonl)
+BATCH_SIZE = 32  # Queries embedded and searched together
+BATCH_CONCURRENCY = 4  # Answers generated at once; Ollama needs OLLAMA_NUM_PARALLEL >= this to run them in parallel
+
+# Instrumentation Configuration
+TRACE_FILE = None  # e.g. "./traces/trace.jsonl" appends the duration of every stage and query phase as a JSON line
+METRICS_PORT = None  # e.g. 9108 serves Prometheus metrics on SERVER_HOST:9108/metrics while answering queries
+METRICS_WINDOW = 10_000  # Latest durations kept per span for p50/p95/p99
 
 # Chunking Configuration (if you want to centralize all config)
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
-CHUNKS_PATTERN = "./chunked/chunked_*.json"
+CHUNKS_PATTERN = "./chunked/chunked_*.jsonl"
+CHUNK_WORKERS = 1  # Chunking processes; --workers N overrides it together with PDF_WORKERS
 
 SYSTEM_PROMPT = (
     "You are an assistant for question-answering tasks. "
@@ -1,30 +1,217 @@
-from langchain_chroma import Chroma
-from config import (CHUNKS_PATTERN, PERSIST_DIR, COLLECTION_NAME, EMBEDDING_MODEL)
-from utils.log_utils import log_embedding_summary
-from utils.embed_utils import load_chunk_files, initialize_ollama_embeddings
-
-def embed_chunks_to_db():
-
-    # 1.Load documents from multiple chunk files
-    documents = load_chunk_files(CHUNKS_PATTERN)
-
-    # 2. Add nomic-embed-text prefixes for documents
-    print("Adding search_document prefixes for nomic-embed-text model...")
-    for doc in documents:
-        doc.page_content = f"search_document: {doc.page_content}"
-
-    # 3. Initialize Ollama Embeddings
-    embeddings = initialize_ollama_embeddings(model_name=EMBEDDING_MODEL)
-
-    # 4. Create and persist the local Chroma DB with batch processing
-    print("Creating vector database...")
-    vector_db = Chroma.from_documents(
-        documents=documents,
-        embedding=embeddings,
-        persist_directory=PERSIST_DIR,
-        collection_name=COLLECTION_NAME
-    )
-
-    # 5. Display summary by source file
-    log_embedding_summary(documents)
-    
+import sys
+import time
+import itertools
+from typing import Iterable
+from config import (CHUNKS_PATTERN, PERSIST_DIR, COLLECTION_NAME, EMBEDDING_MODEL, EMBED_MANIFEST_FILE,
+                    EMBED_REVISION_FILE, EMBED_BATCH_SIZE, EMBED_CONCURRENCY, BM25_INDEX_DIR, DEDUP_ENABLED,
+                    DEDUP_INDEX_FILE, VECTOR_STORE, PARTITION_BY, PARTITION_INDEX_FILE)
+from utils.log_utils import (log_embedding_summary, log_incremental_embedding_summary, log_embedding_cache_stats,
+                             log_embedding_throughput, log_dedup_summary)
+from utils.embed_utils import (iter_new_chunks, add_search_document_prefix, initialize_ollama_embeddings,
+                               new_embed_manifest, load_embed_manifest, save_embed_manifest, is_manifest_compatible,
+                               find_stale_ids, group_stored_ids_by_source, bump_collection_revision,
+                               run_embedding_pipeline)
+from utils.bm25_index import Bm25IndexWriter
+from utils.chunk_store import ChunkStore, parse_chunk_id
+from utils.partition_store import PartitionIndex, PartitionedCollection
+from utils.dedup_utils import (ChunkDeduplicator, live_chunk_ids, release_orphaned_duplicates,
+                               duplicate_sources_metadata)
+
+# Chroma rejects deletes above its max batch size, so delete in slices
+WRITE_BATCH_SIZE = 1000
+MANIFEST_SAVE_INTERVAL = 5.0  # Seconds between manifest checkpoints while embedding
+
+
+def matches_config(manifest: dict | None, index: PartitionIndex | None) -> bool:
+    """Check that stored vectors come from the configured model and collection and are partitioned by PARTITION_BY"""
+    return (is_manifest_compatible(manifest, EMBEDDING_MODEL, COLLECTION_NAME)
+            and (index.partition_by if index is not None else None) == PARTITION_BY)
+
+
+def embed_config_changed() -> bool:
+    """Check whether the vector DB has to be rebuilt for the current configuration"""
+    return not matches_config(load_embed_manifest(EMBED_MANIFEST_FILE), PartitionIndex.load(PARTITION_INDEX_FILE))
+
+
+def embed_chunks_to_db(full_rebuild: bool = False, chunk_files: Iterable[str] = None,
+                       pending_files: set[str] = frozenset()) -> dict[str, list[str]]:
+    """Embed new or changed chunks; returns the stored chunk IDs grouped by source.
+
+    chunk_files may be a stream of chunk files that the chunking stage is still
+    writing (every chunk file on disk by default); pending_files are the names
+    of chunk files on disk that it is about to rewrite.
+    """
+
+    # 1. Decide between incremental update and full rebuild
+    #    (chunks are stored in the collection of their partition; changing PARTITION_BY moves every chunk)
+    manifest = load_embed_manifest(EMBED_MANIFEST_FILE)
+    index = PartitionIndex.load(PARTITION_INDEX_FILE)
+    if not matches_config(manifest, index):
+        full_rebuild = True
+    vector_db = PartitionedCollection(PERSIST_DIR, index or PartitionIndex(PARTITION_BY))
+    index = vector_db.index
+
+    if full_rebuild:
+        print("Rebuilding vector database from scratch...")
+        manifest = new_embed_manifest(EMBEDDING_MODEL, COLLECTION_NAME)
+        vector_db.reset()
+        index.partition_by = PARTITION_BY
+        save_embed_manifest(manifest, EMBED_MANIFEST_FILE)
+        index.save(PARTITION_INDEX_FILE)
+
+    # 2. Read chunk IDs from the chunk store indexes, update the BM25 index and
+    #    stream only chunks that are not stored yet, dropping duplicates of kept chunks
+    store = ChunkStore(CHUNKS_PATTERN)
+    manifest.setdefault("duplicates", {})  # Manifests written before deduplication
+    deduplicator, released_count = None, 0
+    if DEDUP_ENABLED:
+        # Stored chunks about to be deleted as stale must not count as originals,
+        # or a re-chunked file would be dropped as a copy of its old chunks
+        live_ids = live_chunk_ids(store, manifest["chunks"], pending_files)
+        released_count = release_orphaned_duplicates(manifest["duplicates"], live_ids)
+        # Chunks of a rewritten file count again once it turns out to still have them
+        deduplicator = ChunkDeduplicator.load(DEDUP_INDEX_FILE,
+                                              [chunk_id for chunk_id in manifest["chunks"] if chunk_id in live_ids],
+                                              [chunk_id for chunk_id, source_file in manifest["chunks"].items()
+                                               if source_file in pending_files])
+    else:
+        # Duplicates skipped while deduplication was enabled are embedded now
+        manifest["duplicates"] = {}
+
+    seen_ids, failed_files, source_summary = {}, set(), {}
+    # Chunks dropped as duplicates are as good as stored: their text is already in the BM25 segment
+    bm25_writer = Bm25IndexWriter(BM25_INDEX_DIR, {**manifest["chunks"], **manifest["duplicates"]},
+                                  rebuild=full_rebuild)
+
+    def on_file(source_file, chunk_ids, load_documents):
+        if deduplicator is not None and source_file in pending_files:
+            deduplicator.keep_held(chunk_ids)
+        bm25_writer.update_file(source_file, chunk_ids, load_documents)
+
+    new_documents = iter_new_chunks(store, manifest, seen_ids, failed_files, source_summary, on_file=on_file,
+                                    chunk_files=chunk_files)
+    if deduplicator is not None:
+        new_documents = deduplicator.filter(new_documents)
+
+    def save_progress():
+        if deduplicator is not None:
+            manifest["duplicates"].update(deduplicator.found_duplicates())
+            deduplicator.save(DEDUP_INDEX_FILE)
+        save_embed_manifest(manifest, EMBED_MANIFEST_FILE)
+        index.save(PARTITION_INDEX_FILE)
+
+    # 3. Initialize Ollama Embeddings only if there is something to embed
+    first_new_document = next(new_documents, None)
+    embeddings = None
+    embedded_count = failed_count = 0
+
+    if first_new_document is not None:
+        embeddings = initialize_ollama_embeddings(model_name=EMBEDDING_MODEL)
+
+        # 4. Add nomic-embed-text prefixes lazily and embed new or changed chunks
+        print(f"Embedding new or changed chunks "
+              f"(batch size {EMBED_BATCH_SIZE}, {EMBED_CONCURRENCY} concurrent requests)...")
+        new_documents = add_search_document_prefix(itertools.chain([first_new_document], new_documents))
+
+        last_saved = time.monotonic()
+
+        def record_batch(batch):
+            # Record progress so an interrupted run resumes where it stopped
+            nonlocal last_saved
+            for doc in batch:
+                manifest["chunks"][doc.metadata["chunk_id"]] = doc.metadata["source_file"]
+            if time.monotonic() - last_saved > MANIFEST_SAVE_INTERVAL:
+                save_progress()
+                last_saved = time.monotonic()
+
+        start_time = time.perf_counter()
+        embedded_count, failed_count = run_embedding_pipeline(
+            new_documents, embeddings, vector_db, on_batch_written=record_batch
+        )
+        elapsed = time.perf_counter() - start_time
+    save_progress()
+
+    # 5. Delete chunks whose source content changed or disappeared
+    stale_ids = find_stale_ids(manifest, seen_ids, failed_files)
+    if stale_ids:
+        print(f"Deleting {len(stale_ids)} stale chunks...")
+        for start in range(0, len(stale_ids), WRITE_BATCH_SIZE):
+            vector_db.delete(ids=stale_ids[start:start + WRITE_BATCH_SIZE])
+        for chunk_id in stale_ids:
+            del manifest["chunks"][chunk_id]
+        if deduplicator is not None:
+            deduplicator.remove(stale_ids)
+        save_progress()
+
+    # 6. Forget duplicates that disappeared and record on every kept chunk whose
+    #    duplicates changed the sources those duplicates came from
+    gone_ids = [chunk_id for chunk_id in manifest["duplicates"]
+                if chunk_id not in seen_ids and parse_chunk_id(chunk_id)[0] not in failed_files]
+    changed_kept_ids = {manifest["duplicates"].pop(chunk_id) for chunk_id in gone_ids}
+    if deduplicator is not None:
+        changed_kept_ids.update(deduplicator.duplicates.values())
+    changed_kept_ids = [chunk_id for chunk_id in changed_kept_ids if chunk_id in manifest["chunks"]]
+    if changed_kept_ids:
+        updates = duplicate_sources_metadata(manifest["duplicates"], seen_ids, changed_kept_ids)
+        for start in range(0, len(changed_kept_ids), WRITE_BATCH_SIZE):
+            batch_ids = changed_kept_ids[start:start + WRITE_BATCH_SIZE]
+            vector_db.update(ids=batch_ids, metadatas=[updates[chunk_id] for chunk_id in batch_ids])
+    if gone_ids:
+        save_progress()
+
+    # 7. Record chunk files embedded before the partition index existed and the kept
+    #    chunks the duplicates of each chunk file stand for, forget chunk files with
+    #    neither stored chunks nor kept duplicates and drop partitions left empty
+    stored_files = {}
+    for chunk_id, source_file in manifest["chunks"].items():
+        stored_files.setdefault(source_file, chunk_id)
+    for source_file, chunk_id in stored_files.items():
+        if source_file not in index.files:
+            for doc in store.get([chunk_id]):
+                index.add_file(doc.metadata)
+    kept_ids = {}
+    for chunk_id, kept_id in manifest["duplicates"].items():
+        if kept_id in manifest["chunks"]:
+            kept_ids.setdefault(parse_chunk_id(chunk_id)[0], (chunk_id, set()))[1].add(kept_id)
+    index.clear_duplicates()
+    for source_file, (chunk_id, chunk_kept_ids) in kept_ids.items():
+        if source_file in index.files:
+            index.add_duplicates({"source_file": source_file}, chunk_kept_ids)
+        else:
+            for doc in store.get([chunk_id]):
+                index.add_duplicates(doc.metadata, chunk_kept_ids)
+    empty_collections = index.remove_files([source_file for source_file, entry in index.files.items()
+                                            if source_file not in stored_files and "kept_ids" not in entry])
+    vector_db.drop(empty_collections)
+    save_progress()
+
+    bm25_writer.finish(failed_files)
+    if bm25_writer.updated:
+        print(f"✓ BM25 index updated ({bm25_writer.updated} chunk files changed)")
+
+    # 8. Invalidate cached answers if the collection changed
+    if full_rebuild or embedded_count or stale_ids:
+        bump_collection_revision(EMBED_REVISION_FILE)
+
+    # 9. Re-export the memmap stores of partitions that changed since their export, if retrieval reads from them
+    if VECTOR_STORE == "memmap":
+        from embed.export_memmap import export_partitions
+        export_partitions(index)
+
+    # 10. Display summary by source file
+    duplicate_count = sum(1 for chunk_id in manifest["duplicates"] if chunk_id in seen_ids)
+    unchanged_count = len(seen_ids) - embedded_count - failed_count - duplicate_count
+    log_incremental_embedding_summary(embedded_count, len(stale_ids), unchanged_count, failed_count,
+                                      duplicate_count)
+    if deduplicator is not None:
+        log_dedup_summary(deduplicator.exact, deduplicator.near, released_count)
+    log_embedding_summary(source_summary, embedded_count)
+    if first_new_document is not None:
+        log_embedding_throughput(embedded_count, elapsed)
+    log_embedding_cache_stats(embeddings)
+
+    return group_stored_ids_by_source(manifest, seen_ids)
+
+
+if __name__ == "__main__":
+    embed_chunks_to_db(full_rebuild="--full-rebuild" in sys.argv[1:])
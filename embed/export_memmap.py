@@ -0,0 +1,101 @@
+import os
+import shutil
+import argparse
+import time
+
+import numpy as np
+from config import (PERSIST_DIR, COLLECTION_NAME, EMBEDDING_MODEL, EMBED_REVISION_FILE, MEMMAP_STORE_DIR,
+                    MEMMAP_DTYPE, MEMMAP_IVF_MIN_VECTORS, PARTITION_INDEX_FILE)
+from utils.embed_utils import read_collection_revision
+from utils.memmap_store import MemmapStoreWriter, STORAGE_DTYPES, STORE_FORMAT, read_store_meta
+from utils.partition_store import PartitionIndex, partition_store_dir, is_own_collection
+
+EXPORT_PAGE_SIZE = 5000  # Vectors read from Chroma per request
+
+
+def export_collection(store_dir: str = MEMMAP_STORE_DIR, dtype: str = MEMMAP_DTYPE, ivf: bool = None,
+                      collection_name: str = COLLECTION_NAME, revision: str = None) -> dict:
+    """Copy every vector, document and metadata of a Chroma collection into a memmap store; returns its metadata.
+
+    ivf=None builds the IVF index only for collections of at least
+    MEMMAP_IVF_MIN_VECTORS vectors. revision defaults to the revision of
+    the whole vector DB.
+    """
+    import chromadb
+    collection = chromadb.PersistentClient(path=PERSIST_DIR).get_collection(collection_name)
+    count = collection.count()
+    if not count:
+        raise ValueError(f"Collection {collection_name} is empty, run the embed step first")
+    if ivf is None:
+        ivf = count >= MEMMAP_IVF_MIN_VECTORS
+
+    print(f"Exporting {count:,} vectors from {collection_name} to {store_dir} as {dtype}"
+          f"{' with an IVF index' if ivf else ''}...")
+    start_time = time.perf_counter()
+    # Read the revision first: if the collection changes during the export, the store is seen as stale
+    if revision is None:
+        revision = read_collection_revision(EMBED_REVISION_FILE)
+
+    def read_page(offset):
+        page = collection.get(include=["embeddings", "documents", "metadatas"], limit=EXPORT_PAGE_SIZE,
+                              offset=offset)
+        return page, np.asarray(page["embeddings"], dtype=np.float32)
+
+    page, embeddings = read_page(0)
+    with MemmapStoreWriter(store_dir, count, embeddings.shape[1], dtype) as writer:
+        for offset in range(0, count, EXPORT_PAGE_SIZE):
+            if offset:
+                page, embeddings = read_page(offset)
+            writer.append(page["ids"], embeddings, page["documents"], page["metadatas"])
+            print(f"\r  {writer.written:,}/{count:,} vectors", end="", flush=True)
+        print()
+        meta = writer.finish(ivf, embedding_model=EMBEDDING_MODEL, collection_name=collection_name,
+                             revision=revision)
+    size_mb = meta["count"] * meta["dimension"] * np.dtype(STORAGE_DTYPES[dtype]).itemsize / (1024 * 1024)
+    print(f"✓ Exported {meta['count']:,} vectors ({size_mb:,.1f}MB of {dtype}"
+          f"{', ' + str(meta['ivf_lists']) + ' IVF lists' if meta['ivf_lists'] else ''}) "
+          f"in {time.perf_counter() - start_time:.1f}s")
+    return meta
+
+
+def export_partitions(index: PartitionIndex, dtype: str = MEMMAP_DTYPE, ivf: bool = None,
+                      root_dir: str = MEMMAP_STORE_DIR, only_stale: bool = True) -> int:
+    """Export the collections of the partition index (only those changed since their last export if only_stale).
+
+    Exports of partitions that no longer exist are deleted. Returns the
+    number of collections exported.
+    """
+    exported = 0
+    for name, revision in index.collections.items():
+        store_dir = partition_store_dir(name, root_dir)
+        meta = read_store_meta(store_dir)
+        if only_stale and meta is not None and meta["format"] == STORE_FORMAT and meta.get("revision") == revision:
+            continue
+        export_collection(store_dir, dtype, ivf, collection_name=name, revision=revision)
+        exported += 1
+
+    if os.path.isdir(root_dir):
+        for name in os.listdir(root_dir):
+            if is_own_collection(name) and name not in index.collections:
+                shutil.rmtree(os.path.join(root_dir, name), ignore_errors=True)
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the Chroma collection to a quantized memmap vector store")
+    parser.add_argument("--output", default=MEMMAP_STORE_DIR, help="store directory")
+    parser.add_argument("--dtype", default=MEMMAP_DTYPE, choices=list(STORAGE_DTYPES))
+    parser.add_argument("--ivf", action=argparse.BooleanOptionalAction, default=None,
+                        help=f"build an IVF index (default: only for {MEMMAP_IVF_MIN_VECTORS:,}+ vectors)")
+    args = parser.parse_args()
+
+    index = PartitionIndex.load(PARTITION_INDEX_FILE)
+    if index is None:
+        # Vector DBs embedded before the partition index existed
+        export_collection(args.output, args.dtype, args.ivf)
+    else:
+        export_partitions(index, args.dtype, args.ivf, args.output, only_stale=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,100 +1,263 @@
 import os
 import sys
+import glob
+import argparse
+import itertools
+import threading
+from contextlib import ExitStack
 from pathlib import Path
-from source_to_text.pdf_to_text import extract_text_from_pdfs
-from source_to_text.video_to_text import extract_text_from_videos
-from chunking.recursive_chunker import chunk_recursive
-from embed.embed import embed_chunks_to_db
-from retrieve.retrieve import retrieve
-from utils.log_utils import print_header, print_usage
-from config import (PDF_PATTERN, VIDEO_PATTERN, CHUNKED_DIR, VIDEO_TRANSCRIPT_DIR, PERSIST_DIR)
-
-
-def run_full_pipeline(query: str = None):
-    """Run the complete pipeline for first-time setup"""
-    print_header("FIRST RUN DETECTED - Running Full Pipeline")
-    
-    # 1: Extract PDFs to Text
-    pdf_to_text()
-    
-    # 2: Extract text from videos  
-    video_to_text()
-    
-    # 3: Chunk video transcripts
-    chunk_video_transcripts()
-    
-    # 4: Embed chunks to DB
-    embed()
-    
-    # 5: Test retrieval
-    retrieve_query(query)
-    
-    
-def run_retrieval_only(query: str = None):
-    """Run only retrieval for subsequent runs"""
-    retrieve_query(query)
+from utils.log_utils import print_header, print_usage, log_processing_file, log_stage_utilization
+from utils.filter_utils import parse_filter_args
+from utils.ingest_utils import (load_ingest_manifest, save_ingest_manifest, plan_ingestion, has_changes, record_source,
+                                remove_source_outputs, adopt_existing_outputs, remove_legacy_chunk_files,
+                                segments_path_for, chunking_input_for, chunks_path_for, pdf_json_path_for,
+                                transcript_path_for)
+from config import (PDF_PATTERN, VIDEO_PATTERN, CHUNKED_DIR, PDF_PAGES_DIR, VIDEO_TRANSCRIPT_DIR, PERSIST_DIR,
+                    PDF_WORKERS, CHUNK_WORKERS, TRANSCRIBE_WORKERS, CHUNKS_PATTERN, INGEST_MANIFEST_FILE,
+                    STREAM_ANSWERS, RETRIEVER_FILTER)
 
-def pdf_to_text():
-    print("\tLoading and extracting text from PDF...")
-    
-    print_header("Starting PDF to Text conversion...")
-    successful, failed = extract_text_from_pdfs(PDF_PATTERN, CHUNKED_DIR)
-    
-    print(f"\nPDF to Text conversion completed!")
-    print(f"Successfully converted: {len(successful)} files")
-    print(f"Failed conversions: {len(failed)} files")
-    
-    return successful, failed
 
-def video_to_text():
-    """Extract text from multiple videos"""
-    print_header("Starting transcribing Video to Text...")
-    extract_text_from_videos(VIDEO_PATTERN, VIDEO_TRANSCRIPT_DIR)
+def run_pipeline(query: str = None, workers: int = None, serve: bool = False, stream: bool = STREAM_ANSWERS,
+                 batch_file: str = None, output_file: str = None, metadata_filter: dict = RETRIEVER_FILTER):
+    """Process new or modified sources (all of them on the first run), then retrieve, serve or answer a batch"""
+    manifest = load_ingest_manifest(INGEST_MANIFEST_FILE)
+    plan = plan_ingestion(manifest, PDF_PATTERN, VIDEO_PATTERN)
+
+    # Outputs from a run before the manifest existed are reused instead of reprocessed, except
+    # chunk files in the old format, which are re-chunked from the adopted pages and transcripts
+    if not manifest["sources"]:
+        remove_legacy_chunk_files(CHUNKED_DIR)
+        if adopt_existing_outputs(manifest, plan, VIDEO_TRANSCRIPT_DIR, PDF_PAGES_DIR):
+            save_ingest_manifest(manifest, INGEST_MANIFEST_FILE)
+
+    if has_changes(plan) or not embed_db_exists() or embed_config_changed():
+        run_ingestion(manifest, plan, workers)
+    elif plan["touched"]:
+        save_ingest_manifest(manifest, INGEST_MANIFEST_FILE)
+
+    if serve:
+        serve_queries(metadata_filter)
+    elif batch_file:
+        batch_queries(batch_file, output_file, metadata_filter)
+    else:
+        retrieve_query(query, stream=stream, metadata_filter=metadata_filter)
+
+
+def run_ingestion(manifest: dict, plan: dict, workers: int = None):
+    """Run only the stages needed for new, modified or removed sources.
+
+    Each source moves on to its next stage as soon as the previous one is
+    done with it, so chunks of extracted PDFs are embedded while videos are
+    still being transcribed.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from utils.stage_scheduler import StagePipeline
+    from source_to_text.pdf_to_text import extract_pdf_in_pool
+    from source_to_text.video_to_text import transcribe_video_in_pool, init_transcription_worker
+    from chunking.recursive_chunker import chunk_file
+
+    if is_first_run():
+        print_header("FIRST RUN DETECTED - Running Full Pipeline")
+    elif not has_changes(plan):
+        print_header("EMBEDDING SETTINGS CHANGED - Rebuilding the vector DB from the existing chunks")
+    else:
+        print_header(f"SOURCE CHANGES DETECTED - {len(plan['pdfs'])} PDFs and {len(plan['videos'])} videos "
+                     f"to process, {len(plan['chunk'])} to re-chunk, {len(plan['removed'])} sources removed")
+
+    for source in plan["removed"]:
+        remove_source_outputs(manifest, source)
+
+    # Chunk files of the sources processed now are rewritten; every other chunk file is embedded right away
+    previous_chunks = {source: entry["outputs"].get("chunks") for source, entry in manifest["sources"].items()}
+    expected_chunks = {source: chunks_path_for(pdf_json_path_for(source, PDF_PAGES_DIR), CHUNKED_DIR)
+                       for source in plan["pdfs"]}
+    expected_chunks.update({source: chunks_path_for(transcript_path_for(source, VIDEO_TRANSCRIPT_DIR), CHUNKED_DIR)
+                            for source in plan["videos"]})
+    expected_chunks.update({source: chunks_path_for(chunking_input_for(manifest["sources"][source]), CHUNKED_DIR)
+                            for source in plan["chunk"]})
+    pending_files = {Path(path).name for source, path in expected_chunks.items()
+                     for path in (path, previous_chunks.get(source)) if path}
+    ready_files = [path for path in sorted(glob.glob(CHUNKS_PATTERN)) if Path(path).name not in pending_files]
+
+    manifest_lock = threading.Lock()
+    pools = {}
+
+    def record(source: str, fingerprint: dict, outputs: dict):
+        with manifest_lock:
+            record_source(manifest, source, fingerprint, outputs)
 
-def chunk_video_transcripts():
-    """Chunk video transcripts using recursive chunker"""
-    print_header("Starting chunking of video transcripts...")
-    chunk_recursive(input_dir=VIDEO_TRANSCRIPT_DIR, output_dir=CHUNKED_DIR)
+    def keep_previous_chunks(source: str, emit):
+        # A source that failed a stage keeps the chunks it had, as its manifest entry keeps the old fingerprint
+        chunks_path = previous_chunks.get(source)
+        if chunks_path and os.path.exists(chunks_path):
+            emit("embed", chunks_path)
 
-def embed():
-    """Embed chunks to vector DB"""
-    print_header("Starting embedding chunks to vector DB...")
-    embed_chunks_to_db()
+    def extract_pdf(pdf_file: str, emit):
+        output_path, _ = extract_pdf_in_pool(pools["pdf_to_text"], pdf_file, PDF_PAGES_DIR)
+        if output_path is None:
+            keep_previous_chunks(pdf_file, emit)
+            return
+        record(pdf_file, plan["fingerprints"][pdf_file], {"json": output_path})
+        emit("chunk", pdf_file)
 
-def retrieve_query(query: str = None):
+    def transcribe_video(video_file: str, emit):
+        log_processing_file(video_file)
+        try:
+            transcript_path = transcribe_video_in_pool(pools["video_to_text"], video_file, VIDEO_TRANSCRIPT_DIR)
+        except Exception as e:
+            print(f"✗ Error processing {video_file}: {str(e)}")
+            keep_previous_chunks(video_file, emit)
+            return
+        record(video_file, plan["fingerprints"][video_file],
+               {"transcript": transcript_path, "segments": segments_path_for(transcript_path)})
+        emit("chunk", video_file)
+
+    def chunk(source: str, emit):
+        input_path = chunking_input_for(manifest["sources"][source])
+        try:
+            chunks_path, chunk_count = pools["chunk"].submit(chunk_file, input_path, CHUNKED_DIR).result()
+        except Exception as e:
+            print(f"  ❌ Error chunking {Path(input_path).name}: {e}")
+            keep_previous_chunks(source, emit)
+            return
+        print(f"  ✓ {Path(input_path).name} -> {Path(chunks_path).name} ({chunk_count} chunks)")
+        record(source, manifest["sources"][source]["fingerprint"], {"chunks": chunks_path})
+        emit("embed", chunks_path)
+
+    def embed(chunk_files):
+        from embed.embed import embed_chunks_to_db
+
+        print_header("Starting embedding chunks to vector DB...")
+        return embed_chunks_to_db(chunk_files=itertools.chain(ready_files, chunk_files), pending_files=pending_files)
+
+    pipeline = StagePipeline()
+    pipeline.add_stage("pdf_to_text", extract_pdf, workers or PDF_WORKERS, downstream=("chunk", "embed"))
+    pipeline.add_stage("video_to_text", transcribe_video, TRANSCRIBE_WORKERS, downstream=("chunk", "embed"))
+    pipeline.add_stage("chunk", chunk, workers or CHUNK_WORKERS, downstream=("embed",))
+    pipeline.add_sink("embed", embed)
+    for stage, sources in (("pdf_to_text", plan["pdfs"]), ("video_to_text", plan["videos"]), ("chunk", plan["chunk"])):
+        for source in sources:
+            pipeline.put(stage, source)
+
+    # Worker processes are started while other stages run threads, which fork() does not copy safely
+    context = multiprocessing.get_context("spawn")
+    Path(CHUNKED_DIR).mkdir(exist_ok=True)
+    with ExitStack() as stack:
+        if plan["pdfs"]:
+            pools["pdf_to_text"] = stack.enter_context(
+                ProcessPoolExecutor(max_workers=workers or PDF_WORKERS, mp_context=context))
+        if plan["videos"]:
+            torch_threads = max(1, (os.cpu_count() or 1) // TRANSCRIBE_WORKERS)
+            pools["video_to_text"] = stack.enter_context(
+                ProcessPoolExecutor(max_workers=TRANSCRIBE_WORKERS, mp_context=context,
+                                    initializer=init_transcription_worker, initargs=(torch_threads,)))
+        if plan["pdfs"] or plan["videos"] or plan["chunk"]:
+            pools["chunk"] = stack.enter_context(
+                ProcessPoolExecutor(max_workers=workers or CHUNK_WORKERS, mp_context=context))
+        ids_by_source = pipeline.run()
+    log_stage_utilization(pipeline.utilization(), pipeline.wall)
+
+    for source, entry in manifest["sources"].items():
+        if "transcript" in entry["outputs"]:
+            source_key = Path(entry["outputs"]["transcript"]).name
+        else:
+            source_key = source
+        entry["outputs"]["vector_ids"] = ids_by_source.get(source_key, [])
+
+    save_ingest_manifest(manifest, INGEST_MANIFEST_FILE)
+
+
+# Stage and query modules are imported inside the functions that use them, so a retrieval-only
+# run never loads pypdf or Whisper/torch and --help returns before any of them is imported
+
+def retrieve_query(query: str = None, stream: bool = STREAM_ANSWERS, metadata_filter: dict = RETRIEVER_FILTER):
     """Retrieve from embedded DB"""
+    from retrieve.retrieve import retrieve
+
     print_header("Starting retrieval from embedded DB...")
     
     if query:
-        retrieve(query)
+        retrieve(query, stream=stream, metadata_filter=metadata_filter)
     else:
         # Use default query or prompt user
         print("No query provided. Using interactive mode...")
-        retrieve()
+        retrieve(stream=stream, metadata_filter=metadata_filter)
+
+def serve_queries(metadata_filter: dict = RETRIEVER_FILTER):
+    """Keep the RAG chain warm in a local HTTP server"""
+    from retrieve.server import run_server
+
+    run_server(metadata_filter=metadata_filter)
+
+def batch_queries(input_path: str, output_path: str = None, metadata_filter: dict = RETRIEVER_FILTER):
+    """Answer every query in a JSONL/CSV file"""
+    from retrieve.batch import run_batch
+
+    run_batch(input_path, output_path, metadata_filter=metadata_filter)
+
+def query_server(query: str = None):
+    """Answer queries through a running retrieval server"""
+    from retrieve.client import query_remote
+
+    query_remote(query)
+
+def embed_db_exists():
+    """Check whether the vector DB has been created"""
+    return os.path.exists(PERSIST_DIR) and bool(os.listdir(PERSIST_DIR))
+
+def embed_config_changed():
+    """Check whether the vector DB was embedded with another model, collection or PARTITION_BY"""
+    from embed.embed import embed_config_changed as config_changed
+
+    return config_changed()
 
 def is_first_run():
     """Check if this is the first run by looking for embed DB and processed files"""
-    embed_db_exists = os.path.exists(PERSIST_DIR) and os.listdir(PERSIST_DIR)
-    chunked_files_exist = os.path.exists(CHUNKED_DIR) and any(Path(CHUNKED_DIR).glob("chunked_*.json"))
+    chunked_files_exist = os.path.exists(CHUNKED_DIR) and any(Path(CHUNKED_DIR).glob(Path(CHUNKS_PATTERN).name))
     
-    return not (embed_db_exists and chunked_files_exist)
+    return not (embed_db_exists() and chunked_files_exist)
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    """Parse command line options; remaining words form the query"""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-h", "--help", action="store_true")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--serve", action="store_true")
+    parser.add_argument("--remote", action="store_true")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", default=STREAM_ANSWERS)
+    parser.add_argument("--batch", default=None)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--filter", action="append", default=None)
+    parser.add_argument("query", nargs="*")
+    return parser.parse_intermixed_args(argv)
 
-def get_query_from_args():
+def get_query_from_args(args: argparse.Namespace):
     """Get query from command line arguments"""
-    if len(sys.argv) > 1:
-        return " ".join(sys.argv[1:])
+    if args.query:
+        return " ".join(args.query)
     return None
 
 
 if __name__ == "__main__":
     
-    query = get_query_from_args()
+    args = parse_args()
+    query = get_query_from_args(args)
     
-    if len(sys.argv) > 1 and sys.argv[1] in ["-h", "--help"]:
+    if args.help:
         print_usage()
         sys.exit(0)
     
-    if is_first_run():
-        run_full_pipeline(query)
+    try:
+        metadata_filter = parse_filter_args(args.filter) if args.filter else RETRIEVER_FILTER
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+
+    if args.remote:
+        if args.filter:
+            print("Warning: --filter is ignored with --remote, start the server with --serve --filter instead")
+        query_server(query)
     else:
-        run_retrieval_only(query)
+        run_pipeline(query, workers=args.workers, serve=args.serve, stream=args.stream,
+                     batch_file=args.batch, output_file=args.output, metadata_filter=metadata_filter)
@@ -0,0 +1,67 @@
+import asyncio
+import time
+from typing import AsyncIterator
+
+from utils.instrumentation import trace
+from config import (ASYNC_QUERY_TIMEOUT, ASYNC_MAX_CONCURRENCY, RETRIEVER_FILTER)
+
+
+class AsyncRAG:
+    """Asyncio front end to the RAG chain, for servers and notebooks sharing one event loop.
+
+    Query embedding, retrieval and the chat model are awaited through their
+    async interfaces (Chroma searches run in worker threads). Every query has
+    a timeout, and cancelling the awaiting task cancels the query.
+
+        rag = await AsyncRAG.create()
+        answers = await asyncio.gather(*(rag.answer(q) for q in questions))
+    """
+
+    def __init__(self, rag_chain, embeddings=None, max_concurrency: int = ASYNC_MAX_CONCURRENCY,
+                 timeout: float = ASYNC_QUERY_TIMEOUT):
+        self.rag_chain = rag_chain
+        self.embeddings = embeddings
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    @classmethod
+    async def create(cls, metadata_filter: dict = RETRIEVER_FILTER, **kwargs) -> "AsyncRAG":
+        """Build the chain in a worker thread, so loading Chroma and the models doesn't block the loop"""
+        from retrieve.retrieve import build_rag_chain
+
+        rag_chain, embeddings = await asyncio.to_thread(build_rag_chain, metadata_filter)
+        return cls(rag_chain, embeddings, **kwargs)
+
+    async def answer(self, query: str, timeout: float = None) -> dict:
+        """Answer a query: {"input", "context", "answer"}; raises TimeoutError after timeout seconds"""
+        return await asyncio.wait_for(self._answer(query), timeout or self.timeout)
+
+    async def _answer(self, query: str) -> dict:
+        async with self._slots:
+            with trace("query", streamed=False, asynchronous=True):
+                return await self.rag_chain.ainvoke({"input": f"search_query: {query}"})
+
+    async def stream(self, query: str, timeout: float = None) -> AsyncIterator[dict]:
+        """Yield {"context": docs} and then {"answer": token} chunks; the timeout covers the whole answer"""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        async with self._slots:
+            with trace("query", streamed=True, asynchronous=True):
+                chunks = self.rag_chain.astream({"input": f"search_query: {query}"}).__aiter__()
+                try:
+                    while True:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError(f"Query timed out: {query}")
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), remaining)
+                        except StopAsyncIteration:
+                            return
+                        yield chunk
+                finally:
+                    await chunks.aclose()
+
+
+async def answer_query(query: str, timeout: float = ASYNC_QUERY_TIMEOUT) -> dict:
+    """One-off awaitable query; build an AsyncRAG once instead when answering many"""
+    rag = await AsyncRAG.create()
+    return await rag.answer(query, timeout)
@@ -0,0 +1,183 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from langchain_core.documents import Document
+from retrieve.retrieve import load_vector_db, build_answer_chain, resolve_retriever_type, resolve_filter
+from utils.batch_utils import default_output_path, read_batch_queries, load_completed_ids, BatchResultWriter
+from utils.context_utils import pack_context
+from utils.mmr_utils import max_marginal_relevance
+from utils.partition_store import query_vector_store
+from utils.instrumentation import trace, record_span, metrics
+from utils.answer_cache import chunk_ids_of
+from utils.log_utils import print_header, format_source, log_batch_summary, log_latency_summary
+from config import (BATCH_SIZE, BATCH_CONCURRENCY, RETRIEVER_K, RETRIEVER_FETCH_K, RETRIEVER_LAMBDA_MULT,
+                    BM25_INDEX_DIR, CHUNKS_PATTERN, HYBRID_VECTOR_WEIGHT, HYBRID_LEXICAL_WEIGHT, HYBRID_RRF_K,
+                    RETRIEVER_FILTER)
+
+
+class BatchRetriever:
+    """Retrieves for many queries at once: one embedding call and one vector store query per batch.
+
+    Candidates are then selected per query the same way the configured
+    retriever does (top k, MMR or BM25 fusion) and packed into the context
+    token budget.
+    """
+
+    def __init__(self, vector_db, embeddings, retriever_type: str, k: int = RETRIEVER_K,
+                 fetch_k: int = RETRIEVER_FETCH_K, lambda_mult: float = RETRIEVER_LAMBDA_MULT,
+                 metadata_filter: dict = None):
+        self.vector_db = vector_db
+        self.embeddings = embeddings
+        self.retriever_type = retriever_type
+        self.k = k
+        self.n_results = k if retriever_type == "similarity" else fetch_k
+        self.lambda_mult = lambda_mult
+        self.metadata_filter = metadata_filter
+
+        if retriever_type == "hybrid":
+            from utils.bm25_index import Bm25Index
+            from utils.chunk_store import ChunkStore
+            self.index = Bm25Index(BM25_INDEX_DIR)
+            self.chunk_store = ChunkStore(CHUNKS_PATTERN)
+            # A normalized filter from resolve_filter, which guarantees the partition index
+            self.source_files = vector_db.index.matching_files(metadata_filter) if metadata_filter else None
+
+    def retrieve(self, queries: list[str]) -> tuple[list[list[Document]], dict]:
+        """Packed context documents for each search_query:-prefixed query, and the batch timings"""
+        start = time.perf_counter()
+        query_embeddings = self.embeddings.embed_documents(queries)
+        embedded = time.perf_counter()
+
+        include = ["documents", "metadatas"] + (["embeddings"] if self.retriever_type == "mmr" else [])
+        results = query_vector_store(self.vector_db, query_embeddings, self.n_results, include, self.metadata_filter)
+        searched = time.perf_counter()
+        record_span("batch.embed", embedded - start, size=len(queries))
+        record_span("batch.vector_search", searched - embedded, size=len(queries))
+
+        contexts = []
+        for position, query in enumerate(queries):
+            documents = self._select(query, query_embeddings[position], results, position)
+            pack_start = time.perf_counter()
+            packed, _ = pack_context(documents, query.removeprefix("search_query:").strip())
+            record_span("query.prompt_assembly", time.perf_counter() - pack_start)
+            contexts.append(packed)
+
+        timings = {"batch_embed_ms": (embedded - start) * 1000, "batch_search_ms": (searched - embedded) * 1000,
+                   "batch_size": len(queries)}
+        return contexts, timings
+
+    def _select(self, query: str, query_embedding: list[float], results: dict, position: int) -> list[Document]:
+        candidates = [
+            Document(id=chunk_id, page_content=content, metadata=metadata or {})
+            for chunk_id, content, metadata in zip(results["ids"][position], results["documents"][position],
+                                                   results["metadatas"][position])
+        ]
+
+        if self.retriever_type == "mmr" and candidates:
+            start = time.perf_counter()
+            selected = max_marginal_relevance(query_embedding, results["embeddings"][position], self.k,
+                                              self.lambda_mult)
+            record_span("query.mmr", time.perf_counter() - start)
+            return [candidates[index] for index in selected]
+
+        if self.retriever_type == "hybrid":
+            from retrieve.hybrid_retriever import reciprocal_rank_fusion
+            start = time.perf_counter()
+            lexical_ids = [chunk_id for chunk_id, _ in
+                           self.index.search(query.removeprefix("search_query:"), self.n_results, self.source_files)]
+            record_span("query.lexical_search", time.perf_counter() - start)
+
+            docs_by_id = {doc.id: doc for doc in candidates}
+            fused_ids = reciprocal_rank_fusion([[doc.id for doc in candidates], lexical_ids],
+                                               [HYBRID_VECTOR_WEIGHT, HYBRID_LEXICAL_WEIGHT], HYBRID_RRF_K)[:self.k]
+            missing_ids = [chunk_id for chunk_id in fused_ids if chunk_id not in docs_by_id]
+            if missing_ids:
+                docs_by_id.update((doc.id, doc) for doc in self.chunk_store.get(missing_ids))
+            return [docs_by_id[chunk_id] for chunk_id in fused_ids if chunk_id in docs_by_id]
+
+        return candidates[:self.k]
+
+
+def answer_query(answer_chain, record: dict, context: list[Document], timings: dict) -> dict:
+    """Generate the answer for one retrieved query; errors are returned in the result, not raised"""
+    result = {**record, "chunk_ids": chunk_ids_of(context), "sources": [format_source(doc) for doc in context]}
+    start = time.perf_counter()
+    try:
+        with trace("query", batch=True):
+            result["answer"] = answer_chain.invoke({"input": f"search_query: {record['query']}", "context": context})
+    except Exception as e:
+        result["error"] = str(e)
+    result["timings_ms"] = {**timings, "generate_ms": (time.perf_counter() - start) * 1000}
+    return result
+
+
+def run_batch(input_path: str, output_path: str = None, batch_size: int = BATCH_SIZE,
+              concurrency: int = BATCH_CONCURRENCY, metadata_filter: dict = RETRIEVER_FILTER) -> dict:
+    """Answer every query in a JSONL/CSV file, appending results to a JSONL file.
+
+    Queries already answered in output_path are skipped, so rerunning the
+    same command resumes an interrupted run. Returns the result counters.
+    """
+    output_path = output_path or default_output_path(input_path)
+    queries = read_batch_queries(input_path)
+    completed = load_completed_ids(output_path)
+    pending = [record for record in queries if record["id"] not in completed]
+    counts = {"answered": 0, "failed": 0, "skipped": len(queries) - len(pending)}
+
+    print_header(f"BATCH QUERIES - {len(pending)} to answer, {counts['skipped']} already in {output_path}")
+    if not pending:
+        return counts
+
+    vector_db, embeddings = load_vector_db()
+    retriever = BatchRetriever(vector_db, embeddings, resolve_retriever_type(),
+                               metadata_filter=resolve_filter(vector_db, metadata_filter))
+    answer_chain = build_answer_chain()
+    writer = BatchResultWriter(output_path)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="generate")
+    in_flight = set()
+    start_time = time.perf_counter()
+
+    def write_done(done):
+        for future in done:
+            result = future.result()
+            writer.write(result)
+            counts["failed" if "error" in result else "answered"] += 1
+        finished = counts["answered"] + counts["failed"]
+        print(f"\r  {finished}/{len(pending)} queries answered", end="", flush=True)
+
+    try:
+        for batch_start in range(0, len(pending), batch_size):
+            batch = pending[batch_start:batch_start + batch_size]
+            try:
+                contexts, timings = retriever.retrieve([f"search_query: {record['query']}" for record in batch])
+            except Exception as e:
+                print(f"\n❌ Error retrieving batch of {len(batch)} queries: {e}")
+                for record in batch:
+                    writer.write({**record, "error": f"Retrieval failed: {e}"})
+                counts["failed"] += len(batch)
+                continue
+
+            for record, context in zip(batch, contexts):
+                in_flight.add(executor.submit(answer_query, answer_chain, record, context, timings))
+
+            # The next batch is retrieved while the last generations of this one still run
+            while len(in_flight) > concurrency:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                write_done(done)
+
+        done, in_flight = wait(in_flight)
+        write_done(done)
+        print()
+    except KeyboardInterrupt:
+        print("\nInterrupted, run the same command again to resume")
+        executor.shutdown(wait=True, cancel_futures=True)
+        # Keep the answers that finished while shutting down
+        write_done([future for future in in_flight if future.done() and not future.cancelled()])
+        print()
+    finally:
+        executor.shutdown(wait=True)
+        writer.close()
+
+    log_batch_summary(counts, time.perf_counter() - start_time, output_path)
+    log_latency_summary(metrics.summary())
+    return counts
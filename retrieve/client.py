@@ -0,0 +1,56 @@
+import json
+import urllib.error
+import urllib.request
+from config import (SERVER_HOST, SERVER_PORT, SERVER_REQUEST_TIMEOUT)
+from utils.retrieve_utils import execute_query, run_interactive_mode
+
+
+class RemoteRAGChain:
+    """Stand-in for rag_chain that forwards invoke() calls to the retrieval server"""
+
+    def __init__(self, host: str = SERVER_HOST, port: int = SERVER_PORT, timeout: float = SERVER_REQUEST_TIMEOUT):
+        self.base_url = f"http://{host}:{port}"
+        self.timeout = timeout
+
+    def invoke(self, inputs: dict) -> dict:
+        request = urllib.request.Request(
+            f"{self.base_url}/query",
+            data=json.dumps({"input": inputs["input"]}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error", str(e))
+            except (ValueError, json.JSONDecodeError):
+                message = str(e)
+            raise RuntimeError(f"Server returned {e.code}: {message}") from e
+
+
+def check_server_health(host: str = SERVER_HOST, port: int = SERVER_PORT, timeout: float = 2.0) -> dict | None:
+    """Return the server's /health payload, or None if it is not reachable"""
+    try:
+        with urllib.request.urlopen(f"http://{host}:{port}/health", timeout=timeout) as response:
+            return json.loads(response.read())
+    except (urllib.error.URLError, OSError, ValueError):
+        return None
+
+
+def query_remote(query: str = None, host: str = SERVER_HOST, port: int = SERVER_PORT):
+    """Answer a query (or run interactive mode) through a running retrieval server"""
+    health = check_server_health(host, port)
+    if health is None:
+        print(f"❌ No retrieval server reachable at http://{host}:{port}. Start one with: python3 main.py --serve")
+        return
+
+    print(f"✓ Connected to retrieval server at http://{host}:{port} "
+          f"({health['in_flight']} in flight, {health['queued']} queued)")
+
+    rag_chain = RemoteRAGChain(host, port)
+    if query:
+        execute_query(rag_chain, query)
+    else:
+        run_interactive_mode(rag_chain)
@@ -0,0 +1,34 @@
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from utils.context_utils import pack_context, estimate_tokens
+from utils.log_utils import log_context_packing
+from utils.instrumentation import span
+from config import (CONTEXT_TOKEN_BUDGET, CONTEXT_MAX_TOKENS_PER_DOC, SYSTEM_PROMPT)
+
+
+class ContextPackingRetriever(BaseRetriever):
+    """Packs another retriever's documents into the prompt token budget and logs the prompt size"""
+
+    retriever: BaseRetriever
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+    max_tokens_per_doc: int = CONTEXT_MAX_TOKENS_PER_DOC
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> list[Document]:
+        with span("query.retrieve"):
+            documents = self.retriever.invoke(query)
+        return self._pack(documents, query)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager=None) -> list[Document]:
+        with span("query.retrieve"):
+            documents = await self.retriever.ainvoke(query)
+        return self._pack(documents, query)
+
+    def _pack(self, documents: list[Document], query: str) -> list[Document]:
+        with span("query.prompt_assembly"):
+            question = query.removeprefix("search_query:").strip()
+            packed, stats = pack_context(documents, question, self.token_budget, self.max_tokens_per_doc)
+
+            # System prompt + packed context + question, as the stuff chain will send them
+            prompt_tokens = estimate_tokens(SYSTEM_PROMPT) + stats["tokens"] + estimate_tokens(query)
+        log_context_packing(stats, prompt_tokens)
+        return packed
@@ -0,0 +1,85 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+from pydantic import ConfigDict
+from utils.bm25_index import Bm25Index
+from utils.chunk_store import ChunkStore
+from utils.filter_utils import normalize_filter
+from utils.instrumentation import span, submit_in_context
+from config import (RETRIEVER_K, RETRIEVER_FETCH_K, HYBRID_VECTOR_WEIGHT, HYBRID_LEXICAL_WEIGHT, HYBRID_RRF_K)
+
+# Lexical searches run here while the vector search runs on the calling thread
+_lexical_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bm25")
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], weights: list[float], rrf_k: int) -> list[str]:
+    """Fuse ranked ID lists: each ID scores sum(weight / (rrf_k + rank)) over the lists it appears in"""
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (rrf_k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """BM25 and vector search over the same chunks, fused with reciprocal-rank fusion"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vector_store: VectorStore
+    index: Bm25Index
+    chunk_store: ChunkStore
+    k: int = RETRIEVER_K
+    fetch_k: int = RETRIEVER_FETCH_K
+    vector_weight: float = HYBRID_VECTOR_WEIGHT
+    lexical_weight: float = HYBRID_LEXICAL_WEIGHT
+    rrf_k: int = HYBRID_RRF_K
+    filter: dict | None = None  # Metadata filter applied to every query unless invoke() passes filter=
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None, filter: dict = None) -> list[Document]:
+        metadata_filter = filter or self.filter
+        # The search_query: prefix is only meaningful to the embedding model
+        lexical = submit_in_context(_lexical_executor, self._lexical_search, query.removeprefix("search_query:"),
+                                    metadata_filter)
+        # Includes embedding the query
+        with span("query.vector_search"):
+            vector_docs = self.vector_store.similarity_search(query, k=self.fetch_k, filter=metadata_filter)
+        return self._fuse(vector_docs, [chunk_id for chunk_id, _ in lexical.result()])
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager=None, filter: dict = None) -> list[Document]:
+        metadata_filter = filter or self.filter
+        lexical = asyncio.create_task(asyncio.to_thread(self._lexical_search, query.removeprefix("search_query:"),
+                                                        metadata_filter))
+        try:
+            with span("query.vector_search"):
+                query_embedding = await self.vector_store.embeddings.aembed_query(query)
+                vector_docs = await asyncio.to_thread(self.vector_store.similarity_search_by_vector,
+                                                      query_embedding, k=self.fetch_k, filter=metadata_filter)
+            lexical_results = await lexical
+        finally:
+            lexical.cancel()
+        return await asyncio.to_thread(self._fuse, vector_docs, [chunk_id for chunk_id, _ in lexical_results])
+
+    def _fuse(self, vector_docs: list[Document], lexical_ids: list[str]) -> list[Document]:
+        docs_by_id = {doc.id: doc for doc in vector_docs}
+        fused_ids = reciprocal_rank_fusion(
+            [[doc.id for doc in vector_docs], lexical_ids],
+            [self.vector_weight, self.lexical_weight],
+            self.rrf_k
+        )[:self.k]
+
+        # Chunks found only by BM25 are read from the chunk store by ID
+        missing_ids = [chunk_id for chunk_id in fused_ids if chunk_id not in docs_by_id]
+        if missing_ids:
+            docs_by_id.update((doc.id, doc) for doc in self.chunk_store.get(missing_ids))
+        return [docs_by_id[chunk_id] for chunk_id in fused_ids if chunk_id in docs_by_id]
+
+    def _lexical_search(self, query: str, metadata_filter: dict | None) -> list[tuple[str, float]]:
+        # Filters resolve to chunk files through the partition index of a PartitionedVectorStore
+        source_files = (self.vector_store.index.matching_files(normalize_filter(metadata_filter))
+                        if metadata_filter else None)
+        with span("query.lexical_search"):
+            return self.index.search(query, self.fetch_k, source_files)
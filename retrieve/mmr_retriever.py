@@ -0,0 +1,51 @@
+import asyncio
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+from pydantic import ConfigDict
+from utils.mmr_utils import max_marginal_relevance
+from utils.partition_store import query_vector_store
+from utils.instrumentation import span
+from config import (RETRIEVER_K, RETRIEVER_FETCH_K, RETRIEVER_LAMBDA_MULT)
+
+
+class MMRRetriever(BaseRetriever):
+    """MMR re-ranking on the candidate embeddings the vector store returns with the query"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vector_store: VectorStore  # Chroma, MemmapVectorStore or PartitionedVectorStore
+    k: int = RETRIEVER_K
+    fetch_k: int = RETRIEVER_FETCH_K
+    lambda_mult: float = RETRIEVER_LAMBDA_MULT
+    filter: dict | None = None  # Metadata filter applied to every query unless invoke() passes filter=
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None, filter: dict = None) -> list[Document]:
+        # Timed as query.embed by the vector store's embeddings, unless the answer cache already embedded it
+        query_embedding = self.vector_store.embeddings.embed_query(query)
+        return self._search(query_embedding, filter or self.filter)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager=None, filter: dict = None) -> list[Document]:
+        query_embedding = await self.vector_store.embeddings.aembed_query(query)
+        # The vector stores are synchronous, so search in a worker thread
+        return await asyncio.to_thread(self._search, query_embedding, filter or self.filter)
+
+    def _search(self, query_embedding: list[float], metadata_filter: dict | None) -> list[Document]:
+        # One query returns candidates with their stored vectors, nothing is re-embedded or re-fetched
+        with span("query.vector_search"):
+            results = query_vector_store(self.vector_store, [query_embedding], self.fetch_k,
+                                         ["documents", "metadatas", "embeddings"], metadata_filter)
+        if not results["ids"][0]:
+            return []
+
+        with span("query.mmr"):
+            selected = max_marginal_relevance(query_embedding, results["embeddings"][0], self.k, self.lambda_mult)
+        return [
+            Document(
+                id=results["ids"][0][index],
+                page_content=results["documents"][0][index],
+                metadata=results["metadatas"][0][index] or {}
+            )
+            for index in selected
+        ]
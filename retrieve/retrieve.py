@@ -1,64 +1,214 @@
-from langchain_ollama import ChatOllama, OllamaEmbeddings
+import os
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_classic.chains import create_retrieval_chain
-from langchain_classic.chains.combine_documents import create_stuff_documents_chain
-from langchain_chroma import Chroma
-from config import (PERSIST_DIR, COLLECTION_NAME, EMBEDDING_MODEL, RETRIEVER_TYPE, RETRIEVER_K, RETRIEVER_FETCH_K, RETRIEVER_LAMBDA_MULT, SYSTEM_PROMPT)
+from config import (PERSIST_DIR, COLLECTION_NAME, EMBEDDING_MODEL, RETRIEVER_TYPE, RETRIEVER_K, SYSTEM_PROMPT, STREAM_ANSWERS, ANSWER_CACHE_ENABLED, BM25_INDEX_DIR, CHUNKS_PATTERN,
+                    METRICS_PORT, SERVER_HOST, VECTOR_STORE, MEMMAP_STORE_DIR, EMBED_REVISION_FILE, PARTITION_INDEX_FILE,
+                    RETRIEVER_FILTER)
 from utils.retrieve_utils import execute_query, run_interactive_mode
+from utils.embedding_cache import with_embedding_cache, QueryVectorMemo
+from utils.query_batcher import with_query_batching
+from utils.model_utils import create_embeddings, create_chat_model, LLMLatencyCallback
+from utils.instrumentation import span, start_metrics_server
+from retrieve.context_packer import ContextPackingRetriever
+from utils.filter_utils import normalize_filter, describe_filter, filter_scope
+from utils.log_utils import log_embedding_cache_stats, log_answer_cache_stats
 
-def retrieve(query: str = None):
-    """Retrieve answers from embedded PDF chunks using RAG with Ollama LLM"""
-    
-    # 1. Load the vector database
+def load_memmap_store(embeddings):
+    """The exported memmap vector store, or None (with a warning) if it has not been exported yet"""
+    from utils.memmap_store import MemmapVectorStore, read_store_meta, STORE_FORMAT
+    from utils.embed_utils import read_collection_revision
+
+    meta = read_store_meta(MEMMAP_STORE_DIR)
+    if meta is None or meta["format"] != STORE_FORMAT:
+        print(f"Warning: no vector store exported to {MEMMAP_STORE_DIR}, using Chroma "
+              f"(run python3 -m embed.export_memmap)")
+        return None
+    if meta.get("revision") != read_collection_revision(EMBED_REVISION_FILE):
+        print(f"Warning: {MEMMAP_STORE_DIR} is older than the collection (run python3 -m embed.export_memmap)")
+    vector_db = MemmapVectorStore(MEMMAP_STORE_DIR, embeddings)
+    search = f"IVF, {vector_db.nprobe}/{meta['ivf_lists']} lists per query" if meta["ivf_lists"] else "brute force"
+    print(f"✓ Vector store loaded from {MEMMAP_STORE_DIR} ({meta['count']:,} {meta['dtype']} vectors, {search})")
+    return vector_db
+
+
+def load_memmap_partitions(index, embeddings) -> dict | None:
+    """Memmap stores of every collection in the partition index, or None (with a warning) if one is missing"""
+    from utils.memmap_store import MemmapVectorStore, read_store_meta, STORE_FORMAT
+    from utils.partition_store import partition_store_dir
+
+    stores = {}
+    for name, revision in index.collections.items():
+        store_dir = partition_store_dir(name)
+        meta = read_store_meta(store_dir)
+        if meta is None or meta["format"] != STORE_FORMAT:
+            print(f"Warning: no vector store exported to {store_dir}, using Chroma "
+                  f"(run python3 -m embed.export_memmap)")
+            return None
+        if meta.get("revision") != revision:
+            print(f"Warning: {store_dir} is older than its collection (run python3 -m embed.export_memmap)")
+        stores[name] = MemmapVectorStore(store_dir, embeddings)
+    count = sum(store.count for store in stores.values())
+    print(f"✓ Vector store loaded from {MEMMAP_STORE_DIR} ({count:,} vectors in {len(stores)} "
+          f"{'partitions' if index.partition_by else 'collection'})")
+    return stores
+
+
+def load_partitioned_store(embeddings):
+    """Vector store over the collections in the partition index, or None if the embed step has not written one"""
+    from utils.partition_store import PartitionIndex, PartitionedVectorStore
+
+    index = PartitionIndex.load(PARTITION_INDEX_FILE)
+    if index is None:
+        return None
+    partitions = load_memmap_partitions(index, embeddings) if VECTOR_STORE == "memmap" else None
+    if partitions is not None:
+        return PartitionedVectorStore(partitions, index, embeddings, metric="cosine")
+
+    import chromadb
+    client = chromadb.PersistentClient(path=PERSIST_DIR)
+    partitions = {name: client.get_or_create_collection(name, embedding_function=None) for name in index.collections}
+    if index.partition_by:
+        print(f"✓ Vector DB loaded from {PERSIST_DIR} ({len(partitions)} partitions by {index.partition_by})")
+    else:
+        print(f"✓ Vector DB loaded from {PERSIST_DIR}")
+    return PartitionedVectorStore(partitions, index, embeddings, metric="l2")
+
+
+def load_vector_db():
+    """Open the vector store with the cached, micro-batched query embeddings; returns (vector_db, embeddings)"""
     print("Loading vector database...")
     try:
-        embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
-        vector_db = Chroma(
-            persist_directory=PERSIST_DIR,
-            embedding_function=embeddings,
-            collection_name=COLLECTION_NAME
-        )
-        print(f"✓ Vector DB loaded from {PERSIST_DIR}")
+        # Only cache misses reach the batcher, which merges concurrent queries into one Ollama call
+        embeddings = with_embedding_cache(with_query_batching(create_embeddings(EMBEDDING_MODEL)), EMBEDDING_MODEL)
+        # Retrieval reuses the query vector of the answer cache lookup instead of embedding the query again
+        store_embeddings = QueryVectorMemo(embeddings)
+        vector_db = load_partitioned_store(store_embeddings)
+        # Vector DBs embedded before the partition index existed
+        if vector_db is None and VECTOR_STORE == "memmap":
+            vector_db = load_memmap_store(store_embeddings)
+        if vector_db is None:
+            from langchain_chroma import Chroma
+            vector_db = Chroma(
+                persist_directory=PERSIST_DIR,
+                embedding_function=store_embeddings,
+                collection_name=COLLECTION_NAME
+            )
+            print(f"✓ Vector DB loaded from {PERSIST_DIR}")
     except Exception as e:
         print(f"❌ Error loading vector DB: {e}")
         raise
+    return vector_db, embeddings
 
-    # 2. Initialize Llama 3 via Ollama with context length limit
-    
-    """ A LangChain wrapper for Ollama's chat models that enables conversational AI capabilities"""
-    llm = ChatOllama(
-        model="llama3", # Llama 3 has a context window of ~8K tokens
-        temperature=0
-    )
-    
-     # 3. Retrieval chain setup
-    system_prompt = (SYSTEM_PROMPT + "\n\n {context}")
 
+def build_answer_chain():
+    """Prompt and chat model that answer a question from already retrieved documents"""
+    from langchain_classic.chains.combine_documents import create_stuff_documents_chain
+
+    # The callback records time to first token and to the complete answer
+    llm = create_chat_model(callbacks=[LLMLatencyCallback()])  # Llama 3 has a context window of ~8K tokens
+
+    # SYSTEM_PROMPT already ends with the {context} placeholder
     prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
+        ("system", SYSTEM_PROMPT),
         ("human", "{input}"),
     ])
+    return create_stuff_documents_chain(llm, prompt)
+
+
+def resolve_retriever_type() -> str:
+    """RETRIEVER_TYPE, falling back to vector search if the BM25 index has not been built"""
+    if RETRIEVER_TYPE == "hybrid" and not os.path.exists(BM25_INDEX_DIR):
+        print(f"Warning: BM25 index {BM25_INDEX_DIR} not found, using vector search only "
+              f"(run python3 -m embed.embed to build it)")
+        return "similarity"
+    return RETRIEVER_TYPE
 
-    retriever = vector_db.as_retriever(
-        search_type=RETRIEVER_TYPE,
-        search_kwargs={
-            "k": RETRIEVER_K,  # Number of documents to retrieve
-            "fetch_k": RETRIEVER_FETCH_K,  # Fetch more candidates to ensure diversity
-            "lambda_mult": RETRIEVER_LAMBDA_MULT  # Balance between relevance and diversity
-        }
-    )
-
-    question_answer_chain = create_stuff_documents_chain(llm, prompt)
-    rag_chain = create_retrieval_chain(retriever, question_answer_chain)
+
+def resolve_filter(vector_db, metadata_filter: dict | None) -> dict | None:
+    """Normalized metadata filter, or None (with a warning) if the vector store cannot apply it"""
+    from utils.partition_store import PartitionedVectorStore
+
+    metadata_filter = normalize_filter(metadata_filter)
+    if metadata_filter is None:
+        return None
+    if not isinstance(vector_db, PartitionedVectorStore):
+        print("Warning: metadata filters need the partition index, searching all chunks "
+              "(run python3 -m embed.embed to build it)")
+        return None
+
+    plan = vector_db.index.plan(metadata_filter)
+    matched = vector_db.index.matching_files(metadata_filter)
+    print(f"✓ Filter {describe_filter(metadata_filter)}: {len(matched)} chunk files, "
+          f"{len(plan)}/{len(vector_db.index.collections)} collections searched")
+    if not matched:
+        print("Warning: no chunk files match the filter, queries will find no documents")
+    return metadata_filter
+
+
+def build_rag_chain(metadata_filter: dict = RETRIEVER_FILTER):
+    """Load the vector DB and LLM once and assemble the retrieval chain; returns (rag_chain, embeddings)"""
+    # The chain modules are only needed once a query is answered, so import them here
+    from langchain_classic.chains import create_retrieval_chain
+
+    # 1. Load the vector database and check the filter against its partition index
+    vector_db, embeddings = load_vector_db()
+    metadata_filter = resolve_filter(vector_db, metadata_filter)
+
+    # 2. Llama 3 via Ollama answering from the retrieved context
+    question_answer_chain = build_answer_chain()
+
+    # 3. Retriever setup
+    retriever_type = resolve_retriever_type()
+    if retriever_type == "hybrid":
+        from retrieve.hybrid_retriever import HybridRetriever
+        from utils.bm25_index import Bm25Index
+        from utils.chunk_store import ChunkStore
+        retriever = HybridRetriever(vector_store=vector_db, index=Bm25Index(BM25_INDEX_DIR),
+                                    chunk_store=ChunkStore(CHUNKS_PATTERN), filter=metadata_filter)
+        print(f"✓ BM25 index loaded from {BM25_INDEX_DIR}")
+    elif retriever_type == "mmr":
+        # Fetches RETRIEVER_FETCH_K candidates and balances relevance and diversity by RETRIEVER_LAMBDA_MULT
+        from retrieve.mmr_retriever import MMRRetriever
+        retriever = MMRRetriever(vector_store=vector_db, filter=metadata_filter)
+    else:
+        search_kwargs = {"k": RETRIEVER_K}  # Number of documents to retrieve
+        if metadata_filter:
+            search_kwargs["filter"] = metadata_filter
+        retriever = vector_db.as_retriever(search_type=retriever_type, search_kwargs=search_kwargs)
+
+    # Fit retrieved documents into the context token budget
+    retriever = ContextPackingRetriever(retriever=retriever)
+
+    # 4. Serve repeated and near-duplicate questions from the answer cache, among answers given under the same filter
+    if ANSWER_CACHE_ENABLED:
+        from utils.answer_cache import AnswerCache, CachedRAGChain
+        rag_chain = CachedRAGChain(retriever, question_answer_chain, embeddings,
+                                   AnswerCache(scope=filter_scope(metadata_filter)))
+    else:
+        rag_chain = create_retrieval_chain(retriever, question_answer_chain)
+
+    return rag_chain, embeddings
+
+
+def retrieve(query: str = None, stream: bool = STREAM_ANSWERS, metadata_filter: dict = RETRIEVER_FILTER):
+    """Retrieve answers from embedded PDF chunks using RAG with Ollama LLM"""
+    with span("stage.load_chain"):
+        rag_chain, embeddings = build_rag_chain(metadata_filter)
+
+    if METRICS_PORT:
+        start_metrics_server(SERVER_HOST, METRICS_PORT)
+        print(f"✓ Prometheus metrics on http://{SERVER_HOST}:{METRICS_PORT}/metrics")
     
-    # 4. Handle query input
+    # 5. Handle query input
     if query:
         # Use provided query
-        execute_query(rag_chain, query)
+        execute_query(rag_chain, query, stream=stream)
     else:
         # Interactive mode - allow multiple queries
-        run_interactive_mode(rag_chain)
-    
+        run_interactive_mode(rag_chain, stream=stream)
+
+    log_answer_cache_stats(rag_chain)
+    log_embedding_cache_stats(embeddings)
+
     
 if __name__ == "__main__":
     retrieve()
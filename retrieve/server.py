@@ -0,0 +1,153 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import (SERVER_HOST, SERVER_PORT, SERVER_MAX_CONCURRENCY, SERVER_MAX_QUEUE, RETRIEVER_FILTER)
+from utils.log_utils import print_header, log_latency_summary, log_histogram_summary
+from utils.instrumentation import span, trace, metrics
+
+
+class QueryLimiter:
+    """Admit at most max_concurrency queries at once, with a bounded number waiting"""
+
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.in_flight = 0
+
+    def try_enter_queue(self) -> bool:
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                return False
+            self.waiting += 1
+            return True
+
+    def acquire(self) -> None:
+        self._slots.acquire()
+        with self._lock:
+            self.waiting -= 1
+            self.in_flight += 1
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+
+def serialize_documents(documents) -> list[dict]:
+    """Convert retrieved Document objects to JSON-friendly dicts"""
+    return [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in documents]
+
+
+def make_handler(rag_chain, limiter: QueryLimiter, started_at: float):
+    """Build a request handler bound to the warm chain"""
+
+    class RAGRequestHandler(BaseHTTPRequestHandler):
+
+        def _send_json(self, status: int, payload: dict) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            if self.path != "/health":
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+            self._send_json(200, {
+                "status": "ok",
+                "in_flight": limiter.in_flight,
+                "queued": limiter.waiting,
+                "uptime_s": round(time.monotonic() - started_at, 1)
+            })
+
+        def do_POST(self):
+            if self.path != "/query":
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except (ValueError, json.JSONDecodeError) as e:
+                self._send_json(400, {"error": f"Invalid JSON body: {e}"})
+                return
+
+            if not isinstance(request, dict):
+                self._send_json(400, {"error": "Body must be a JSON object"})
+                return
+            field = next((name for name in ("input", "query") if request.get(name) not in (None, "")), None)
+            if field is None or not isinstance(request[field], str) or not request[field].strip():
+                self._send_json(400, {"error": "Body must contain 'query' or 'input' as a non-empty string"})
+                return
+
+            # "input" is passed to the chain as-is; "query" gets the nomic-embed-text prefix added
+            chain_input = request["input"] if field == "input" else f"search_query: {request['query']}"
+
+            if not limiter.try_enter_queue():
+                self._send_json(503, {"error": "Server busy, too many queued queries"})
+                return
+
+            start_time = time.perf_counter()
+            limiter.acquire()
+            try:
+                with trace("query", streamed=False):
+                    response = rag_chain.invoke({"input": chain_input})
+            except Exception as e:
+                self._send_json(500, {"error": f"Error executing query: {e}"})
+                return
+            finally:
+                limiter.release()
+
+            self._send_json(200, {
+                "answer": response["answer"],
+                "context": serialize_documents(response.get("context", [])),
+                "latency_s": round(time.perf_counter() - start_time, 3)
+            })
+
+        def log_message(self, format, *args):
+            print(f"[server] {self.address_string()} {format % args}")
+
+    return RAGRequestHandler
+
+
+def run_server(host: str = SERVER_HOST, port: int = SERVER_PORT,
+               max_concurrency: int = SERVER_MAX_CONCURRENCY, max_queue: int = SERVER_MAX_QUEUE,
+               metadata_filter: dict = RETRIEVER_FILTER):
+    """Build the RAG chain once and serve queries until interrupted"""
+    from retrieve.retrieve import build_rag_chain
+
+    print_header("Starting RAG retrieval server...")
+    with span("stage.load_chain"):
+        rag_chain, _ = build_rag_chain(metadata_filter)
+
+    limiter = QueryLimiter(max_concurrency, max_queue)
+    server = ThreadingHTTPServer((host, port), make_handler(rag_chain, limiter, time.monotonic()))
+    server.daemon_threads = True
+
+    print(f"✓ Serving on http://{host}:{port} (POST /query, GET /health, GET /metrics), "
+          f"{max_concurrency} concurrent queries, {max_queue} queued")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down server...")
+    finally:
+        server.server_close()
+        log_latency_summary(metrics.summary())
+        log_histogram_summary(metrics.histogram_summary())
+
+
+if __name__ == "__main__":
+    run_server()
@@ -1,21 +1,25 @@
 import os
 import glob
+import argparse
 from pathlib import Path
-from langchain_community.document_loaders import PyPDFLoader
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from utils.log_utils import print_header, log_processing_count, log_processing_file, log_extraction_summary
 from utils.source_to_text_utils import save_to_json
-from config import (PDF_PATTERN, CHUNKED_DIR)
+from config import (PDF_PATTERN, PDF_PAGES_DIR, PDF_WORKERS, PDF_PAGES_PER_TASK)
+
 
 
 def pdf_to_json(pdf_path:str, output_dir:str):
     """
-    This script creates chunked PDF JSON files directly from PDFs.
+    This script creates PDF page JSON files for the chunking stage.
     1. Load PDF using PyPDFLoader
     2. Convert Document objects to dicts
     3. Save as JSON file
     4. Return output path and number of documents extracted
     """
     
+    from langchain_community.document_loaders import PyPDFLoader
+
     output_data = []
     try:
         loader = PyPDFLoader(pdf_path)
@@ -33,29 +37,144 @@ def pdf_to_json(pdf_path:str, output_dir:str):
         print(f"✗ Error processing {pdf_path}: {str(e)}")
         return None, 0
 
+    output_path = save_pdf_json(pdf_path, output_data, output_dir)
+    return output_path, len(documents)
+
+
+def save_pdf_json(pdf_path: str, output_data: list[dict], output_dir: str) -> str:
+    """Save extracted PDF pages as <pdf name>_pages.json and return the output path"""
+
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
         
     # Generate output filename based on input PDF name
     pdf_name = Path(pdf_path).stem
-    output_filename = f"chunked_{pdf_name}.json"
+    output_filename = f"{pdf_name}_pages.json"
     output_path = os.path.join(output_dir, output_filename)
 
     # Save to a file
     save_to_json(output_data, output_path)
         
     print(f"✓ Extracted: {pdf_path} -> {output_path}")
-    return output_path, len(documents)
+    return output_path
+
+
+
+def extract_pdf_pages(pdf_path: str, start_page: int, end_page: int) -> list[dict]:
+    """Extract pages [start_page, end_page) of a PDF into page records (runs in a worker process)"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(pdf_path)
+    total_pages = len(reader.pages)
+    page_labels = reader.page_labels
 
+    # Same text extraction and page metadata as PyPDFLoader, so chunk IDs match serial runs
+    return [
+        {
+            "page_content": reader.pages[page].extract_text(extraction_mode="plain").strip(),
+            "metadata": {
+                "source": pdf_path,
+                "total_pages": total_pages,
+                "page": page,
+                "page_label": page_labels[page]
+            }
+        }
+        for page in range(start_page, min(end_page, total_pages))
+    ]
 
-def extract_text_from_pdfs(pdf_pattern:str, output_dir:str):
-    """Extract multiple PDFs to JSON files"""
+
+def plan_page_ranges(pdf_files: list[str], pages_per_task: int) -> tuple[dict[str, list[tuple[int, int]]], list[str]]:
+    """Split every PDF into page ranges; returns ranges per file and files that cannot be opened"""
+    from pypdf import PdfReader
+
+    page_ranges = {}
+    failed = []
+
+    for pdf_file in pdf_files:
+        try:
+            page_count = len(PdfReader(pdf_file).pages)
+        except Exception as e:
+            print(f"✗ Error processing {pdf_file}: {str(e)}")
+            failed.append(pdf_file)
+            continue
+
+        page_ranges[pdf_file] = [
+            (start, min(start + pages_per_task, page_count))
+            for start in range(0, page_count, pages_per_task)
+        ] or [(0, 0)]
+
+    return page_ranges, failed
+
+
+def extract_pdfs_in_parallel(pdf_files: list[str], output_dir: str, workers: int):
+    """Extract PDFs with a process pool, splitting large files into page ranges"""
+    successful_extractions = []
+    failed_extractions = []
+
+    page_ranges, failed_extractions = plan_page_ranges(pdf_files, PDF_PAGES_PER_TASK)
+    results = {pdf_file: [None] * len(ranges) for pdf_file, ranges in page_ranges.items()}
+    remaining = {pdf_file: len(ranges) for pdf_file, ranges in page_ranges.items()}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(extract_pdf_pages, pdf_file, start, end): (pdf_file, index)
+            for pdf_file, ranges in page_ranges.items()
+            for index, (start, end) in enumerate(ranges)
+        }
+
+        for future in as_completed(futures):
+            pdf_file, index = futures[future]
+            if pdf_file not in remaining:
+                continue  # Another range of this file already failed
+
+            try:
+                results[pdf_file][index] = future.result()
+            except Exception as e:
+                print(f"✗ Error processing {pdf_file}: {str(e)}")
+                failed_extractions.append(pdf_file)
+                del remaining[pdf_file], results[pdf_file]
+                continue
+
+            remaining[pdf_file] -= 1
+            if remaining[pdf_file] == 0:
+                # All page ranges are done, stitch them back together in page order
+                output_data = [page for pages in results.pop(pdf_file) for page in pages]
+                del remaining[pdf_file]
+                print_header(f"✓ Loaded: {pdf_file} with {len(output_data)} pages.")
+                output_path = save_pdf_json(pdf_file, output_data, output_dir)
+                successful_extractions.append((pdf_file, output_path, len(output_data)))
+
+    return successful_extractions, failed_extractions
+
+
+def extract_pdf_in_pool(pool, pdf_file: str, output_dir: str) -> tuple[str | None, int]:
+    """Extract one PDF with its page ranges spread over a process pool; returns output path and page count"""
+    page_ranges, failed = plan_page_ranges([pdf_file], PDF_PAGES_PER_TASK)
+    if failed:
+        return None, 0
+
+    futures = [pool.submit(extract_pdf_pages, pdf_file, start, end) for start, end in page_ranges[pdf_file]]
+    try:
+        output_data = [page for future in futures for page in future.result()]
+    except Exception as e:
+        print(f"✗ Error processing {pdf_file}: {str(e)}")
+        for future in futures:
+            future.cancel()
+        return None, 0
+
+    print_header(f"✓ Loaded: {pdf_file} with {len(output_data)} pages.")
+    return save_pdf_json(pdf_file, output_data, output_dir), len(output_data)
+
+
+def extract_text_from_pdfs(pdf_pattern:str, output_dir:str, workers: int = PDF_WORKERS, pdf_files: list[str] = None):
+    """Extract multiple PDFs (matching the pattern, or the given files) to JSON files"""
     
-    pdf_files = glob.glob(pdf_pattern)
+    if pdf_files is None:
+        pdf_files = glob.glob(pdf_pattern)
     
     if not pdf_files:
         print(f"No PDF files found matching pattern: {pdf_pattern}")
-        return
+        return [], []
     
     successful_extractions = []
     failed_extractions = []
@@ -63,15 +182,20 @@ def extract_text_from_pdfs(pdf_pattern:str, output_dir:str):
     
     log_processing_count(len(pdf_files))
     
-    for pdf_file in pdf_files:
-        log_processing_file(pdf_file)
-        result_path, doc_count = pdf_to_json(pdf_file, output_dir)
-        
-        if result_path:
-            successful_extractions.append((pdf_file, result_path, doc_count))
-            total_documents += doc_count
-        else:
-            failed_extractions.append(pdf_file)
+    if workers > 1:
+        print(f"Extracting with {workers} worker processes...")
+        successful_extractions, failed_extractions = extract_pdfs_in_parallel(pdf_files, output_dir, workers)
+        total_documents = sum(doc_count for _, _, doc_count in successful_extractions)
+    else:
+        for pdf_file in pdf_files:
+            log_processing_file(pdf_file)
+            result_path, doc_count = pdf_to_json(pdf_file, output_dir)
+
+            if result_path:
+                successful_extractions.append((pdf_file, result_path, doc_count))
+                total_documents += doc_count
+            else:
+                failed_extractions.append(pdf_file)
     
     log_extraction_summary(successful_extractions, failed_extractions, total_documents, output_dir)
     
@@ -81,5 +205,8 @@ def extract_text_from_pdfs(pdf_pattern:str, output_dir:str):
 
 if __name__ == "__main__":
     """Extract PDFs to Text files"""
-    extract_text_from_pdfs(PDF_PATTERN, CHUNKED_DIR)
+    parser = argparse.ArgumentParser(description="Extract PDF pages to JSON files")
+    parser.add_argument("--workers", type=int, default=PDF_WORKERS, help="number of extraction processes")
+    args = parser.parse_args()
+    extract_text_from_pdfs(PDF_PATTERN, PDF_PAGES_DIR, workers=args.workers)
     
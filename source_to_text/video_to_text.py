@@ -1,44 +1,213 @@
-import whisper
 import os
 import glob
+import json
+from functools import lru_cache
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from utils.log_utils import log_processing_file
+from config import (WHISPER_MODEL, TRANSCRIBE_WORKERS, TRANSCRIBE_WINDOW_SECONDS, TRANSCRIBE_OVERLAP_SECONDS)
 
-# Load the Whisper model once
-model = whisper.load_model("small")
+# Whisper resamples all audio to 16 kHz mono
+SAMPLE_RATE = 16000
+
+
+@lru_cache(maxsize=1)
+def get_whisper_model():
+    """Load the Whisper model once, on first use (importing whisper pulls in torch)"""
+    import whisper
+    return whisper.load_model(WHISPER_MODEL)
+
+
+def init_transcription_worker(torch_threads: int):
+    """Give each worker process its own model and a fair share of CPU threads"""
+    import torch
+    torch.set_num_threads(torch_threads)
+    get_whisper_model()
+
+
+def load_audio(video_file: str):
+    """Decode a video's audio track to a 16 kHz float32 array (needs ffmpeg)"""
+    import whisper
+    return whisper.load_audio(video_file)
+
+
+def plan_audio_windows(duration: float, window_seconds: float = TRANSCRIBE_WINDOW_SECONDS,
+                       overlap_seconds: float = TRANSCRIBE_OVERLAP_SECONDS) -> list[tuple[float, float]]:
+    """Split audio into overlapping (start, end) windows in seconds"""
+    if duration <= window_seconds:
+        return [(0.0, duration)]
+
+    step = window_seconds - overlap_seconds
+    windows = []
+    start = 0.0
+    while True:
+        end = min(start + window_seconds, duration)
+        windows.append((start, end))
+        if end >= duration:
+            return windows
+        start += step
+
+
+def transcribe_window(audio, offset: float) -> list[dict]:
+    """Transcribe one audio window; segment times are shifted to the position in the whole video"""
+    result = get_whisper_model().transcribe(audio, fp16=False, language="en")
+    return [
+        {"start": segment["start"] + offset, "end": segment["end"] + offset, "text": segment["text"]}
+        for segment in result["segments"]
+    ]
+
+
+def stitch_segments(windows: list[tuple[float, float]], window_segments: list[list[dict]]) -> list[dict]:
+    """Merge per-window segments, cutting each overlap at its midpoint so no speech is kept twice"""
+    segments = []
+    for index, ((start, end), window) in enumerate(zip(windows, window_segments)):
+        lower = (start + windows[index - 1][1]) / 2 if index > 0 else float("-inf")
+        upper = (windows[index + 1][0] + end) / 2 if index + 1 < len(windows) else float("inf")
+        segments.extend(segment for segment in window if lower <= segment["start"] < upper)
+    return segments
+
+
+def transcribe_video(video_file: str) -> list[dict]:
+    """Transcribe a whole video window by window in this process"""
+    audio = load_audio(video_file)
+    windows = plan_audio_windows(len(audio) / SAMPLE_RATE)
+    window_segments = [
+        transcribe_window(audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)], start)
+        for start, end in windows
+    ]
+    return stitch_segments(windows, window_segments)
+
+
+def save_transcript(video_file: str, segments: list[dict], output_dir: str) -> str:
+    """Save the transcript text and its timestamped segments; returns the transcript path"""
+
+    # Generate output filenames based on input filename
+    video_name = Path(video_file).stem
+    output_path = os.path.join(output_dir, f"{video_name}_transcript.txt")
+    segments_path = os.path.join(output_dir, f"{video_name}_segments.json")
+
+    # Save the transcript
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write("".join(segment["text"] for segment in segments).strip())
+
+    # Save segments with start/end times so chunks can cite a time offset
+    with open(segments_path, "w", encoding="utf-8") as f:
+        json.dump({"source": video_file, "segments": segments}, f, ensure_ascii=False, indent=4)
+
+    print(f"✓ Transcript saved: {output_path}")
+    return output_path
+
+
+def transcribe_videos_in_parallel(video_files: list[str], output_dir: str, workers: int) -> list[tuple[str, str]]:
+    """Transcribe audio windows of all videos across worker processes, each with its own model"""
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    pending = {}  # future -> (video_file, window index)
+    videos = {}  # video_file -> windows, per-window segments and windows still running
+    transcribed = []
+
+    def collect(done):
+        for future in done:
+            video_file, index = pending.pop(future)
+            video = videos.get(video_file)
+            if video is None:
+                continue  # Another window of this video already failed
+
+            try:
+                video["segments"][index] = future.result()
+            except Exception as e:
+                print(f"✗ Error processing {video_file}: {str(e)}")
+                del videos[video_file]
+                continue
+
+            video["remaining"] -= 1
+            if video["remaining"] == 0:
+                del videos[video_file]
+                segments = stitch_segments(video["windows"], video["segments"])
+                transcribed.append((video_file, save_transcript(video_file, segments, output_dir)))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_transcription_worker,
+                             initargs=(torch_threads,)) as pool:
+        for video_file in video_files:
+            log_processing_file(file=video_file)
+            try:
+                audio = load_audio(video_file)
+            except Exception as e:
+                print(f"✗ Error processing {video_file}: {str(e)}")
+                continue
+
+            windows = plan_audio_windows(len(audio) / SAMPLE_RATE)
+            videos[video_file] = {"windows": windows, "segments": [None] * len(windows), "remaining": len(windows)}
+            print(f"  Split into {len(windows)} audio windows")
+
+            for index, (start, end) in enumerate(windows):
+                # Keep a bounded number of audio windows in flight to cap memory
+                while len(pending) >= 2 * workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                window_audio = audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+                pending[pool.submit(transcribe_window, window_audio, start)] = (video_file, index)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+
+    return transcribed
+
+
+def transcribe_video_in_pool(pool, video_file: str, output_dir: str, max_in_flight: int = 2) -> str:
+    """Transcribe one video on a process pool set up with init_transcription_worker; returns the transcript path.
+
+    Only max_in_flight audio windows are handed to the pool at a time to cap memory.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    audio = load_audio(video_file)
+    windows = plan_audio_windows(len(audio) / SAMPLE_RATE)
+    print(f"  {Path(video_file).name}: split into {len(windows)} audio windows")
+
+    window_segments = [None] * len(windows)
+    pending = {}  # future -> window index
+    for index, (start, end) in enumerate(windows):
+        while len(pending) >= max_in_flight:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                window_segments[pending.pop(future)] = future.result()
+        pending[pool.submit(transcribe_window, audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)], start)] = index
+    for future, index in pending.items():
+        window_segments[index] = future.result()
+
+    return save_transcript(video_file, stitch_segments(windows, window_segments), output_dir)
+
+
+def extract_text_from_videos(video_pattern:str, output_dir:str, video_files: list[str] = None,
+                             workers: int = TRANSCRIBE_WORKERS):
+    """Transcribe videos matching the pattern (or the given files); returns (video, transcript) pairs"""
 
-def extract_text_from_videos(video_pattern:str, output_dir:str):
-    
     # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)      
-    
+    os.makedirs(output_dir, exist_ok=True)
+
     # Find all .mp4 files in the input directory
-    mp4_files = glob.glob(video_pattern)
+    mp4_files = video_files if video_files is not None else glob.glob(video_pattern)
+    transcribed = []
 
     if not mp4_files:
         print("No .mp4 files found in the specified directory.")
+    elif workers > 1:
+        print(f"Found {len(mp4_files)} .mp4 files to process with {workers} worker processes:")
+        transcribed = transcribe_videos_in_parallel(mp4_files, output_dir, workers)
     else:
         print(f"Found {len(mp4_files)} .mp4 files to process:")
-        
+
         for video_file in mp4_files:
             log_processing_file(file=video_file)
-            
+
             try:
                 # Transcribe the video file
-                result = model.transcribe(video_file, fp16=False, language="en")
-                
-                # Generate output filename based on input filename
-                video_name = Path(video_file).stem
-                output_filename = f"{video_name}_transcript.txt"
-                output_path = os.path.join(output_dir, output_filename)
-                
-                # Save the transcript
-                with open(output_path, "w", encoding="utf-8") as f:
-                    f.write(result["text"])
-                
-                print(f"✓ Transcript saved: {output_path}")
-                
+                segments = transcribe_video(video_file)
+                output_path = save_transcript(video_file, segments, output_dir)
+                transcribed.append((video_file, output_path))
+
             except Exception as e:
                 print(f"✗ Error processing {video_file}: {str(e)}")
 
     print("\nProcessing complete!")
+    return transcribed
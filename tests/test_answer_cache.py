@@ -0,0 +1,89 @@
+import os
+
+import pytest
+from langchain_core.documents import Document
+from utils.answer_cache import AnswerCache, normalize_query
+from utils.embed_utils import bump_collection_revision
+
+VECTOR = [1.0, 0.0, 0.0]
+CONTEXT = [Document(page_content="chunk text", metadata={"chunk_id": "chunked_a.jsonl:0:0"})]
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "answer_cache.db"), str(tmp_path / "revision.txt")
+
+
+def make_cache(paths, scope: str = "") -> AnswerCache:
+    cache_path, revision_file = paths
+    return AnswerCache(cache_path, max_entries=10, ttl_seconds=3600, similarity=0.95, revision_file=revision_file,
+                       scope=scope)
+
+
+def bump_revision(revision_file: str, mtime: float) -> None:
+    bump_collection_revision(revision_file)
+    # The cache notices a new revision by the file's mtime
+    os.utime(revision_file, (mtime, mtime))
+
+
+def test_normalize_query():
+    assert normalize_query("search_query:  What is  RAG?? ") == "what is rag"
+
+
+def test_semantic_and_exact_lookups(paths):
+    cache = make_cache(paths)
+    cache.store("What is RAG?", VECTOR, ["chunked_a.jsonl:0:0"], "An answer", CONTEXT)
+
+    entry = cache.lookup_semantic([0.99, 0.05, 0.0])
+    assert entry["answer"] == "An answer" and entry["cached_query"] == "what is rag"
+    assert entry["context"][0].page_content == "chunk text"
+    assert cache.lookup_semantic([0.0, 1.0, 0.0]) is None
+    assert cache.lookup_exact("what is rag", ["chunked_a.jsonl:0:0"])["answer"] == "An answer"
+    assert cache.lookup_exact("what is rag", ["chunked_b.jsonl:0:0"]) is None
+
+
+def test_new_collection_revision_drops_every_entry(paths):
+    _, revision_file = paths
+    bump_revision(revision_file, 1_000_000)
+    cache = make_cache(paths)
+    cache.store("What is RAG?", VECTOR, ["chunked_a.jsonl:0:0"], "An answer", CONTEXT)
+    assert cache.lookup_semantic(VECTOR) is not None
+
+    bump_revision(revision_file, 2_000_000)
+    assert cache.lookup_semantic(VECTOR) is None
+    assert cache.lookup_exact("What is RAG?", ["chunked_a.jsonl:0:0"]) is None
+    # A cache opened later does not serve them either
+    assert make_cache(paths).lookup_semantic(VECTOR) is None
+
+
+def test_entries_are_only_served_in_their_scope(paths):
+    filtered = make_cache(paths, scope='{"category": ["pdf"]}')
+    filtered.store("What is RAG?", VECTOR, ["chunked_a.jsonl:0:0"], "A filtered answer", CONTEXT)
+
+    unfiltered = make_cache(paths)
+    assert unfiltered.lookup_semantic(VECTOR) is None
+    assert unfiltered.lookup_exact("What is RAG?", ["chunked_a.jsonl:0:0"]) is None
+    assert make_cache(paths, scope='{"category": ["pdf"]}').lookup_semantic(VECTOR)["answer"] == "A filtered answer"
+
+
+def test_rows_evicted_by_another_process_are_misses(paths):
+    cache, other = make_cache(paths), make_cache(paths)
+    cache.store("What is RAG?", VECTOR, ["chunked_a.jsonl:0:0"], "An answer", CONTEXT)
+    other._conn.execute("DELETE FROM answers")
+    other._conn.commit()
+
+    assert cache.lookup_semantic(VECTOR) is None
+    assert cache.lookup_exact("What is RAG?", ["chunked_a.jsonl:0:0"]) is None
+    assert cache._vectors is None
+
+
+def test_least_recently_used_entries_are_evicted(paths):
+    cache = make_cache(paths)
+    cache.max_entries = 2
+    for position, query in enumerate(["first", "second", "third"]):
+        vector = [0.0, 0.0, 0.0]
+        vector[position] = 1.0
+        cache.store(query, vector, [], f"answer {query}", CONTEXT)
+
+    assert cache.lookup_exact("first", []) is None
+    assert cache.lookup_exact("third", [])["answer"] == "answer third"
@@ -0,0 +1,68 @@
+import os
+
+from langchain_core.documents import Document
+from utils.bm25_index import Bm25Index, Bm25IndexWriter, load_segments, tokenize
+
+FILES = {
+    "chunked_a.jsonl": {"a:0": "the llama model answers questions", "a:1": "PaliGemma-3B reads images"},
+    "chunked_b.jsonl": {"b:0": "whisper transcribes the video", "b:1": "the llama llama llama herds"},
+}
+
+
+def update(writer: Bm25IndexWriter, files: dict) -> list[str]:
+    loaded = []
+    for source_file, chunks in files.items():
+        def load_documents(source_file=source_file, chunks=chunks):
+            loaded.append(source_file)
+            return [Document(page_content=text) for text in chunks.values()]
+        writer.update_file(source_file, list(chunks), load_documents)
+    return loaded
+
+
+def build(index_dir: str, files: dict = FILES, stored_ids: dict = None, failed_files: set = frozenset()):
+    writer = Bm25IndexWriter(index_dir, stored_ids or {})
+    loaded = update(writer, files)
+    writer.finish(set(failed_files))
+    return writer, loaded
+
+
+def test_tokenize_splits_identifiers():
+    assert tokenize("PaliGemma-3B, v1.5!") == ["paligemma-3b", "paligemma", "3b", "v1.5", "v1", "5"]
+
+
+def test_search_ranks_and_filters_by_chunk_file(tmp_path):
+    build(str(tmp_path))
+    index = Bm25Index(str(tmp_path))
+
+    assert [chunk_id for chunk_id, _ in index.search("llama", 5)] == ["b:1", "a:0"]
+    assert [chunk_id for chunk_id, _ in index.search("llama", 5, {"chunked_a.jsonl"})] == ["a:0"]
+    assert [chunk_id for chunk_id, _ in index.search("paligemma", 5)] == ["a:1"]
+    assert index.search("llama", 1)[0][0] == "b:1"
+    assert index.search("unknown words", 5) == []
+
+
+def test_unchanged_files_are_not_reloaded(tmp_path):
+    build(str(tmp_path))
+    stored_ids = {chunk_id: {} for chunks in FILES.values() for chunk_id in chunks}
+    writer, loaded = build(str(tmp_path), stored_ids=stored_ids)
+    assert loaded == []
+    assert writer.updated == 0
+
+    changed = {**FILES, "chunked_b.jsonl": {"b:0": "whisper transcribes the video"}}
+    writer, loaded = build(str(tmp_path), changed, stored_ids)
+    assert loaded == ["chunked_b.jsonl"]
+    assert [chunk_id for chunk_id, _ in Bm25Index(str(tmp_path)).search("llama", 5)] == ["a:0"]
+
+
+def test_deleted_files_drop_their_segment_unless_they_failed(tmp_path):
+    build(str(tmp_path))
+    remaining = {"chunked_a.jsonl": FILES["chunked_a.jsonl"]}
+    stored_ids = {chunk_id: {} for chunk_id in remaining["chunked_a.jsonl"]}
+
+    build(str(tmp_path), remaining, stored_ids, failed_files={"chunked_b.jsonl"})
+    assert set(load_segments(str(tmp_path))) == set(FILES)
+
+    writer, _ = build(str(tmp_path), remaining, stored_ids)
+    assert writer.updated == 1
+    assert set(load_segments(str(tmp_path))) == {"chunked_a.jsonl"}
+    assert len([name for name in os.listdir(tmp_path) if os.path.isdir(tmp_path / name)]) == 1
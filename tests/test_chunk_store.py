@@ -0,0 +1,64 @@
+import os
+
+import pytest
+from langchain_core.documents import Document
+from utils.chunk_store import (ChunkStore, ChunkFileWriter, write_chunk_file, compute_chunk_id, parse_chunk_id,
+                               chunk_content_hash)
+from utils.ingest_utils import chunk_offsets_path_for, chunk_ids_path_for
+
+TEXTS = ["first chunk", "zweiter Abschnitt mit Umlauten äöü", "", "last chunk"]
+
+
+def write_chunks(chunk_dir, name: str = "chunked_a.jsonl", texts: list[str] = TEXTS) -> str:
+    chunk_file = str(chunk_dir / name)
+    write_chunk_file((Document(page_content=text, metadata={"source": "a.pdf"}) for text in texts), chunk_file)
+    return chunk_file
+
+
+def test_chunk_id_round_trip():
+    chunk_id = compute_chunk_id("chunked_a:b.jsonl", 7, "text")
+    assert parse_chunk_id(chunk_id) == ("chunked_a:b.jsonl", 7)
+    assert chunk_content_hash(chunk_id) == chunk_content_hash(compute_chunk_id("other.jsonl", 0, "text"))
+
+
+def test_entries_and_reads_match_the_file(tmp_path):
+    chunk_file = write_chunks(tmp_path)
+    store = ChunkStore(str(tmp_path / "chunked_*.jsonl"))
+    expected_ids = [compute_chunk_id("chunked_a.jsonl", position, text) for position, text in enumerate(TEXTS)]
+
+    assert store.chunk_counts() == {"chunked_a.jsonl": len(TEXTS)}
+    assert store.entries(chunk_file) == [(chunk_id, "a.pdf") for chunk_id in expected_ids]
+    assert [doc.id for doc in store.read(chunk_file)] == expected_ids
+    assert [doc.page_content for doc in store.read(chunk_file, [3, 1])] == [TEXTS[3], TEXTS[1]]
+
+
+def test_get_keeps_order_and_skips_missing_chunks(tmp_path):
+    write_chunks(tmp_path)
+    write_chunks(tmp_path, "chunked_b.jsonl", ["other"])
+    store = ChunkStore(str(tmp_path / "chunked_*.jsonl"))
+    wanted = [compute_chunk_id("chunked_b.jsonl", 0, "other"), compute_chunk_id("chunked_a.jsonl", 1, TEXTS[1]),
+              compute_chunk_id("chunked_a.jsonl", 9, "gone"), compute_chunk_id("chunked_c.jsonl", 0, "gone")]
+    assert [doc.page_content for doc in store.get(wanted)] == ["other", TEXTS[1]]
+
+
+def test_missing_or_stale_index_is_rebuilt(tmp_path):
+    chunk_file = write_chunks(tmp_path)
+    os.remove(chunk_offsets_path_for(chunk_file))
+    os.remove(chunk_ids_path_for(chunk_file))
+    store = ChunkStore(str(tmp_path / "chunked_*.jsonl"))
+    assert store.count(chunk_file) == len(TEXTS)
+
+    # Rewritten behind the store's back: the cached offsets no longer match the file size
+    os.replace(write_chunks(tmp_path, "new.jsonl", ["only one"]), chunk_file)
+    assert store.count(chunk_file) == 1
+    assert [entry[0] for entry in store.entries(chunk_file)] == [compute_chunk_id("chunked_a.jsonl", 0, "only one")]
+
+
+def test_failed_write_keeps_the_previous_file(tmp_path):
+    chunk_file = write_chunks(tmp_path)
+    with pytest.raises(RuntimeError):
+        with ChunkFileWriter(chunk_file) as writer:
+            writer.append(Document(page_content="partial", metadata={}))
+            raise RuntimeError
+    assert ChunkStore(str(tmp_path / "chunked_*.jsonl")).count(chunk_file) == len(TEXTS)
+    assert sorted(os.listdir(tmp_path)) == ["chunked_a.ids.tsv", "chunked_a.jsonl", "chunked_a.offsets.npy"]
@@ -0,0 +1,81 @@
+import random
+
+import numpy as np
+from langchain_core.documents import Document
+from utils.chunk_store import compute_chunk_id
+from utils import dedup_utils
+from utils.dedup_utils import ChunkDeduplicator, MinHasher, MERSENNE_PRIME, MAX_HASH, shingle_hashes
+
+random.seed(0)
+VOCABULARY = [f"w{i}" for i in range(5000)]
+TEXT = " ".join(random.choice(VOCABULARY) for _ in range(300))
+NEAR_TEXT = TEXT.rsplit(" ", 1)[0] + " changed"
+OTHER_TEXT = " ".join(random.choice(VOCABULARY) for _ in range(300))
+
+
+def chunk(source_file: str, position: int, text: str) -> Document:
+    return Document(page_content=text, metadata={"chunk_id": compute_chunk_id(source_file, position, text)})
+
+
+def chunk_ids(documents) -> list[str]:
+    return [doc.metadata["chunk_id"] for doc in documents]
+
+
+def test_signature_matches_exact_universal_hashing():
+    hasher = MinHasher()
+    hashes = shingle_hashes(TEXT)
+    expected = [min(((int(a) * int(x) + int(b)) % MERSENNE_PRIME) & MAX_HASH for x in hashes.tolist())
+                for a, b in zip(hasher.a, hasher.b)]
+    assert hasher.signature(TEXT).tolist() == expected
+
+
+def test_filter_drops_exact_and_near_duplicates():
+    deduplicator = ChunkDeduplicator()
+    documents = [chunk("chunked_a.jsonl", 0, TEXT), chunk("chunked_a.jsonl", 1, OTHER_TEXT),
+                 chunk("chunked_b.jsonl", 0, TEXT), chunk("chunked_c.jsonl", 0, NEAR_TEXT)]
+
+    assert chunk_ids(deduplicator.filter(documents)) == chunk_ids(documents[:2])
+    assert deduplicator.found_duplicates() == {documents[2].metadata["chunk_id"]: documents[0].metadata["chunk_id"],
+                                               documents[3].metadata["chunk_id"]: documents[0].metadata["chunk_id"]}
+    assert (deduplicator.exact, deduplicator.near) == (1, 1)
+
+
+def test_saved_signatures_find_near_duplicates_in_later_runs(tmp_path):
+    path = str(tmp_path / "dedup_index.npz")
+    kept, other = chunk("chunked_a.jsonl", 0, TEXT), chunk("chunked_a.jsonl", 1, OTHER_TEXT)
+    first_run = ChunkDeduplicator()
+    list(first_run.filter([kept, other]))
+    first_run.save(path)
+
+    # Only chunks still stored are kept; the other one was deleted in the meantime
+    later_run = ChunkDeduplicator.load(path, [kept.metadata["chunk_id"]])
+    near, copy_of_deleted = chunk("chunked_c.jsonl", 0, NEAR_TEXT), chunk("chunked_d.jsonl", 0, OTHER_TEXT)
+    assert chunk_ids(later_run.filter([near, copy_of_deleted])) == [copy_of_deleted.metadata["chunk_id"]]
+    assert later_run.duplicates == {near.metadata["chunk_id"]: kept.metadata["chunk_id"]}
+
+
+def test_changed_settings_fall_back_to_exact_matching(tmp_path, monkeypatch):
+    path = str(tmp_path / "dedup_index.npz")
+    kept = chunk("chunked_a.jsonl", 0, TEXT)
+    first_run = ChunkDeduplicator()
+    list(first_run.filter([kept]))
+    first_run.save(path)
+
+    monkeypatch.setattr(dedup_utils, "MINHASH_SEED", dedup_utils.MINHASH_SEED + 1)
+    later_run = ChunkDeduplicator.load(path, [kept.metadata["chunk_id"]])
+    exact, near = chunk("chunked_b.jsonl", 0, TEXT), chunk("chunked_c.jsonl", 0, NEAR_TEXT)
+    assert chunk_ids(later_run.filter([exact, near])) == [near.metadata["chunk_id"]]
+
+
+def test_held_chunks_count_only_once_kept_again(tmp_path):
+    path = str(tmp_path / "dedup_index.npz")
+    kept = chunk("chunked_a.jsonl", 0, TEXT)
+    first_run = ChunkDeduplicator()
+    list(first_run.filter([kept]))
+    first_run.save(path)
+
+    later_run = ChunkDeduplicator.load(path, [], held_ids=[kept.metadata["chunk_id"]])
+    assert later_run._find_near(later_run.hasher.signature(NEAR_TEXT)) is None
+    later_run.keep_held([kept.metadata["chunk_id"]])
+    assert later_run._find_near(later_run.hasher.signature(NEAR_TEXT)) == kept.metadata["chunk_id"]
+    assert np.array_equal(later_run._signatures[kept.metadata["chunk_id"]], first_run.hasher.signature(TEXT))
@@ -0,0 +1,23 @@
+import json
+
+import pytest
+from utils.embed_utils import iter_json_array
+
+ITEMS = [1.5e10, 2, -0.25, 3e-7, 12345678901234567890, "a,]b \"c\"", {"k": [1, 2.5]}, [], True, None]
+
+
+@pytest.mark.parametrize("text", [json.dumps(ITEMS), json.dumps(ITEMS, indent=2), "[1.5e10,2]", "[]", " [ 7 ] "])
+def test_iter_json_array_matches_json_loads_for_every_read_size(tmp_path, text):
+    path = tmp_path / "array.json"
+    path.write_text(text, encoding="utf-8")
+    for read_size in range(1, 17):
+        assert list(iter_json_array(str(path), read_size)) == json.loads(text), read_size
+
+
+@pytest.mark.parametrize("text", ["{}", "[1x]", "[1,", "[1 2]"])
+def test_iter_json_array_rejects_malformed_input(tmp_path, text):
+    path = tmp_path / "array.json"
+    path.write_text(text, encoding="utf-8")
+    for read_size in (1, 3, 16):
+        with pytest.raises(json.JSONDecodeError):
+            list(iter_json_array(str(path), read_size))
@@ -0,0 +1,87 @@
+import os
+
+from utils.ingest_utils import (plan_ingestion, has_changes, record_source, remove_source_outputs,
+                                remove_legacy_chunk_files, chunk_offsets_path_for, chunk_ids_path_for)
+
+
+def write(path, content: str) -> str:
+    path.write_text(content, encoding="utf-8")
+    return str(path)
+
+
+def setup_source(tmp_path):
+    pdf_dir, pages_dir, chunked_dir = (tmp_path / name for name in ("pdfs", "pages", "chunked"))
+    for directory in (pdf_dir, pages_dir, chunked_dir):
+        directory.mkdir(parents=True)
+    source = write(pdf_dir / "a.pdf", "first version")
+    pages = write(pages_dir / "a_pages.json", "[]")
+    chunks = write(chunked_dir / "chunked_a_pages.jsonl", "")
+    manifest = {"sources": {}}
+    plan = plan_ingestion(manifest, str(pdf_dir / "*.pdf"), str(tmp_path / "*.mp4"))
+    record_source(manifest, source, plan["fingerprints"][source], {"json": pages, "chunks": chunks})
+    return manifest, source, str(pdf_dir / "*.pdf"), str(tmp_path / "*.mp4")
+
+
+def test_new_source_is_planned(tmp_path):
+    (tmp_path / "a.pdf").write_text("content")
+    plan = plan_ingestion({"sources": {}}, str(tmp_path / "*.pdf"), str(tmp_path / "*.mp4"))
+    assert plan["pdfs"] == [str(tmp_path / "a.pdf")]
+    assert has_changes(plan)
+
+
+def test_unchanged_source_is_skipped(tmp_path):
+    manifest, _, pdf_pattern, video_pattern = setup_source(tmp_path)
+    plan = plan_ingestion(manifest, pdf_pattern, video_pattern)
+    assert not has_changes(plan)
+    assert plan["touched"] == []
+
+
+def test_touched_source_refreshes_fingerprint_without_reprocessing(tmp_path):
+    manifest, source, pdf_pattern, video_pattern = setup_source(tmp_path)
+    stat = os.stat(source)
+    os.utime(source, (stat.st_atime, stat.st_mtime + 10))
+
+    plan = plan_ingestion(manifest, pdf_pattern, video_pattern)
+    assert plan["touched"] == [source]
+    assert not has_changes(plan)
+    assert manifest["sources"][source]["fingerprint"]["mtime"] == stat.st_mtime + 10
+
+
+def test_modified_removed_and_unchunked_sources(tmp_path):
+    manifest, source, pdf_pattern, video_pattern = setup_source(tmp_path)
+    write(tmp_path / "pdfs" / "a.pdf", "second version")
+    assert plan_ingestion(manifest, pdf_pattern, video_pattern)["pdfs"] == [source]
+
+    manifest, source, pdf_pattern, video_pattern = setup_source(tmp_path / "chunk")
+    os.remove(manifest["sources"][source]["outputs"]["chunks"])
+    assert plan_ingestion(manifest, pdf_pattern, video_pattern)["chunk"] == [source]
+
+    os.remove(source)
+    assert plan_ingestion(manifest, pdf_pattern, video_pattern)["removed"] == [source]
+
+
+def test_replaced_and_removed_chunk_files_take_their_indexes(tmp_path):
+    manifest, source, _, _ = setup_source(tmp_path)
+    old_chunks = manifest["sources"][source]["outputs"]["chunks"]
+    old_files = [old_chunks, write(tmp_path / "chunked" / "chunked_a_pages.offsets.npy", ""),
+                 write(tmp_path / "chunked" / "chunked_a_pages.ids.tsv", "")]
+
+    new_chunks = write(tmp_path / "chunked" / "chunked_b_pages.jsonl", "")
+    new_files = [new_chunks, write(tmp_path / "chunked" / "chunked_b_pages.offsets.npy", ""),
+                 write(tmp_path / "chunked" / "chunked_b_pages.ids.tsv", "")]
+    assert new_files[1:] == [chunk_offsets_path_for(new_chunks), chunk_ids_path_for(new_chunks)]
+    record_source(manifest, source, manifest["sources"][source]["fingerprint"], {"chunks": new_chunks})
+    assert not any(map(os.path.exists, old_files))
+    assert all(map(os.path.exists, new_files))
+
+    remove_source_outputs(manifest, source)
+    assert not any(map(os.path.exists, new_files))
+    assert manifest["sources"] == {}
+
+
+def test_legacy_chunk_files_are_removed(tmp_path):
+    legacy = write(tmp_path / "chunked_a.json", "[]")
+    current = write(tmp_path / "chunked_b.jsonl", "")
+    assert remove_legacy_chunk_files(str(tmp_path)) == 1
+    assert not os.path.exists(legacy)
+    assert os.path.exists(current)
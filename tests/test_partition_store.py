@@ -0,0 +1,80 @@
+from utils.partition_store import PartitionIndex, partition_collection_name
+from config import COLLECTION_NAME
+
+
+def chunk(source_file: str, position: int) -> str:
+    return f"{source_file}:{position}:{position:016x}"
+
+
+def make_index(partition_by: str | None = "category") -> PartitionIndex:
+    index = PartitionIndex(partition_by)
+    for source_file, category, source in (("chunked_a.jsonl", "pdf", "sources/a.pdf"),
+                                          ("chunked_b.jsonl", "slides", "sources/b.pdf"),
+                                          ("chunked_v.jsonl", "video_transcript", "sources/v.mp4")):
+        index.add_file({"source_file": source_file, "category": category, "source": source})
+    return index
+
+
+def test_plan_without_filter_searches_every_collection_whole():
+    index = make_index()
+    assert index.plan(None) == dict.fromkeys(index.collections)
+
+
+def test_plan_leaves_out_collections_without_matching_files():
+    index = make_index()
+    assert index.plan({"category": ["pdf"]}) == {partition_collection_name("pdf"): None}
+
+
+def test_plan_restricts_partly_matching_collections_to_matching_files():
+    index = make_index(partition_by=None)
+    assert index.plan({"source": ["a.pdf"]}) == {COLLECTION_NAME: ({"chunked_a.jsonl"}, set())}
+
+
+def test_plan_adds_only_the_kept_chunks_of_partial_duplicates():
+    # b.pdf shares one chunk with a.pdf, which was kept in a's partition
+    index = make_index()
+    index.add_duplicates({"source_file": "chunked_b.jsonl"}, [chunk("chunked_a.jsonl", 3)])
+
+    assert index.plan({"source": ["b.pdf"]}) == {
+        partition_collection_name("slides"): None,
+        partition_collection_name("pdf"): (set(), {chunk("chunked_a.jsonl", 3)}),
+    }
+    # The other direction is unaffected: a.pdf's filter never brings in b.pdf's own chunks
+    assert index.plan({"source": ["a.pdf"]}) == {partition_collection_name("pdf"): None}
+
+
+def test_plan_with_kept_chunks_in_a_partly_matching_collection():
+    index = make_index(partition_by=None)
+    index.add_duplicates({"source_file": "chunked_b.jsonl"}, [chunk("chunked_a.jsonl", 3)])
+    assert index.plan({"source": ["b.pdf"]}) == {
+        COLLECTION_NAME: ({"chunked_b.jsonl"}, {chunk("chunked_a.jsonl", 3)})
+    }
+
+
+def test_file_with_only_duplicates_stays_searchable():
+    index = make_index()
+    index.add_duplicates({"source_file": "chunked_c.jsonl", "category": "copies", "source": "sources/c.pdf"},
+                         [chunk("chunked_a.jsonl", 0), chunk("chunked_a.jsonl", 1)])
+
+    assert index.files["chunked_c.jsonl"]["collection"] == partition_collection_name("pdf")
+    assert index.matching_files({"category": ["copies"]}) == {"chunked_c.jsonl"}
+    assert index.plan({"source": ["c.pdf"]}) == {
+        partition_collection_name("pdf"): ({"chunked_c.jsonl"}, {chunk("chunked_a.jsonl", 0),
+                                                                 chunk("chunked_a.jsonl", 1)})
+    }
+
+
+def test_duplicates_of_unknown_chunk_files_are_ignored():
+    index = make_index()
+    index.add_duplicates({"source_file": "chunked_c.jsonl"}, [chunk("chunked_gone.jsonl", 0)])
+    assert "chunked_c.jsonl" not in index.files
+
+
+def test_remove_files_drops_collections_left_empty(tmp_path):
+    index = make_index()
+    assert index.remove_files(["chunked_v.jsonl"]) == [partition_collection_name("video_transcript")]
+    path = str(tmp_path / "partitions.json")
+    index.save(path)
+    loaded = PartitionIndex.load(path)
+    assert (loaded.partition_by, loaded.files, loaded.collections) == (index.partition_by, index.files,
+                                                                       index.collections)
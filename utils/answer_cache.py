@@ -0,0 +1,302 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+from utils.embed_utils import read_collection_revision
+from utils.embedding_cache import known_query_vector
+from utils.instrumentation import span
+from config import (ANSWER_CACHE_PATH, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS,
+                    ANSWER_CACHE_SIMILARITY, EMBED_REVISION_FILE)
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, drop the search_query prefix, collapse whitespace and trailing punctuation"""
+    query = query.removeprefix("search_query:").strip().lower()
+    query = re.sub(r"\s+", " ", query)
+    return query.rstrip("?!. ")
+
+
+class AnswerCache:
+    """Answers keyed by normalized query + retrieved chunk IDs, with semantic lookup by query embedding.
+
+    Entries live in SQLite with TTL and LRU eviction; their query vectors are
+    also kept in an in-memory matrix so a semantic lookup is one matrix-vector
+    product. All entries are dropped when the embed_chunks collection changes.
+    Lookups only see entries stored under the same scope (the metadata filter
+    of the retriever), so a filtered answer is never served unfiltered.
+    """
+
+    def __init__(self, cache_path: str = ANSWER_CACHE_PATH, max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS, similarity: float | None = ANSWER_CACHE_SIMILARITY,
+                 revision_file: str = EMBED_REVISION_FILE, scope: str = ""):
+        self.scope = scope
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self.revision_file = revision_file
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " id INTEGER PRIMARY KEY, normalized_query TEXT NOT NULL, chunk_ids TEXT NOT NULL,"
+            " query_vector BLOB NOT NULL, answer TEXT NOT NULL, context TEXT NOT NULL,"
+            " revision TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL, scope TEXT NOT NULL DEFAULT '')"
+        )
+        # Caches created before scopes existed
+        if "scope" not in [column[1] for column in self._conn.execute("PRAGMA table_info(answers)")]:
+            self._conn.execute("ALTER TABLE answers ADD COLUMN scope TEXT NOT NULL DEFAULT ''")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_key ON answers(normalized_query, chunk_ids)")
+        self._conn.commit()
+
+        self._revision_mtime = None
+        self._revision = None
+        self._check_revision()
+        self._load_vectors()
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _check_revision(self) -> None:
+        """Drop every entry if the collection changed since they were cached"""
+        try:
+            mtime = os.stat(self.revision_file).st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self._revision_mtime and self._revision is not None:
+            return
+
+        self._revision_mtime = mtime
+        self._revision = read_collection_revision(self.revision_file)
+        stale = self._conn.execute("DELETE FROM answers WHERE revision != ?", (self._revision,)).rowcount
+        self._conn.commit()
+        if stale > 0:
+            print(f"Answer cache: dropped {stale} entries after the collection changed")
+            self._load_vectors()
+
+    def _load_vectors(self) -> None:
+        rows = self._conn.execute("SELECT id, query_vector FROM answers WHERE scope = ?", (self.scope,)).fetchall()
+        self._ids = [row[0] for row in rows]
+        self._vectors = (
+            np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+            if rows else None
+        )
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        expired = self._conn.execute("DELETE FROM answers WHERE created_at < ?", (cutoff,)).rowcount
+        # Commit even if nothing expired: the DELETE opened a write transaction that locks out other processes
+        self._conn.commit()
+        if expired > 0:
+            self._load_vectors()
+
+    def _entry(self, row_id: int) -> dict | None:
+        """Cached answer of a row, or None if another process sharing the cache file evicted it"""
+        row = self._conn.execute(
+            "SELECT answer, context, normalized_query FROM answers WHERE id = ?", (row_id,)
+        ).fetchone()
+        if row is None:
+            self._load_vectors()
+            return None
+        answer, context, normalized_query = row
+        self._conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), row_id))
+        self._conn.commit()
+        return {
+            "answer": answer,
+            "context": [Document(page_content=doc["page_content"], metadata=doc["metadata"])
+                        for doc in json.loads(context)],
+            "cached_query": normalized_query
+        }
+
+    def lookup_semantic(self, query_vector: list[float]) -> dict | None:
+        """Cached answer of the most similar earlier query, if within the cosine threshold"""
+        if self.similarity is None:
+            return None
+
+        with self._lock:
+            self._check_revision()
+            self._expire()
+            if self._vectors is None:
+                return None
+
+            vector = np.asarray(query_vector, dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+            scores = self._vectors @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity:
+                return None
+
+            entry = self._entry(self._ids[best])
+            if entry is None:
+                return None
+            entry["similarity"] = float(scores[best])
+            self.hits += 1
+            return entry
+
+    def lookup_exact(self, query: str, chunk_ids: list[str]) -> dict | None:
+        """Cached answer for the same normalized query with the same retrieved chunks"""
+        with self._lock:
+            self._check_revision()
+            self._expire()
+            row = self._conn.execute(
+                "SELECT id FROM answers WHERE normalized_query = ? AND chunk_ids = ? AND scope = ?",
+                (normalize_query(query), json.dumps(chunk_ids), self.scope)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            entry = self._entry(row[0])
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry
+
+    def store(self, query: str, query_vector: list[float], chunk_ids: list[str],
+              answer: str, context: list[Document]) -> None:
+        """Cache an answer, evicting the least recently used entries past max_entries"""
+        vector = np.asarray(query_vector, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        now = time.time()
+
+        with self._lock:
+            self._check_revision()
+            row_id = self._conn.execute(
+                "INSERT INTO answers (normalized_query, chunk_ids, query_vector, answer, context, revision,"
+                " created_at, last_used, scope) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (normalize_query(query), json.dumps(chunk_ids), vector.tobytes(), answer,
+                 json.dumps([{"page_content": doc.page_content, "metadata": doc.metadata} for doc in context],
+                            ensure_ascii=False),
+                 self._revision, now, now, self.scope)
+            ).lastrowid
+
+            # Entries of every scope share the bound
+            overflow = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used LIMIT ?)",
+                    (overflow,)
+                )
+                self._conn.commit()
+                self._load_vectors()
+            else:
+                self._conn.commit()
+                self._ids.append(row_id)
+                self._vectors = vector[None, :] if self._vectors is None else np.vstack([self._vectors, vector])
+
+
+def chunk_ids_of(documents: list[Document]) -> list[str]:
+    """IDs of retrieved chunks, used in the exact cache key"""
+    return [doc.metadata.get("chunk_id") or doc.id or doc.page_content[:64] for doc in documents]
+
+
+class CachedRAGChain:
+    """Wraps the retriever and answer chain with an AnswerCache.
+
+    Exposes the same invoke()/stream() outputs as create_retrieval_chain, and
+    their ainvoke()/astream() counterparts, so execute_query, interactive
+    mode, the server and the async API work unchanged.
+    """
+
+    def __init__(self, retriever, question_answer_chain, embeddings, cache: AnswerCache):
+        self.retriever = retriever
+        self.question_answer_chain = question_answer_chain
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def _lookup(self, query: str):
+        """Semantic lookup before retrieval, then an exact lookup on the retrieved chunks"""
+        with span("query.embed"):
+            query_vector = self.embeddings.embed_query(query)
+        entry = self.cache.lookup_semantic(query_vector)
+        if entry is not None:
+            print(f"⚡ Cached answer (similarity {entry['similarity']:.3f} with \"{entry['cached_query']}\")")
+            return query_vector, entry["context"], entry
+
+        with known_query_vector(query, query_vector):
+            context = self.retriever.invoke(query)
+        entry = self.cache.lookup_exact(query, chunk_ids_of(context))
+        if entry is not None:
+            print("⚡ Cached answer (same query and retrieved chunks)")
+        return query_vector, context, entry
+
+    async def _alookup(self, query: str):
+        # Cache reads are fast SQLite/NumPy work and stay on the event loop; embedding and retrieval are awaited
+        with span("query.embed"):
+            query_vector = await self.embeddings.aembed_query(query)
+        entry = self.cache.lookup_semantic(query_vector)
+        if entry is not None:
+            print(f"⚡ Cached answer (similarity {entry['similarity']:.3f} with \"{entry['cached_query']}\")")
+            return query_vector, entry["context"], entry
+
+        with known_query_vector(query, query_vector):
+            context = await self.retriever.ainvoke(query)
+        entry = self.cache.lookup_exact(query, chunk_ids_of(context))
+        if entry is not None:
+            print("⚡ Cached answer (same query and retrieved chunks)")
+        return query_vector, context, entry
+
+    def invoke(self, inputs: dict) -> dict:
+        query = inputs["input"]
+        query_vector, context, entry = self._lookup(query)
+        if entry is not None:
+            return {"input": query, "context": entry["context"], "answer": entry["answer"]}
+
+        answer = self.question_answer_chain.invoke({"input": query, "context": context})
+        self.cache.store(query, query_vector, chunk_ids_of(context), answer, context)
+        return {"input": query, "context": context, "answer": answer}
+
+    def stream(self, inputs: dict):
+        query = inputs["input"]
+        yield {"input": query}
+
+        query_vector, context, entry = self._lookup(query)
+        if entry is not None:
+            yield {"context": entry["context"]}
+            yield {"answer": entry["answer"]}
+            return
+
+        yield {"context": context}
+        answer_parts = []
+        for token in self.question_answer_chain.stream({"input": query, "context": context}):
+            answer_parts.append(token)
+            yield {"answer": token}
+        self.cache.store(query, query_vector, chunk_ids_of(context), "".join(answer_parts), context)
+
+    async def ainvoke(self, inputs: dict) -> dict:
+        query = inputs["input"]
+        query_vector, context, entry = await self._alookup(query)
+        if entry is not None:
+            return {"input": query, "context": entry["context"], "answer": entry["answer"]}
+
+        answer = await self.question_answer_chain.ainvoke({"input": query, "context": context})
+        self.cache.store(query, query_vector, chunk_ids_of(context), answer, context)
+        return {"input": query, "context": context, "answer": answer}
+
+    async def astream(self, inputs: dict):
+        query = inputs["input"]
+        yield {"input": query}
+
+        query_vector, context, entry = await self._alookup(query)
+        if entry is not None:
+            yield {"context": entry["context"]}
+            yield {"answer": entry["answer"]}
+            return
+
+        yield {"context": context}
+        answer_parts = []
+        async for token in self.question_answer_chain.astream({"input": query, "context": context}):
+            answer_parts.append(token)
+            yield {"answer": token}
+        self.cache.store(query, query_vector, chunk_ids_of(context), "".join(answer_parts), context)
@@ -0,0 +1,94 @@
+import csv
+import json
+import threading
+from pathlib import Path
+
+# Column or key holding the question, in order of preference
+QUERY_FIELDS = ("query", "question", "input")
+
+
+def default_output_path(input_path: str) -> str:
+    """questions.csv -> questions_answers.jsonl, next to the input file"""
+    path = Path(input_path)
+    return str(path.with_name(f"{path.stem}_answers.jsonl"))
+
+
+def _query_of(record: dict) -> str | None:
+    for field in QUERY_FIELDS:
+        if record.get(field):
+            return str(record[field]).strip()
+    return None
+
+
+def read_batch_queries(input_path: str) -> list[dict]:
+    """Read {"id", "query"} records from a JSONL or CSV file.
+
+    JSONL lines and CSV rows need a "query" (or "question") field; "id" is
+    optional and defaults to the line or row number. Any other fields are
+    carried through to the output.
+    """
+    with open(input_path, "r", encoding="utf-8", newline="") as f:
+        if Path(input_path).suffix.lower() == ".csv":
+            records = list(csv.DictReader(f))
+        else:
+            records = []
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"{input_path}:{line_number}: invalid JSON ({e})") from e
+
+    queries, seen_ids = [], set()
+    for number, record in enumerate(records, 1):
+        query = _query_of(record)
+        if not query:
+            print(f"Warning: record {number} of {input_path} has no query, skipping...")
+            continue
+        query_id = str(record.get("id") or number)
+        if query_id in seen_ids:
+            raise ValueError(f"{input_path}: duplicate query id {query_id!r}")
+        seen_ids.add(query_id)
+        queries.append({**record, "id": query_id, "query": query})
+    return queries
+
+
+def load_completed_ids(output_path: str) -> set[str]:
+    """IDs already answered in an earlier run; failed queries and a truncated last line are retried"""
+    completed = set()
+    if not Path(output_path).exists():
+        return completed
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "error" not in result:
+                completed.add(str(result["id"]))
+    return completed
+
+
+class BatchResultWriter:
+    """Appends one JSON line per answered query and flushes it, so an interrupted run can resume"""
+
+    def __init__(self, output_path: str):
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(output_path, "a", encoding="utf-8")
+        # A run killed mid-write leaves a partial line; start on a fresh one
+        if self._file.tell() > 0:
+            with open(output_path, "rb") as existing:
+                existing.seek(-1, 2)
+                if existing.read(1) != b"\n":
+                    self._file.write("\n")
+
+    def write(self, result: dict) -> None:
+        line = json.dumps(result, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
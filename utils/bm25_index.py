@@ -0,0 +1,204 @@
+import os
+import re
+import json
+import math
+import shutil
+import hashlib
+from collections import Counter
+from typing import Callable, Iterable
+
+import numpy as np
+from langchain_core.documents import Document
+from config import (BM25_K1, BM25_B)
+
+SEGMENTS_FILE = "segments.json"
+
+# Identifiers like "PaliGemma-3B" are kept whole and also split into their parts
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase word tokens; hyphenated or dotted identifiers also yield their parts"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(re.split(r"[-_.]", token))
+    return tokens
+
+
+def hash_term(term: str) -> int:
+    """64-bit term hash, so the vocabulary is a sorted array that can be searched in place"""
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def segment_name(source_file: str) -> str:
+    return hashlib.sha1(source_file.encode("utf-8")).hexdigest()[:16]
+
+
+def write_segment(segment_dir: str, chunk_ids: list[str], texts: list[str]) -> int:
+    """Write the inverted index of one chunk file as .npy arrays; returns the total token count"""
+    postings = {}  # term hash -> ([doc], [tf])
+    doc_lengths = np.zeros(len(texts), dtype=np.int32)
+
+    for doc, text in enumerate(texts):
+        counts = Counter(tokenize(text))
+        doc_lengths[doc] = sum(counts.values())
+        for term, tf in counts.items():
+            docs, tfs = postings.setdefault(hash_term(term), ([], []))
+            docs.append(doc)
+            tfs.append(min(tf, np.iinfo(np.uint16).max))
+
+    terms = np.array(sorted(postings), dtype=np.uint64)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(postings[int(term)][0]) for term in terms])
+
+    tmp_dir = f"{segment_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "terms.npy"), terms)
+    np.save(os.path.join(tmp_dir, "offsets.npy"), offsets)
+    np.save(os.path.join(tmp_dir, "docs.npy"),
+            np.fromiter((d for term in terms for d in postings[int(term)][0]), dtype=np.int32, count=offsets[-1]))
+    np.save(os.path.join(tmp_dir, "tfs.npy"),
+            np.fromiter((t for term in terms for t in postings[int(term)][1]), dtype=np.uint16, count=offsets[-1]))
+    np.save(os.path.join(tmp_dir, "doc_lengths.npy"), doc_lengths)
+    with open(os.path.join(tmp_dir, "chunk_ids.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(chunk_ids))
+
+    shutil.rmtree(segment_dir, ignore_errors=True)
+    os.replace(tmp_dir, segment_dir)
+    return int(doc_lengths.sum())
+
+
+class Bm25IndexWriter:
+    """Keeps the BM25 index in step with the vector store, one segment per chunk file.
+
+    A chunk file's segment is rewritten only if it has chunks that are not
+    stored yet or its chunk count changed; segments of deleted chunk files
+    are removed by finish().
+    """
+
+    def __init__(self, index_dir: str, stored_ids: dict, rebuild: bool = False):
+        self.index_dir = index_dir
+        self.stored_ids = stored_ids
+        if rebuild:
+            shutil.rmtree(index_dir, ignore_errors=True)
+        os.makedirs(index_dir, exist_ok=True)
+        self.segments = load_segments(index_dir)
+        self.seen_sources = set()
+        self.updated = 0
+
+    def update_file(self, source_file: str, chunk_ids: list[str], load_documents: Callable[[], Iterable[Document]]):
+        """Rewrite the segment of a chunk file if it changed; documents are only loaded in that case"""
+        self.seen_sources.add(source_file)
+        segment = self.segments.get(source_file)
+        # Called before the file's new chunks are embedded, so they are not in stored_ids yet
+        changed = any(chunk_id not in self.stored_ids for chunk_id in chunk_ids)
+        if not changed and segment is not None and segment["num_docs"] == len(chunk_ids):
+            return
+
+        name = segment_name(source_file)
+        texts = [doc.page_content for doc in load_documents()]
+        total_length = write_segment(os.path.join(self.index_dir, name), chunk_ids, texts)
+        self.segments[source_file] = {"segment": name, "num_docs": len(chunk_ids), "total_length": total_length}
+        self.updated += 1
+
+    def finish(self, failed_files: set) -> None:
+        """Drop segments of chunk files that no longer exist and save the segment list"""
+        for source in [source for source in self.segments
+                       if source not in self.seen_sources and source not in failed_files]:
+            shutil.rmtree(os.path.join(self.index_dir, self.segments.pop(source)["segment"]), ignore_errors=True)
+            self.updated += 1
+
+        tmp_path = os.path.join(self.index_dir, f"{SEGMENTS_FILE}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.segments, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, os.path.join(self.index_dir, SEGMENTS_FILE))
+
+
+def load_segments(index_dir: str) -> dict:
+    """Segment list of an index: source_file -> {segment, num_docs, total_length}"""
+    segments_path = os.path.join(index_dir, SEGMENTS_FILE)
+    if not os.path.exists(segments_path):
+        return {}
+    with open(segments_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Bm25Segment:
+    """Memory-mapped arrays of one segment; chunk IDs are read on first use"""
+
+    def __init__(self, segment_dir: str):
+        self.segment_dir = segment_dir
+        self.terms, self.offsets, self.docs, self.tfs, self.doc_lengths = (
+            np.load(os.path.join(segment_dir, f"{name}.npy"), mmap_mode="r")
+            for name in ("terms", "offsets", "docs", "tfs", "doc_lengths")
+        )
+        self._chunk_ids = None
+
+    @property
+    def chunk_ids(self) -> list[str]:
+        if self._chunk_ids is None:
+            with open(os.path.join(self.segment_dir, "chunk_ids.txt"), "r", encoding="utf-8") as f:
+                self._chunk_ids = f.read().split("\n")
+        return self._chunk_ids
+
+    def postings(self, term_hash: np.uint64) -> tuple[np.ndarray, np.ndarray]:
+        position = int(np.searchsorted(self.terms, term_hash))
+        if position == len(self.terms) or self.terms[position] != term_hash:
+            return self.docs[:0], self.tfs[:0]
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.docs[start:end], self.tfs[start:end]
+
+
+class Bm25Index:
+    """Read-only BM25 index over all segments"""
+
+    def __init__(self, index_dir: str, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        segments = load_segments(index_dir)
+        self.source_files = list(segments)
+        self.segments = [Bm25Segment(os.path.join(index_dir, entry["segment"])) for entry in segments.values()]
+        self.num_docs = sum(entry["num_docs"] for entry in segments.values())
+        total_length = sum(entry["total_length"] for entry in segments.values())
+        self.avg_length = total_length / self.num_docs if self.num_docs else 0.0
+
+    def search(self, query: str, k: int, source_files: set[str] = None) -> list[tuple[str, float]]:
+        """Top k (chunk_id, score) pairs for the query, only among chunks of source_files if given"""
+        term_hashes = {np.uint64(hash_term(term)) for term in tokenize(query)}
+        if not term_hashes or self.num_docs == 0:
+            return []
+
+        # Document frequencies are global, so collect postings of all segments first
+        postings = {
+            term_hash: [segment.postings(term_hash) for segment in self.segments]
+            for term_hash in term_hashes
+        }
+        # Only segments of the wanted chunk files are scored
+        searched = [source_files is None or source_file in source_files for source_file in self.source_files]
+        scores = [np.zeros(len(segment.doc_lengths) if wanted else 0, dtype=np.float32)
+                  for segment, wanted in zip(self.segments, searched)]
+
+        for term_postings in postings.values():
+            df = sum(len(docs) for docs, _ in term_postings)
+            if df == 0:
+                continue
+            idf = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            for segment, segment_scores, (docs, tfs), wanted in zip(self.segments, scores, term_postings, searched):
+                if len(docs) == 0 or not wanted:
+                    continue
+                tf = tfs.astype(np.float32)
+                length_norm = 1 - self.b + self.b * segment.doc_lengths[docs] / self.avg_length
+                segment_scores[docs] += idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+
+        results = []
+        for segment, segment_scores in zip(self.segments, scores):
+            candidates = np.flatnonzero(segment_scores)
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(-segment_scores[candidates], k)[:k]]
+            results.extend((segment.chunk_ids[doc], float(segment_scores[doc])) for doc in candidates)
+
+        results.sort(key=lambda result: result[1], reverse=True)
+        return results[:k]
@@ -0,0 +1,186 @@
+import os
+import glob
+import json
+import mmap
+import hashlib
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import numpy as np
+from langchain_core.documents import Document
+from utils.ingest_utils import chunk_offsets_path_for, chunk_ids_path_for
+
+
+def compute_chunk_id(source_file: str, position: int, content: str) -> str:
+    """Build a stable chunk ID from source file, position and content hash"""
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+    return f"{source_file}:{position}:{content_hash}"
+
+
+def parse_chunk_id(chunk_id: str) -> tuple[str, int]:
+    """Chunk file name and line position encoded in a chunk ID"""
+    source_file, position, _ = chunk_id.rsplit(":", 2)
+    return source_file, int(position)
+
+
+def chunk_content_hash(chunk_id: str) -> str:
+    """Content hash encoded in a chunk ID; equal for chunks with identical text"""
+    return chunk_id.rsplit(":", 1)[1]
+
+
+def make_chunk_document(item: dict, chunk_file: str, position: int) -> Document:
+    """Document for a stored chunk, with its source file, position and chunk ID in the metadata"""
+    source_file = Path(chunk_file).name
+    metadata = item["metadata"].copy()
+    metadata["source_file"] = source_file
+    metadata["source_path"] = chunk_file
+    metadata["original_length"] = len(item["page_content"])
+    metadata["chunk_index"] = position
+    metadata["chunk_id"] = compute_chunk_id(source_file, position, item["page_content"])
+    return Document(id=metadata["chunk_id"], page_content=item["page_content"], metadata=metadata)
+
+
+class ChunkFileWriter:
+    """Appends chunks to a JSONL file, recording each line's byte offset and chunk ID.
+
+    Lines, offsets (<name>.offsets.npy) and IDs (<name>.ids.tsv) are written
+    to temporary files and swapped in together on close, so readers never see
+    a chunk file and index that disagree.
+    """
+
+    def __init__(self, output_path: str):
+        self.output_path = str(output_path)
+        self.source_file = Path(output_path).name
+        self.offsets = [0]
+        self.ids = []
+        self._file = open(f"{self.output_path}.tmp", "wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(f"{self.output_path}.tmp")
+
+    def append(self, document: Document) -> None:
+        line = json.dumps({"page_content": document.page_content, "metadata": document.metadata},
+                          ensure_ascii=False).encode("utf-8") + b"\n"
+        self._file.write(line)
+        self.offsets.append(self.offsets[-1] + len(line))
+        chunk_id = compute_chunk_id(self.source_file, len(self.ids), document.page_content)
+        self.ids.append((chunk_id, str(document.metadata.get("source", "unknown"))))
+
+    def close(self) -> None:
+        self._file.close()
+        save_chunk_index(self.output_path, np.array(self.offsets, dtype=np.int64), self.ids, suffix=".tmp")
+        for path in (chunk_offsets_path_for(self.output_path), chunk_ids_path_for(self.output_path),
+                     self.output_path):
+            os.replace(f"{path}.tmp", path)
+
+
+def write_chunk_file(chunks: Iterable[Document], output_path: str) -> int:
+    """Write chunks to a JSONL chunk file with its offset and ID index; returns the number written"""
+    with ChunkFileWriter(output_path) as writer:
+        for chunk in chunks:
+            writer.append(chunk)
+    return len(writer.ids)
+
+
+def save_chunk_index(chunk_file: str, offsets: np.ndarray, ids: list[tuple[str, str]], suffix: str = "") -> None:
+    # np.save appends .npy unless the name already ends with it, so write through a file object
+    with open(chunk_offsets_path_for(chunk_file) + suffix, "wb") as f:
+        np.save(f, offsets)
+    with open(chunk_ids_path_for(chunk_file) + suffix, "w", encoding="utf-8") as f:
+        f.writelines(f"{chunk_id}\t{source}\n" for chunk_id, source in ids)
+
+
+def build_chunk_index(chunk_file: str) -> None:
+    """Index a chunk file that was written without one (e.g. by hand or an older version)"""
+    offsets, ids = [0], []
+    with open(chunk_file, "rb") as f:
+        for line in f:
+            offsets.append(offsets[-1] + len(line))
+            item = json.loads(line)
+            ids.append((make_chunk_document(item, chunk_file, len(ids)).metadata["chunk_id"],
+                        str(item["metadata"].get("source", "unknown"))))
+    save_chunk_index(chunk_file, np.array(offsets, dtype=np.int64), ids)
+
+
+class ChunkStore:
+    """Read access to the JSONL chunk files: IDs without parsing chunks, and chunks by position or ID"""
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.chunk_dir = os.path.dirname(pattern)
+        self._offsets = {}
+
+    def files(self) -> list[str]:
+        return sorted(glob.glob(self.pattern))
+
+    def offsets(self, chunk_file: str) -> np.ndarray:
+        """Byte offset of every line plus the file size, memory-mapped; rebuilt if missing or stale"""
+        offsets_path = chunk_offsets_path_for(chunk_file)
+        size = os.path.getsize(chunk_file)
+        cached = self._offsets.get(chunk_file)
+        if cached is not None and cached[-1] == size:
+            return cached
+
+        if not os.path.exists(offsets_path) or not os.path.exists(chunk_ids_path_for(chunk_file)):
+            build_chunk_index(chunk_file)
+        offsets = np.load(offsets_path, mmap_mode="r")
+        if offsets[-1] != size:
+            build_chunk_index(chunk_file)
+            offsets = np.load(offsets_path, mmap_mode="r")
+
+        self._offsets[chunk_file] = offsets
+        return offsets
+
+    def count(self, chunk_file: str) -> int:
+        return len(self.offsets(chunk_file)) - 1
+
+    def chunk_counts(self) -> dict[str, int]:
+        """Chunks per chunk file, read from the offset indexes"""
+        return {Path(chunk_file).name: self.count(chunk_file) for chunk_file in self.files()}
+
+    def entries(self, chunk_file: str) -> list[tuple[str, str]]:
+        """(chunk ID, source) of every chunk in file order, without parsing the chunks"""
+        self.offsets(chunk_file)
+        with open(chunk_ids_path_for(chunk_file), "r", encoding="utf-8") as f:
+            return [tuple(line.rstrip("\n").split("\t", 1)) for line in f]
+
+    def read(self, chunk_file: str, positions: list[int] = None) -> Iterator[Document]:
+        """Chunks of a file, all of them in order or only the given positions"""
+        if positions is None:
+            with open(chunk_file, "r", encoding="utf-8") as f:
+                for position, line in enumerate(f):
+                    yield make_chunk_document(json.loads(line), chunk_file, position)
+            return
+
+        if not positions:
+            return
+        offsets = self.offsets(chunk_file)
+        with open(chunk_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for position in positions:
+                line = data[offsets[position]:offsets[position + 1]]
+                yield make_chunk_document(json.loads(line), chunk_file, position)
+
+    def get(self, chunk_ids: list[str]) -> list[Document]:
+        """Chunks by ID, in the given order; IDs whose chunk no longer exists are skipped"""
+        positions_by_file = {}
+        for chunk_id in chunk_ids:
+            source_file, position = parse_chunk_id(chunk_id)
+            positions_by_file.setdefault(source_file, []).append(position)
+
+        documents = {}
+        for source_file, positions in positions_by_file.items():
+            chunk_file = os.path.join(self.chunk_dir, source_file)
+            if not os.path.exists(chunk_file):
+                continue
+            count = self.count(chunk_file)
+            for doc in self.read(chunk_file, [position for position in positions if position < count]):
+                documents[doc.id] = doc
+
+        return [documents[chunk_id] for chunk_id in chunk_ids if chunk_id in documents]
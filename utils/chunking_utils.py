@@ -1,86 +1,88 @@
 import json
+import bisect
 from pathlib import Path
+from typing import Iterator
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from config import CHUNKED_TRANSCRIPTS_FILE
-
-def load_transcript_documents(transcript_folder: Path) -> list[Document]:
-    """Load and process transcript files into Document objects"""
-    documents = []
-    
-    # Loop through every .txt file in the folder
-    for file_path in transcript_folder.glob("*.txt"):
-        print(f"Processing {file_path}")
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read().strip() 
-            # Skip empty files
-            if not content:
-                print(f"  Warning: {file_path.name} is empty, skipping...")
-                continue
-            
-            # Create a Document object with the full text and metadata
-            doc = Document(
-                page_content=content,
-                metadata={
-                    "source": file_path.name,
-                    "category": "video_transcript",
-                    "file_path": str(file_path),
-                    "original_length": len(content)
-                }
-            )
-            documents.append(doc)
-            print(f"  ✓ Loaded {len(content)} characters from {file_path.name}")
-            
-        except Exception as e:
-            print(f"  ❌ Error reading {file_path.name}: {e}")
+from utils.embed_utils import iter_json_array
+from config import (CHUNK_SIZE, CHUNK_OVERLAP)
+
+def create_text_splitter() -> RecursiveCharacterTextSplitter:
+    """Splitter shared by PDF pages and transcripts, so all chunks have the same size"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        add_start_index=True
+    )
+
+
+def load_transcript_document(file_path: Path) -> Document | None:
+    """Load a transcript file into a Document, or None if it is empty"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        content = f.read().strip()
+
+    # Skip empty files
+    if not content:
+        print(f"  Warning: {file_path.name} is empty, skipping...")
+        return None
+
+    # Create a Document object with the full text and metadata
+    return Document(
+        page_content=content,
+        metadata={
+            "source": file_path.name,
+            "category": "video_transcript",
+            "file_path": str(file_path),
+            "original_length": len(content)
+        }
+    )
+
+
+def load_page_documents(file_path: Path) -> Iterator[Document]:
+    """Stream the page records the PDF stage extracted"""
+    for item in iter_json_array(str(file_path)):
+        metadata = dict(item["metadata"], category="pdf", original_length=len(item["page_content"]))
+        yield Document(page_content=item["page_content"], metadata=metadata)
+
+
+def load_segment_offsets(segments_path: Path) -> tuple[list[int], list[dict]] | None:
+    """Character offset of every segment within the stripped transcript text"""
+    if not segments_path.exists():
+        return None
+
+    with open(segments_path, "r", encoding="utf-8") as f:
+        segments = json.load(f)["segments"]
+
+    full_text = "".join(segment["text"] for segment in segments)
+    leading_whitespace = len(full_text) - len(full_text.lstrip())
+
+    offsets = []
+    position = -leading_whitespace
+    for segment in segments:
+        offsets.append(max(position, 0))
+        position += len(segment["text"])
+    return offsets, segments
+
+
+def add_segment_timestamps(chunks: list[Document], transcript_folder: Path) -> None:
+    """Add start_time/end_time (seconds into the video) to transcript chunks with saved segments"""
+    segment_offsets = {}
+
+    for chunk in chunks:
+        source = chunk.metadata.get("source", "")
+        if "start_index" not in chunk.metadata or not source.endswith("_transcript.txt"):
+            continue
+
+        if source not in segment_offsets:
+            segments_path = transcript_folder / (source.removesuffix("_transcript.txt") + "_segments.json")
+            segment_offsets[source] = load_segment_offsets(segments_path)
+        if not segment_offsets[source]:
             continue
-    
-    return documents
-
-
-def validate_loaded_documents(documents: list[Document]) -> bool:
-    """Validate that documents were successfully loaded"""
-    if not documents:
-        print("No valid documents found to process!")
-        return False
-    
-    print(f"\nLoaded {len(documents)} transcript files")
-    return True
-
-
-def split_documents_into_chunks(
-    text_splitter: RecursiveCharacterTextSplitter, 
-    documents: list[Document]
-) -> list[Document]:
-    """Split documents into chunks using the provided text splitter"""
-    print("Splitting documents into chunks...")
-    all_splits = text_splitter.split_documents(documents)
-    
-    print(f"Created {len(all_splits)} chunks from {len(documents)} transcript files")
-    return all_splits
-
-
-def documents_to_dicts(documents: list[Document]) -> list[dict]:
-    """Convert Document objects to list of dictionaries"""
-    return [
-        {
-            "page_content": doc.page_content, 
-            "metadata": doc.metadata
-        } 
-        for doc in documents
-    ]
-    
-    
-def save_chunks_to_json(docs_to_save: list[dict], output_folder: Path, filename: str = CHUNKED_TRANSCRIPTS_FILE) -> None:
-    """Save chunked transcripts to JSON file"""
-    
-    output_file = output_folder / filename
-    
-    try:
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump(docs_to_save, f, ensure_ascii=False, indent=4)
-        
-        print(f"\n✓ Successfully saved {len(docs_to_save)} chunks to {output_file}")
-    except Exception as e:
-        print(f"❌ Error saving to {output_file}: {e}")
\ No newline at end of file
+
+        offsets, segments = segment_offsets[source]
+        start = chunk.metadata["start_index"]
+        end = start + max(len(chunk.page_content) - 1, 0)
+        first = max(bisect.bisect_right(offsets, start) - 1, 0)
+        last = max(bisect.bisect_right(offsets, end) - 1, 0)
+        chunk.metadata["start_time"] = round(segments[first]["start"], 2)
+        chunk.metadata["end_time"] = round(segments[last]["end"], 2)
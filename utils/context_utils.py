@@ -0,0 +1,111 @@
+import re
+import math
+
+from langchain_core.documents import Document
+from utils.bm25_index import tokenize
+from config import (CONTEXT_TOKEN_BUDGET, CONTEXT_MAX_TOKENS_PER_DOC, CHUNK_OVERLAP)
+
+# llama3's tokenizer averages ~1.3 tokens per word/punctuation piece of English text
+TOKENS_PER_PIECE = 1.3
+TOKEN_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+MIN_OVERLAP_CHARS = 32  # Shorter shared text between chunks is treated as a coincidence
+MIN_USEFUL_TOKENS = 32  # Stop packing when less budget than this is left
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate llama3 token count without loading a tokenizer"""
+    return math.ceil(len(TOKEN_PIECE_PATTERN.findall(text)) * TOKENS_PER_PIECE)
+
+
+def strip_document_prefix(text: str) -> str:
+    """Drop the nomic-embed-text prefix stored with each chunk, it only costs prompt tokens"""
+    return text.removeprefix("search_document: ")
+
+
+def find_overlap(first: str, second: str, max_overlap: int = 2 * CHUNK_OVERLAP) -> int:
+    """Length of the longest suffix of first that is a prefix of second (the splitter's chunk overlap)"""
+    tail = first[-max_overlap:]
+    probe = second[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+
+    position = tail.find(probe)
+    while position != -1:
+        if second.startswith(tail[position:]):
+            return len(tail) - position
+        position = tail.find(probe, position + 1)
+    return 0
+
+
+def remove_overlap(text: str, packed: list[str]) -> str | None:
+    """Strip text already in the packed context; None if nothing new is left"""
+    for other in packed:
+        if text in other:
+            return None
+        text = text[find_overlap(other, text):]
+        overlap = find_overlap(text, other)
+        if overlap:
+            text = text[:-overlap]
+    return text.strip() or None
+
+
+def select_relevant_sentences(text: str, query: str, token_budget: int) -> str:
+    """Keep the sentences sharing most terms with the query that fit the budget, in their original order"""
+    sentences = [sentence.strip() for sentence in SENTENCE_PATTERN.split(text) if sentence.strip()]
+    query_terms = set(tokenize(query))
+    scores = [len(query_terms & set(tokenize(sentence))) for sentence in sentences]
+    # Sentences without any query term are only kept when no sentence matches
+    ranked = sorted(
+        (index for index, score in enumerate(scores) if score > 0 or not any(scores)),
+        key=lambda index: scores[index],
+        reverse=True
+    )
+
+    kept, used = set(), 0
+    for index in ranked:
+        tokens = estimate_tokens(sentences[index])
+        if used + tokens <= token_budget:
+            kept.add(index)
+            used += tokens
+    return " ".join(sentences[index] for index in sorted(kept))
+
+
+def pack_context(documents: list[Document], query: str, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                 max_tokens_per_doc: int = CONTEXT_MAX_TOKENS_PER_DOC) -> tuple[list[Document], dict]:
+    """Fit retrieved documents into a token budget in relevance order.
+
+    Text shared with higher ranked documents (chunk overlap, repeated pages)
+    is removed, and documents too long for their share of the budget are
+    trimmed to their most query-relevant sentences. Returns the packed
+    documents and counters for logging.
+    """
+    packed, packed_texts = [], []
+    stats = {"retrieved": len(documents), "deduplicated": 0, "trimmed": 0, "dropped": 0, "tokens": 0}
+
+    for doc in documents:
+        remaining = token_budget - stats["tokens"]
+        if remaining < MIN_USEFUL_TOKENS:
+            stats["dropped"] += 1
+            continue
+
+        text = remove_overlap(strip_document_prefix(doc.page_content), packed_texts)
+        if text is None:
+            stats["deduplicated"] += 1
+            continue
+
+        tokens = estimate_tokens(text)
+        limit = min(remaining, max_tokens_per_doc)
+        if tokens > limit:
+            text = select_relevant_sentences(text, query, limit)
+            if not text:
+                stats["dropped"] += 1
+                continue
+            tokens = estimate_tokens(text)
+            stats["trimmed"] += 1
+
+        packed.append(Document(id=doc.id, page_content=text, metadata=doc.metadata))
+        packed_texts.append(text)
+        stats["tokens"] += tokens
+
+    return packed, stats
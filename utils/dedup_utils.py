@@ -0,0 +1,234 @@
+import os
+import re
+import zlib
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import numpy as np
+from langchain_core.documents import Document
+from utils.chunk_store import ChunkStore, chunk_content_hash
+from config import (DEDUP_JACCARD_THRESHOLD, DEDUP_NUM_PERM, DEDUP_SHINGLE_SIZE)
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+# Fixed so signatures saved by earlier runs stay comparable; RandomState streams never change between NumPy versions.
+# Saved with the signatures, so changing how they are computed means changing the seed (2: 32-bit coefficients)
+MINHASH_SEED = 2
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def shingle_hashes(text: str, size: int = DEDUP_SHINGLE_SIZE) -> np.ndarray:
+    """32-bit hashes of the distinct word n-grams of text, ignoring case, punctuation and spacing"""
+    words = WORD_PATTERN.findall(text.lower())
+    shingles = {" ".join(words[start:start + size]) for start in range(max(len(words) - size + 1, 1))}
+    return np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64,
+                       count=len(shingles))
+
+
+class MinHasher:
+    """MinHash signatures: the minimum of num_perm random hash functions over the shingles of a text"""
+
+    def __init__(self, num_perm: int = DEDUP_NUM_PERM, shingle_size: int = DEDUP_SHINGLE_SIZE,
+                 seed: int = MINHASH_SEED):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        # Below 2^32 like the shingle hashes, so a * x + b fits in 64 bits and is reduced mod p exactly
+        self.a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingle_hashes(text, self.shingle_size)
+        # (a * x + b) mod p, keeping the low 32 bits
+        permuted = (np.outer(hashes, self.a) + self.b) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+def lsh_bands(threshold: float, num_perm: int) -> tuple[int, int]:
+    """LSH bands and rows per band whose S-curve rises just below threshold, so near-duplicates share a band"""
+    layouts = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    below = [(bands, rows) for bands, rows in layouts if (1 / bands) ** (1 / rows) <= threshold]
+    return max(below or layouts[:1], key=lambda layout: (1 / layout[0]) ** (1 / layout[1]))
+
+
+class ChunkDeduplicator:
+    """Drops chunks whose text duplicates a chunk that is already kept.
+
+    Exact copies are found by the content hash in the chunk ID, near copies
+    by MinHash signatures bucketed with LSH and confirmed by their estimated
+    Jaccard similarity. Signatures of kept chunks are saved, so later runs
+    also catch copies of chunks embedded before.
+    """
+
+    def __init__(self, threshold: float = DEDUP_JACCARD_THRESHOLD, num_perm: int = DEDUP_NUM_PERM,
+                 shingle_size: int = DEDUP_SHINGLE_SIZE):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        self.duplicates = {}  # duplicate chunk_id -> kept chunk_id, found in this run
+        self.exact = 0
+        self.near = 0
+        self._lock = threading.Lock()
+        self._content_hashes = {}  # content hash -> kept chunk_id
+        self._signatures = {}  # kept chunk_id -> signature
+        self._buckets = {}  # (band, band values) -> kept chunk_ids
+        self._held = {}  # chunk_id -> saved signature (or None) of a stored chunk that is not kept yet
+
+    def _band_keys(self, signature: np.ndarray) -> list[tuple[int, bytes]]:
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def add(self, chunk_id: str, signature: np.ndarray = None) -> None:
+        """Keep a chunk; without a signature only its exact copies are found"""
+        with self._lock:
+            self._content_hashes.setdefault(chunk_content_hash(chunk_id), chunk_id)
+            if signature is not None and chunk_id not in self._signatures:
+                self._signatures[chunk_id] = signature
+                for key in self._band_keys(signature):
+                    self._buckets.setdefault(key, []).append(chunk_id)
+
+    def keep_held(self, chunk_ids: Iterable[str]) -> None:
+        """Keep held chunks again, with their saved signatures, e.g. once their rewritten chunk file still has them"""
+        for chunk_id in chunk_ids:
+            if chunk_id in self._held:
+                self.add(chunk_id, self._held.pop(chunk_id))
+
+    def remove(self, chunk_ids: Iterable[str]) -> None:
+        """Forget kept chunks that were deleted from the collection"""
+        with self._lock:
+            for chunk_id in chunk_ids:
+                content_hash = chunk_content_hash(chunk_id)
+                if self._content_hashes.get(content_hash) == chunk_id:
+                    del self._content_hashes[content_hash]
+                signature = self._signatures.pop(chunk_id, None)
+                if signature is None:
+                    continue
+                for key in self._band_keys(signature):
+                    bucket = self._buckets[key]
+                    bucket.remove(chunk_id)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def _find_near(self, signature: np.ndarray) -> str | None:
+        """Most similar kept chunk sharing an LSH band, if its estimated Jaccard reaches the threshold"""
+        with self._lock:
+            candidates = {chunk_id for key in self._band_keys(signature) for chunk_id in self._buckets.get(key, ())}
+            best_id, best_similarity = None, self.threshold
+            for chunk_id in candidates:
+                similarity = np.count_nonzero(self._signatures[chunk_id] == signature) / len(signature)
+                if similarity >= best_similarity:
+                    best_id, best_similarity = chunk_id, similarity
+        return best_id
+
+    def filter(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """Yield only chunks that duplicate no kept chunk; the yielded chunks are kept from then on"""
+        for doc in documents:
+            chunk_id = doc.metadata["chunk_id"]
+            with self._lock:
+                kept_id = self._content_hashes.get(chunk_content_hash(chunk_id))
+            if kept_id is not None:
+                self._record_duplicate(chunk_id, kept_id, exact=True)
+                continue
+
+            signature = self.hasher.signature(doc.page_content)
+            kept_id = self._find_near(signature)
+            if kept_id is not None:
+                self._record_duplicate(chunk_id, kept_id, exact=False)
+                continue
+
+            self.add(chunk_id, signature)
+            yield doc
+
+    def _record_duplicate(self, chunk_id: str, kept_id: str, exact: bool) -> None:
+        with self._lock:
+            self.duplicates[chunk_id] = kept_id
+            if exact:
+                self.exact += 1
+            else:
+                self.near += 1
+
+    def found_duplicates(self) -> dict[str, str]:
+        """Copy of the duplicates found so far, safe to take while chunks are still being filtered"""
+        with self._lock:
+            return dict(self.duplicates)
+
+    def save(self, path: str) -> None:
+        """Atomically write the signatures of kept chunks"""
+        with self._lock:
+            chunk_ids = list(self._signatures)
+            signatures = np.array([self._signatures[chunk_id] for chunk_id in chunk_ids], dtype=np.uint32)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"  # np.savez appends .npz to any other name
+        np.savez(tmp_path, ids=np.array(chunk_ids, dtype=str),
+                 signatures=signatures.reshape(len(chunk_ids), self.hasher.num_perm),
+                 params=np.array([self.hasher.num_perm, self.hasher.shingle_size, MINHASH_SEED]))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, stored_ids: Iterable[str], held_ids: Iterable[str] = ()) -> "ChunkDeduplicator":
+        """Deduplicator that keeps the stored chunks, with the signatures saved for them by earlier runs.
+
+        Signatures of held_ids are loaded too, but those chunks are only kept
+        once passed to keep_held().
+        """
+        deduplicator = cls()
+        stored_ids = set(stored_ids)
+        deduplicator._held = dict.fromkeys(held_ids)
+        for chunk_id in stored_ids:
+            deduplicator.add(chunk_id)
+
+        if not os.path.exists(path):
+            return deduplicator
+        try:
+            with np.load(path) as saved:
+                params = [deduplicator.hasher.num_perm, deduplicator.hasher.shingle_size, MINHASH_SEED]
+                if saved["params"].tolist() != params:
+                    print("Warning: deduplication settings changed, stored chunks only match exact copies")
+                    return deduplicator
+                for chunk_id, signature in zip(saved["ids"].tolist(), saved["signatures"]):
+                    if chunk_id in stored_ids:
+                        deduplicator.add(chunk_id, signature)
+                    elif chunk_id in deduplicator._held:
+                        deduplicator._held[chunk_id] = signature
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Warning: Cannot read deduplication index {path}: {e}")
+        return deduplicator
+
+
+def live_chunk_ids(store: ChunkStore, stored_ids: dict, pending_files: set[str] = frozenset()) -> set[str]:
+    """IDs in the chunk file indexes, plus the stored IDs of files that cannot be read (they are not deleted).
+
+    Chunk files in pending_files are about to be rewritten, so none of their IDs count.
+    """
+    live_ids, unreadable_files = set(), set()
+    for chunk_file in store.files():
+        if Path(chunk_file).name in pending_files:
+            continue
+        try:
+            live_ids.update(chunk_id for chunk_id, _ in store.entries(chunk_file))
+        except (OSError, ValueError, KeyError):
+            unreadable_files.add(Path(chunk_file).name)
+    if unreadable_files:
+        live_ids.update(chunk_id for chunk_id, source_file in stored_ids.items() if source_file in unreadable_files)
+    return live_ids
+
+
+def release_orphaned_duplicates(duplicates: dict[str, str], live_ids: set[str]) -> int:
+    """Forget duplicates whose kept chunk no longer exists, so they are checked again; returns how many"""
+    orphaned = [chunk_id for chunk_id, kept_id in duplicates.items() if kept_id not in live_ids]
+    for chunk_id in orphaned:
+        del duplicates[chunk_id]
+    return len(orphaned)
+
+
+def duplicate_sources_metadata(duplicates: dict[str, str], seen_ids: dict, kept_ids: Iterable[str]) -> dict[str, dict]:
+    """Metadata update for each kept chunk: the sources its duplicates came from and how many there are"""
+    duplicates_of = {kept_id: [] for kept_id in kept_ids}
+    for chunk_id, kept_id in duplicates.items():
+        if kept_id in duplicates_of and chunk_id in seen_ids:
+            duplicates_of[kept_id].append(chunk_id)
+    return {
+        kept_id: {"duplicate_sources": " | ".join(sorted({str(seen_ids[chunk_id]) for chunk_id in chunk_ids})),
+                  "duplicate_count": len(chunk_ids)}
+        for kept_id, chunk_ids in duplicates_of.items()
+    }
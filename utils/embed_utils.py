@@ -1,80 +1,355 @@
+import os
 import json
-import glob
+import time
+import queue
+import threading
+import uuid
 from pathlib import Path
+from typing import Callable, Iterable, Iterator
 
 from langchain_core.documents import Document
-from langchain_ollama import OllamaEmbeddings
+from langchain_core.embeddings import Embeddings
+from utils.embedding_cache import with_embedding_cache
+from utils.model_utils import create_embeddings
+from utils.chunk_store import ChunkStore
+from config import (EMBED_BATCH_SIZE, EMBED_CONCURRENCY, EMBED_QUEUE_SIZE, EMBED_MAX_RETRIES, EMBED_RETRY_BACKOFF)
 
+# Marks the end of a queue for one consumer
+_END_OF_QUEUE = object()
 
+# Characters read per step when streaming chunk files
+JSON_READ_SIZE = 1 << 16
+
+
+def iter_json_array(file_path: str, read_size: int = JSON_READ_SIZE) -> Iterator:
+    """Incrementally parse a top-level JSON array, yielding one item at a time.
+
+    Only the item being decoded and one read buffer are kept in memory, so
+    large chunk files never have to be loaded whole.
+    """
+    decoder = json.JSONDecoder()
+
+    with open(file_path, "r", encoding="utf-8") as f:
+        buffer = ""
+        pos = 0
+        eof = False
+
+        def fill() -> bool:
+            nonlocal buffer, pos, eof
+            data = f.read(read_size)
+            if not data:
+                eof = True
+                return False
+            buffer = buffer[pos:] + data
+            pos = 0
+            return True
+
+        def next_token() -> str:
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos].isspace():
+                    pos += 1
+                if pos < len(buffer):
+                    return buffer[pos]
+                if not fill():
+                    raise json.JSONDecodeError("Unexpected end of file", buffer, pos)
+
+        if next_token() != "[":
+            raise json.JSONDecodeError("Expected a JSON array", buffer, pos)
+        pos += 1
+
+        if next_token() == "]":
+            return
+
+        while True:
+            next_token()
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                    # A value is complete once a separator follows it; a number may be cut short
+                    # anywhere, e.g. "1.5e10" read as "1" or "1.5e1"
+                    if eof or (end < len(buffer) and (buffer[end] in ",]" or buffer[end].isspace())):
+                        break
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+            pos = end
+            yield item
+
+            separator = next_token()
+            pos += 1
+            if separator == "]":
+                return
+            if separator != ",":
+                raise json.JSONDecodeError("Expected ',' or ']'", buffer, pos - 1)
+
+
+def iter_new_chunks(store: ChunkStore, manifest: dict, seen_ids: dict, failed_files: set = None,
+                    source_summary: dict = None, on_file: Callable = None,
+                    chunk_files: Iterable[str] = None) -> Iterator[Document]:
+    """Stream only chunks that are not stored or known duplicates yet, recording every chunk ID seen with its source.
+
+    Chunk IDs come from each file's index, so files without new chunks are
+    never parsed. on_file(source_file, chunk_ids, load_documents) is called
+    for every readable file before its new chunks are yielded. Files that
+    cannot be read are added to failed_files (when given), so callers can tell
+    a missing chunk from an unreadable one. chunk_files may be a stream of
+    files that are still being written (every chunk file in the store by default).
+    """
+    if chunk_files is None:
+        chunk_files = store.files()
+        if not chunk_files:
+            raise FileNotFoundError(f"No files found matching pattern: {store.pattern}")
+        print(f"Found {len(chunk_files)} chunk files: {[Path(f).name for f in chunk_files]}")
+
+    return _iter_new_chunks(store, chunk_files, manifest["chunks"], manifest.get("duplicates", {}), seen_ids,
+                            failed_files if failed_files is not None else set(),
+                            source_summary if source_summary is not None else {}, on_file)
+
+
+def _iter_new_chunks(store: ChunkStore, chunk_files: Iterable[str], stored_ids: dict, duplicate_ids: dict,
+                     seen_ids: dict, failed_files: set, source_summary: dict,
+                     on_file: Callable | None) -> Iterator[Document]:
+    total_loaded = file_count = 0
 
-def load_chunk_files(pattern):
-    """Load and process multiple chunk files"""
-    chunk_files = glob.glob(pattern)
-    
-    if not chunk_files:
-        raise FileNotFoundError(f"No files found matching pattern: {pattern}")
-    
-    print(f"Found {len(chunk_files)} chunk files: {[Path(f).name for f in chunk_files]}")
-    
-    all_documents = []
-    
     for chunk_file in chunk_files:
-        print(f"Processing: {chunk_file}")
-            
-        # Load and validate JSON structure
+        file_count += 1
+        source_file = Path(chunk_file).name
         try:
-            with open(chunk_file, "r", encoding="utf-8") as f:
-                json_data = json.load(f)
-            
-            if not json_data:
-                print(f"Warning: {chunk_file} is empty, skipping...")
-                continue
-                
-            # Validate required keys
-            file_documents = []
-            for item in json_data:
-                if "page_content" not in item or "metadata" not in item:
-                    print(f"Warning: Invalid JSON structure in {chunk_file}, missing required keys")
-                    continue
-                
-                # Add source file information to metadata
-                enhanced_metadata = item["metadata"].copy()
-
-                enhanced_metadata["source_file"] = Path(chunk_file).name
-                enhanced_metadata["source_path"] = chunk_file
-                enhanced_metadata["original_length"] = len(item["page_content"])
-                
-                file_documents.append(
-                    Document(page_content=item["page_content"], metadata=enhanced_metadata)
-                )
-            
-            all_documents.extend(file_documents)
-            print(f"  → Loaded {len(file_documents)} chunks from {chunk_file}")
-                
-        except json.JSONDecodeError as e:
-            print(f"Error: Invalid JSON format in {chunk_file}: {e}")
-            continue
-        except Exception as e:
+            entries = store.entries(chunk_file)
+        except (OSError, ValueError, KeyError) as e:
             print(f"Error processing {chunk_file}: {e}")
+            failed_files.add(source_file)
             continue
-    
-    if not all_documents:
+
+        if not entries:
+            print(f"Warning: {chunk_file} is empty, skipping...")
+            continue
+
+        new_positions = []
+        for position, (chunk_id, source) in enumerate(entries):
+            seen_ids[chunk_id] = source
+            if chunk_id not in stored_ids and chunk_id not in duplicate_ids:
+                new_positions.append(position)
+
+        if on_file is not None:
+            on_file(source_file, [chunk_id for chunk_id, _ in entries], lambda: store.read(chunk_file))
+
+        source_summary[source_file] = len(entries)
+        total_loaded += len(entries)
+        print(f"  → {source_file}: {len(entries)} chunks, {len(new_positions)} new")
+        yield from store.read(chunk_file, new_positions)
+
+    if not total_loaded:
         raise ValueError("No valid documents were loaded from any chunk files")
-    
-    print(f"\nTotal loaded: {len(all_documents)} chunks from {len(chunk_files)} files")
-    return all_documents
-    
 
-def initialize_ollama_embeddings(model_name: str) -> OllamaEmbeddings:
-    """Initialize and test Ollama embeddings connection"""
+    print(f"\nTotal loaded: {total_loaded} chunks from {file_count} files")
+
+
+def add_search_document_prefix(documents: Iterable[Document]) -> Iterator[Document]:
+    """Lazily add the nomic-embed-text search_document prefix"""
+    for doc in documents:
+        doc.page_content = f"search_document: {doc.page_content}"
+        yield doc
+
+
+def new_embed_manifest(model_name: str, collection_name: str) -> dict:
+    """Create an empty manifest for the given model and collection"""
+    return {
+        "embedding_model": model_name,
+        "collection_name": collection_name,
+        "chunks": {},  # chunk_id -> source_file
+        "duplicates": {}  # chunk_id -> chunk_id of the stored chunk it duplicates
+    }
+
+
+def load_embed_manifest(manifest_path: str) -> dict | None:
+    """Load the embedding manifest, or None if missing or unreadable"""
+    if not os.path.exists(manifest_path):
+        return None
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"Warning: Cannot read embedding manifest {manifest_path}: {e}")
+        return None
+
+
+def save_embed_manifest(manifest: dict, manifest_path: str) -> None:
+    """Atomically write the embedding manifest"""
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+
+def is_manifest_compatible(manifest: dict | None, model_name: str, collection_name: str) -> bool:
+    """Check that the manifest describes vectors from the same model and collection"""
+    return (
+        manifest is not None
+        and manifest.get("embedding_model") == model_name
+        and manifest.get("collection_name") == collection_name
+    )
+
+
+def bump_collection_revision(revision_file: str) -> str:
+    """Record that the collection changed, so answers cached against it are dropped"""
+    revision = uuid.uuid4().hex
+    os.makedirs(os.path.dirname(revision_file) or ".", exist_ok=True)
+    tmp_path = f"{revision_file}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(revision)
+    os.replace(tmp_path, revision_file)
+    return revision
+
+
+def read_collection_revision(revision_file: str) -> str:
+    """Current collection revision, or an empty string if the collection was never changed"""
+    try:
+        with open(revision_file, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def find_stale_ids(manifest: dict, seen_ids: dict, failed_files: set) -> list[str]:
+    """Return stored chunk IDs that no longer exist, keeping those of unreadable files"""
+    return [
+        chunk_id for chunk_id, source_file in manifest["chunks"].items()
+        if chunk_id not in seen_ids and source_file not in failed_files
+    ]
+
+
+def group_stored_ids_by_source(manifest: dict, seen_ids: dict) -> dict[str, list[str]]:
+    """Group stored chunk IDs by the source (PDF path or transcript) they came from"""
+    ids_by_source = {}
+    for chunk_id, source in seen_ids.items():
+        if chunk_id in manifest["chunks"]:
+            ids_by_source.setdefault(source, []).append(chunk_id)
+    return ids_by_source
+
+
+def initialize_ollama_embeddings(model_name: str) -> Embeddings:
+    """Initialize and test Ollama embeddings connection, wrapped with the embedding cache"""
     try:
         # Basic configuration (local Ollama running on default port)
-        embeddings = OllamaEmbeddings(model=model_name)
+        embeddings = create_embeddings(model_name)
         
         # Test Ollama connection
         print("Testing Ollama connection...")
         embeddings.embed_query("connection test")
         print("✓ Ollama connection successful")
-        return embeddings
+        return with_embedding_cache(embeddings, model_name)
     except Exception as e:
-        raise ConnectionError(f"Cannot connect to Ollama: {e}")
\ No newline at end of file
+        raise ConnectionError(f"Cannot connect to Ollama: {e}")
+
+
+def batch_documents(documents: Iterable[Document], batch_size: int) -> Iterable[list[Document]]:
+    """Group documents into lists of at most batch_size"""
+    batch = []
+    for doc in documents:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def embed_batch_with_retry(embeddings: Embeddings, texts: list[str],
+                           max_retries: int = EMBED_MAX_RETRIES, backoff: float = EMBED_RETRY_BACKOFF) -> list[list[float]]:
+    """Embed a batch of texts, retrying with exponential backoff"""
+    for attempt in range(max_retries + 1):
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff * (2 ** attempt)
+            print(f"  Warning: Embedding batch failed ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+
+def run_embedding_pipeline(
+    documents: Iterable[Document],
+    embeddings: Embeddings,
+    collection,
+    on_batch_written: Callable[[list[Document]], None] = None,
+    batch_size: int = EMBED_BATCH_SIZE,
+    concurrency: int = EMBED_CONCURRENCY,
+    queue_size: int = EMBED_QUEUE_SIZE
+) -> tuple[int, int]:
+    """Embed documents concurrently and upsert them into a Chroma collection.
+
+    A loader thread batches documents into a bounded queue, `concurrency`
+    worker threads embed batches, and the calling thread writes the results
+    through a second bounded queue, so a slow stage applies backpressure.
+    Returns the number of written and failed chunks.
+    """
+    batch_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    loader_errors = []
+
+    def load():
+        try:
+            for batch in batch_documents(documents, batch_size):
+                batch_queue.put(batch)
+        except Exception as e:
+            loader_errors.append(e)
+        finally:
+            for _ in range(concurrency):
+                batch_queue.put(_END_OF_QUEUE)
+
+    def embed():
+        while (batch := batch_queue.get()) is not _END_OF_QUEUE:
+            try:
+                vectors = embed_batch_with_retry(embeddings, [doc.page_content for doc in batch])
+                write_queue.put((batch, vectors, None))
+            except Exception as e:
+                write_queue.put((batch, None, e))
+        write_queue.put(_END_OF_QUEUE)
+
+    threads = [threading.Thread(target=load, daemon=True)]
+    threads += [threading.Thread(target=embed, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    written = failed = 0
+    finished_workers = 0
+    while finished_workers < concurrency:
+        item = write_queue.get()
+        if item is _END_OF_QUEUE:
+            finished_workers += 1
+            continue
+
+        batch, vectors, error = item
+        if error is None:
+            try:
+                collection.upsert(
+                    ids=[doc.metadata["chunk_id"] for doc in batch],
+                    embeddings=vectors,
+                    documents=[doc.page_content for doc in batch],
+                    metadatas=[doc.metadata for doc in batch]
+                )
+            except Exception as e:
+                error = e
+
+        if error is not None:
+            print(f"  ❌ Failed to embed batch of {len(batch)} chunks: {error}")
+            failed += len(batch)
+            continue
+
+        written += len(batch)
+        if on_batch_written:
+            on_batch_written(batch)
+
+    for thread in threads:
+        thread.join()
+    if loader_errors:
+        raise loader_errors[0]
+
+    return written, failed
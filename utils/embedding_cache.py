@@ -0,0 +1,230 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import contextvars
+from array import array
+from contextlib import contextmanager
+
+from langchain_core.embeddings import Embeddings
+from utils.instrumentation import span
+from config import (EMBED_CACHE_ENABLED, EMBED_CACHE_PATH, EMBED_CACHE_MAX_ENTRIES)
+
+# nomic-embed-text task prefixes, stored as a separate key column
+TASK_PREFIXES = ("search_document: ", "search_query: ")
+
+# (query, vector) of the query being answered, once something embedded it for this request
+_known_query_vector = contextvars.ContextVar("known_query_vector", default=None)
+
+
+def split_task_prefix(text: str) -> tuple[str, str]:
+    """Split a nomic-embed-text task prefix from the text"""
+    for prefix in TASK_PREFIXES:
+        if text.startswith(prefix):
+            return prefix.strip(), text[len(prefix):]
+    return "", text
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper with a size-bounded LRU cache stored in SQLite.
+
+    Vectors are keyed by (model, task prefix, sha256(text)), so identical
+    chunks and repeated queries are only sent to the embedding model once.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str,
+                 cache_path: str = EMBED_CACHE_PATH, max_entries: int = EMBED_CACHE_MAX_ENTRIES):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, prefix TEXT NOT NULL, text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, prefix, text_hash)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._entry_count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _key(self, text: str) -> tuple[str, str, str]:
+        prefix, body = split_task_prefix(text)
+        return self.model_name, prefix, hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: list[tuple[str, str, str]]) -> dict[tuple[str, str, str], list[float]]:
+        found = {}
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute(
+                    "SELECT vector FROM embeddings WHERE model = ? AND prefix = ? AND text_hash = ?", key
+                ).fetchone()
+                if row is not None:
+                    found[key] = array("f", row[0]).tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND prefix = ? AND text_hash = ?",
+                    [(now, *key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, items: dict[tuple[str, str, str], list[float]]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, prefix, text_hash, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(*key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+            )
+            self._entry_count += len(items)
+
+            # Evict least recently used entries once the cache grows past its bound
+            if self._entry_count > self.max_entries:
+                self._entry_count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                overflow = self._entry_count - self.max_entries
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM embeddings WHERE (model, prefix, text_hash) IN ("
+                        " SELECT model, prefix, text_hash FROM embeddings ORDER BY last_used LIMIT ?)",
+                        (overflow,)
+                    )
+                    self._entry_count -= overflow
+            self._conn.commit()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [self._key(text) for text in texts]
+        cached = self._lookup(list(dict.fromkeys(keys)))
+
+        # Embed each distinct missing text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        miss_count = sum(1 for key in keys if key not in cached)
+        with self._lock:
+            self.hits += len(texts) - miss_count
+            self.misses += miss_count
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            cached.update(computed)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        key = self._key(text)
+        cached = self._lookup([key])
+        with self._lock:
+            if key in cached:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if key in cached:
+            return cached[key]
+
+        vector = self.underlying.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        # Lookups are a few milliseconds of SQLite, only the model call is awaited
+        keys = [self._key(text) for text in texts]
+        cached = self._lookup(list(dict.fromkeys(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        miss_count = sum(1 for key in keys if key not in cached)
+        with self._lock:
+            self.hits += len(texts) - miss_count
+            self.misses += miss_count
+
+        if missing:
+            vectors = await self.underlying.aembed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            cached.update(computed)
+
+        return [cached[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        key = self._key(text)
+        cached = self._lookup([key])
+        with self._lock:
+            if key in cached:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if key in cached:
+            return cached[key]
+
+        vector = await self.underlying.aembed_query(text)
+        self._store({key: vector})
+        return vector
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+@contextmanager
+def known_query_vector(text: str, vector: list[float]):
+    """Let QueryVectorMemo return this vector for the query while the block runs, e.g. during retrieval"""
+    token = _known_query_vector.set((text, vector))
+    try:
+        yield
+    finally:
+        _known_query_vector.reset(token)
+
+
+class QueryVectorMemo(Embeddings):
+    """Embeddings wrapper that returns a query's vector if it was already embedded for the same request.
+
+    Queries it does embed are timed as the query.embed span, so every query
+    records that span once, wherever it is embedded.
+    """
+
+    def __init__(self, underlying: Embeddings):
+        self.underlying = underlying
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        known = _known_query_vector.get()
+        if known is not None and known[0] == text:
+            return known[1]
+        with span("query.embed"):
+            return self.underlying.embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.underlying.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        known = _known_query_vector.get()
+        if known is not None and known[0] == text:
+            return known[1]
+        with span("query.embed"):
+            return await self.underlying.aembed_query(text)
+
+
+def with_embedding_cache(embeddings: Embeddings, model_name: str) -> Embeddings:
+    """Wrap embeddings with the persistent cache when it is enabled in config"""
+    if not EMBED_CACHE_ENABLED:
+        return embeddings
+    return CachedEmbeddings(embeddings, model_name)
@@ -0,0 +1,50 @@
+import json
+from pathlib import Path
+
+# Metadata fields a filter may use; all chunks of a chunk file share their values
+FILTER_FIELDS = ("category", "source", "source_file")
+
+
+def normalize_filter(metadata_filter: dict | None) -> dict[str, list[str]] | None:
+    """Filter as field -> accepted values (a chunk must match every field), or None; raises ValueError on other fields"""
+    if not metadata_filter:
+        return None
+    unknown = sorted(set(metadata_filter) - set(FILTER_FIELDS))
+    if unknown:
+        raise ValueError(f"Cannot filter on {', '.join(unknown)}, only on {', '.join(FILTER_FIELDS)}")
+    return {
+        field: sorted({str(value) for value in (values if isinstance(values, (list, tuple, set)) else [values])})
+        for field, values in metadata_filter.items()
+    }
+
+
+def parse_filter_args(items: list[str] | None) -> dict[str, list[str]] | None:
+    """Filter from --filter field=value options; repeating a field accepts any of its values"""
+    metadata_filter = {}
+    for item in items or []:
+        field, separator, value = item.partition("=")
+        if not separator or not value.strip():
+            raise ValueError(f"Expected --filter field=value, got {item!r}")
+        metadata_filter.setdefault(field.strip(), []).append(value.strip())
+    return normalize_filter(metadata_filter)
+
+
+def entry_matches(entry: dict, metadata_filter: dict[str, list[str]]) -> bool:
+    """Whether metadata passes a normalized filter; a source also matches by its file name"""
+    for field, values in metadata_filter.items():
+        value = entry.get(field)
+        if value is None:
+            return False
+        if str(value) not in values and not (field == "source" and Path(str(value)).name in values):
+            return False
+    return True
+
+
+def describe_filter(metadata_filter: dict[str, list[str]]) -> str:
+    return " and ".join(f"{field}={'|'.join(values)}" for field, values in metadata_filter.items())
+
+
+def filter_scope(metadata_filter: dict | None) -> str:
+    """Stable key of a filter, so answers cached under one filter are not served under another"""
+    metadata_filter = normalize_filter(metadata_filter)
+    return json.dumps(metadata_filter, sort_keys=True) if metadata_filter else ""
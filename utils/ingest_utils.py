@@ -0,0 +1,200 @@
+import os
+import json
+import glob
+import hashlib
+from pathlib import Path
+
+# Bytes read per step when hashing source files
+HASH_READ_SIZE = 1 << 20
+
+
+def load_ingest_manifest(manifest_path: str) -> dict:
+    """Load the ingestion manifest, or an empty one if missing or unreadable"""
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Warning: Cannot read ingestion manifest {manifest_path}: {e}")
+    return {"sources": {}}
+
+
+def save_ingest_manifest(manifest: dict, manifest_path: str) -> None:
+    """Atomically write the ingestion manifest"""
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, manifest_path)
+
+
+def hash_file(file_path: str) -> str:
+    """SHA-256 of a file's content, read in blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while block := f.read(HASH_READ_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint_source(file_path: str, previous: dict = None) -> dict:
+    """Fingerprint a source by size, mtime and content hash.
+
+    The content is only hashed when size or mtime differ from the previous
+    fingerprint, so unchanged sources cost a single stat call.
+    """
+    stat = os.stat(file_path)
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime") == stat.st_mtime:
+        return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": previous["sha256"]}
+
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": hash_file(file_path)}
+
+
+def outputs_exist(entry: dict) -> bool:
+    """Check that every extraction output recorded for a source is still on disk"""
+    return all(
+        os.path.exists(path)
+        for stage, path in entry.get("outputs", {}).items()
+        if stage not in ("chunks", "vector_ids")
+    )
+
+
+def needs_chunking(entry: dict) -> bool:
+    """True if the source's chunk file was never written or has been deleted"""
+    chunks_path = entry.get("outputs", {}).get("chunks")
+    return chunks_path is None or not chunks_path.endswith(".jsonl") or not os.path.exists(chunks_path)
+
+
+def plan_ingestion(manifest: dict, pdf_pattern: str, video_pattern: str) -> dict:
+    """Compare sources on disk with the manifest and decide what has to be (re)processed"""
+    recorded = manifest["sources"]
+    plan = {"pdfs": [], "videos": [], "chunk": [], "removed": [], "touched": [], "fingerprints": {}}
+
+    for kind, pattern in (("pdfs", pdf_pattern), ("videos", video_pattern)):
+        for source in sorted(glob.glob(pattern)):
+            entry = recorded.get(source)
+            fingerprint = fingerprint_source(source, entry.get("fingerprint") if entry else None)
+            plan["fingerprints"][source] = fingerprint
+
+            if (entry is None or entry["fingerprint"]["sha256"] != fingerprint["sha256"]
+                    or not outputs_exist(entry) or is_legacy_pdf_output(entry)):
+                plan[kind].append(source)
+                continue
+
+            if entry["fingerprint"] != fingerprint:
+                # Touched but identical content: refresh size/mtime to skip hashing next time
+                entry["fingerprint"] = fingerprint
+                plan["touched"].append(source)
+            if needs_chunking(entry):
+                plan["chunk"].append(source)
+
+    plan["removed"] = [source for source in recorded if source not in plan["fingerprints"]]
+    return plan
+
+
+def is_legacy_pdf_output(entry: dict) -> bool:
+    """Whole pages written straight into CHUNKED_DIR before PDFs went through the chunking stage"""
+    json_path = entry.get("outputs", {}).get("json")
+    return json_path is not None and not json_path.endswith("_pages.json")
+
+
+def has_changes(plan: dict) -> bool:
+    """True if any source is new, modified, removed or still has to be chunked"""
+    return bool(plan["pdfs"] or plan["videos"] or plan["chunk"] or plan["removed"])
+
+
+def record_source(manifest: dict, source: str, fingerprint: dict, outputs: dict) -> None:
+    """Record a processed source with the outputs each stage produced"""
+    entry = manifest["sources"].setdefault(source, {})
+    entry["fingerprint"] = fingerprint
+    previous = entry.setdefault("outputs", {})
+
+    # An output written to a new path replaces the old file
+    for stage, path in outputs.items():
+        old_path = previous.get(stage)
+        if stage != "vector_ids" and old_path and old_path != path:
+            for old_file in filter(os.path.exists, output_files(stage, old_path)):
+                os.remove(old_file)
+    previous.update(outputs)
+
+
+def output_files(stage: str, path: str) -> list[str]:
+    """Files behind a stage output; a chunk file's offset and ID indexes go with it"""
+    return [path, chunk_offsets_path_for(path), chunk_ids_path_for(path)] if stage == "chunks" else [path]
+
+
+def remove_source_outputs(manifest: dict, source: str) -> None:
+    """Delete the files a removed source produced and forget it"""
+    entry = manifest["sources"].pop(source, {})
+    for stage, path in entry.get("outputs", {}).items():
+        if stage == "vector_ids":
+            continue
+        for path in filter(os.path.exists, output_files(stage, path)):
+            os.remove(path)
+            print(f"  Removed {Path(path).name} (source {Path(source).name} deleted)")
+
+
+def adopt_existing_outputs(manifest: dict, plan: dict, transcript_dir: str, pages_dir: str) -> int:
+    """Record sources whose outputs already exist from a run that predates the manifest"""
+    adopted = 0
+    for kind, output_stage, output_for in (
+        ("pdfs", "json", lambda source: pdf_json_path_for(source, pages_dir)),
+        ("videos", "transcript", lambda source: transcript_path_for(source, transcript_dir)),
+    ):
+        for source in list(plan[kind]):
+            output_path = output_for(source)
+            if os.path.exists(output_path):
+                record_source(manifest, source, plan["fingerprints"][source], {output_stage: output_path})
+                plan[kind].remove(source)
+                plan["chunk"].append(source)
+                adopted += 1
+
+    if adopted:
+        print(f"Adopted {adopted} already processed sources into the ingestion manifest")
+    return adopted
+
+
+def remove_legacy_chunk_files(chunked_dir: str) -> int:
+    """Delete chunk files in the JSON array format of versions before the manifest; their sources are chunked again"""
+    legacy_files = glob.glob(os.path.join(chunked_dir, "chunked_*.json"))
+    for path in legacy_files:
+        os.remove(path)
+    if legacy_files:
+        print(f"Removed {len(legacy_files)} chunk files in the old JSON format, their sources are chunked again")
+    return len(legacy_files)
+
+
+def transcript_path_for(video_path: str, transcript_dir: str) -> str:
+    """Transcript file the video stage writes for a video"""
+    return os.path.join(transcript_dir, f"{Path(video_path).stem}_transcript.txt")
+
+
+def segments_path_for(transcript_path: str) -> str:
+    """Timestamped segments file written next to a transcript"""
+    return transcript_path.removesuffix("_transcript.txt") + "_segments.json"
+
+
+def pdf_json_path_for(pdf_path: str, output_dir: str) -> str:
+    """Page records file the PDF stage writes for a PDF"""
+    return os.path.join(output_dir, f"{Path(pdf_path).stem}_pages.json")
+
+
+def chunks_path_for(input_path: str, chunked_dir: str) -> str:
+    """Chunk file the chunking stage writes for a page records file or transcript"""
+    return os.path.join(chunked_dir, f"chunked_{Path(input_path).stem}.jsonl")
+
+
+def chunk_offsets_path_for(chunks_path: str) -> str:
+    """Byte offset index written next to a JSONL chunk file"""
+    return chunks_path.removesuffix(".jsonl") + ".offsets.npy"
+
+
+def chunk_ids_path_for(chunks_path: str) -> str:
+    """Chunk ID index written next to a JSONL chunk file"""
+    return chunks_path.removesuffix(".jsonl") + ".ids.tsv"
+
+
+def chunking_input_for(entry: dict) -> str:
+    """Text the chunking stage splits for a source: its page records or its transcript"""
+    outputs = entry["outputs"]
+    return outputs.get("json") or outputs["transcript"]
@@ -0,0 +1,212 @@
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+from config import (TRACE_FILE, METRICS_WINDOW)
+
+QUANTILES = (0.5, 0.95, 0.99)
+RUN_ID = uuid.uuid4().hex[:12]  # Tells the runs apart in a shared trace file
+
+# ID of the query being answered, so all of its spans can be grouped in the trace file
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+
+
+def quantile(sorted_values: list[float], q: float) -> float:
+    """Linearly interpolated quantile of sorted values"""
+    position = q * (len(sorted_values) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class Histogram:
+    """Thread-safe value distribution: cumulative bucket counts for Prometheus, percentiles over the latest window"""
+
+    def __init__(self, name: str, buckets: tuple, description: str, window: int = METRICS_WINDOW):
+        self.name = name
+        self.buckets = tuple(sorted(buckets))
+        self.description = description
+        self._lock = threading.Lock()
+        self._bucket_counts = [0] * len(self.buckets)
+        self._samples = deque(maxlen=window)
+        self._count = 0
+        self._sum = 0.0
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._bucket_counts[position] += 1
+            self._samples.append(value)
+            self._count += 1
+            self._sum += value
+
+    def summary(self) -> dict:
+        """{count, sum, mean, p50, p95, p99, max, buckets: {le: cumulative count}}"""
+        with self._lock:
+            values = sorted(self._samples)
+            count, total, bucket_counts = self._count, self._sum, list(self._bucket_counts)
+        if not values:
+            return {"count": 0, "sum": 0.0}
+        return {"count": count, "sum": total, "mean": total / count, "max": values[-1],
+                **{f"p{round(q * 100)}": quantile(values, q) for q in QUANTILES},
+                "buckets": dict(zip(self.buckets, bucket_counts))}
+
+    def prometheus_lines(self) -> list[str]:
+        summary = self.summary()
+        lines = [f"# HELP rag_{self.name} {self.description}", f"# TYPE rag_{self.name} histogram"]
+        for bound, bucket_count in summary.get("buckets", dict.fromkeys(self.buckets, 0)).items():
+            lines.append(f'rag_{self.name}_bucket{{le="{bound}"}} {bucket_count}')
+        lines.append(f'rag_{self.name}_bucket{{le="+Inf"}} {summary["count"]}')
+        lines.append(f"rag_{self.name}_sum {summary['sum']:.6f}")
+        lines.append(f"rag_{self.name}_count {summary['count']}")
+        return lines
+
+
+class Metrics:
+    """Thread-safe span durations: count and sum of all samples, percentiles over the latest window"""
+
+    def __init__(self, window: int = METRICS_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._counts = {}
+        self._sums = {}
+        self.histograms = {}
+
+    def histogram(self, name: str, buckets: tuple, description: str) -> Histogram:
+        """The histogram registered under name, created on first use"""
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(name, buckets, description, self.window)
+            return self.histograms[name]
+
+    def histogram_summary(self) -> dict[str, dict]:
+        with self._lock:
+            histograms = list(self.histograms.values())
+        return {histogram.name: histogram.summary() for histogram in histograms}
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            self._sums[name] = self._sums.get(name, 0.0) + seconds
+
+    def summary(self) -> dict[str, dict]:
+        """span -> {count, sum, p50, p95, p99}, durations in seconds"""
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+            counts, sums = dict(self._counts), dict(self._sums)
+
+        summary = {}
+        for name, values in samples.items():
+            summary[name] = {"count": counts[name], "sum": sums[name],
+                             **{f"p{round(q * 100)}": quantile(values, q) for q in QUANTILES}}
+        return summary
+
+    def prometheus_text(self) -> str:
+        """Prometheus text exposition of the span durations as one summary metric"""
+        lines = ["# HELP rag_span_seconds Duration of pipeline stages and query phases",
+                 "# TYPE rag_span_seconds summary"]
+        for name, stats in sorted(self.summary().items()):
+            for q in QUANTILES:
+                lines.append(f'rag_span_seconds{{span="{name}",quantile="{q}"}} {stats[f"p{round(q * 100)}"]:.6f}')
+            lines.append(f'rag_span_seconds_sum{{span="{name}"}} {stats["sum"]:.6f}')
+            lines.append(f'rag_span_seconds_count{{span="{name}"}} {stats["count"]}')
+        with self._lock:
+            histograms = list(self.histograms.values())
+        for histogram in histograms:
+            lines.extend(histogram.prometheus_lines())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class TraceWriter:
+    """Appends one JSON line per span to the trace file"""
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def write(self, record: dict) -> None:
+        if not self.path:
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(line)
+
+
+trace_writer = TraceWriter(TRACE_FILE)
+
+
+def record_span(name: str, seconds: float, **attributes) -> None:
+    """Record a duration measured elsewhere (e.g. by callbacks) as a span"""
+    metrics.observe(name, seconds)
+    trace_writer.write({"time": round(time.time(), 3), "run": RUN_ID, "trace": _trace_id.get(),
+                        "span": name, "ms": round(seconds * 1000, 3), **attributes})
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the enclosed block as a span; failed blocks are recorded with error=True"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        attributes["error"] = True
+        raise
+    finally:
+        record_span(name, time.perf_counter() - start, **attributes)
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """Span that starts a new trace, so the spans recorded inside it share its trace ID"""
+    token = _trace_id.set(uuid.uuid4().hex[:16])
+    try:
+        with span(name, **attributes):
+            yield
+    finally:
+        _trace_id.reset(token)
+
+
+def submit_in_context(executor, function, *args):
+    """Submit to a thread pool with the caller's context, so spans in the worker keep the trace ID"""
+    return executor.submit(contextvars.copy_context().run, function, *args)
+
+
+def start_metrics_server(host: str, port: int):
+    """Serve GET /metrics in Prometheus text format from a background thread"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -1,5 +1,18 @@
 from pathlib import Path
-from langchain_core.documents import Document
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Only for annotations; importing langchain_core here would slow down every CLI start
+    from langchain_core.documents import Document
+
+# Pipeline stages, then query phases in the order they run
+SPAN_ORDER = {name: position for position, name in enumerate((
+    "stage.pdf_to_text", "stage.video_to_text", "stage.chunk", "stage.embed", "stage.load_chain",
+    "batch.embed", "batch.vector_search",
+    "query", "query.embed", "query.retrieve", "query.vector_search", "query.partition_search",
+    "query.lexical_search", "query.mmr",
+    "query.prompt_assembly", "query.llm_first_token", "query.llm_completion"
+))}
 
 
 def print_header(message: str) -> None:
@@ -43,40 +56,181 @@ def log_extraction_summary(successful_extractions: list[tuple[str, str, int]],
             print(f"  {Path(pdf_path).name}")
             
             
-def print_chunking_summary(all_splits: list[Document]) -> None:
-    """Print summary of chunking results by source file"""
+def print_chunking_summary(source_summary: dict[str, int]) -> None:
+    """Print summary of chunking results by chunk file"""
     
     print_header("CHUNKING SUMMARY")
-    
-    source_summary = {}
-    for chunk in all_splits:
-        source = chunk.metadata.get("source", "unknown")
-        source_summary[source] = source_summary.get(source, 0) + 1
 
     for source, count in source_summary.items():
         print(f"  {source}: {count} chunks")
+    print(f"Total: {sum(source_summary.values()):,} chunks from {len(source_summary)} files")
         
         
-def log_embedding_summary(documents: list[Document]) -> None:
-    """Log summary of embedding results by source file"""
+def log_embedding_summary(source_summary: dict[str, int], written: int) -> None:
+    """Log summary of embedding results by source file, from per-source chunk counts.
+
+    written is the number of chunks upserted in this run; the per-source counts
+    also include chunks that were unchanged or dropped as duplicates.
+    """
     
-    print(f"✓ Vector DB created with {len(documents)} chunks from multiple files")
+    print(f"✓ Vector DB updated: {written:,} chunks written, {sum(source_summary.values()):,} chunks seen "
+          f"in {len(source_summary)} files")
     
     print_header("EMBEDDING SUMMARY")
-    
-    source_summary = {}
-    for doc in documents:
-        source = doc.metadata.get("source_file", "unknown")
-        source_summary[source] = source_summary.get(source, 0) + 1
 
     print("\nDocument distribution by source file:")
     for source, count in source_summary.items():
         print(f"  {source}: {count} chunks")
 
 
+def log_incremental_embedding_summary(added: int, deleted: int, unchanged: int, failed: int = 0,
+                                      duplicates: int = 0) -> None:
+    """Log how many chunks were embedded, deleted or reused"""
+    print_header("INCREMENTAL EMBEDDING")
+    print(f"  Embedded (new or changed): {added:,} chunks")
+    print(f"  Deleted (stale): {deleted:,} chunks")
+    print(f"  Unchanged (skipped): {unchanged:,} chunks")
+    if duplicates:
+        print(f"  Duplicates (not embedded): {duplicates:,} chunks")
+    if failed:
+        print(f"  ❌ Failed (retried on next run): {failed:,} chunks")
+
+
+def log_dedup_summary(exact: int, near: int, released: int = 0) -> None:
+    """Log how many chunks deduplication kept from being embedded in this run"""
+    if exact or near:
+        print(f"✓ Deduplication: skipped {exact:,} exact and {near:,} near-duplicate chunks "
+              f"({exact + near:,} embeddings saved)")
+    if released:
+        print(f"  {released:,} earlier duplicates lost the chunk they duplicated and were checked again")
+
+
+def log_embedding_throughput(chunk_count: int, elapsed_seconds: float) -> None:
+    """Log embedding throughput in chunks per second"""
+    rate = chunk_count / elapsed_seconds if elapsed_seconds > 0 else 0.0
+    print(f"\n⏱ Embedded {chunk_count:,} chunks in {elapsed_seconds:.1f}s ({rate:,.1f} chunks/sec)")
+
+
+def log_embedding_cache_stats(embeddings) -> None:
+    """Log hit/miss counters of the embedding cache, if one is in use"""
+    if not hasattr(embeddings, "hit_rate"):
+        return
+    print(f"Embedding cache: {embeddings.hits:,} hits, {embeddings.misses:,} misses "
+          f"({embeddings.hit_rate():.1%} hit rate)")
+
+
+def log_context_packing(stats: dict, prompt_tokens: int) -> None:
+    """Log how retrieved documents were packed into the prompt"""
+    details = [f"{stats[key]} {key}" for key in ("deduplicated", "trimmed", "dropped") if stats[key]]
+    packed = stats["retrieved"] - stats["deduplicated"] - stats["dropped"]
+    print(f"📝 Context: {packed}/{stats['retrieved']} documents"
+          f"{' (' + ', '.join(details) + ')' if details else ''}, ~{prompt_tokens:,} prompt tokens")
+
+
+def log_answer_cache_stats(rag_chain) -> None:
+    """Log hit/miss counters of the answer cache, if the chain uses one"""
+    cache = getattr(rag_chain, "cache", None)
+    if cache is None or cache.hits + cache.misses == 0:
+        return
+    print(f"Answer cache: {cache.hits:,} hits, {cache.misses:,} misses ({cache.hit_rate():.1%} hit rate)")
+
+
+def format_source(doc: "Document") -> str:
+    """Short citation for a retrieved chunk: file, page or time offset in the video"""
+    metadata = doc.metadata
+    citation = Path(str(metadata.get("source_file") or metadata.get("source", "unknown"))).name
+    if "page" in metadata:
+        citation += f", page {int(metadata['page']) + 1}"
+    if "start_time" in metadata:
+        minutes, seconds = divmod(int(metadata["start_time"]), 60)
+        citation += f", at {minutes}:{seconds:02d}"
+    return citation
+
+
+def log_sources(documents: list["Document"]) -> None:
+    """Log the sources retrieved for a query"""
+    print(f"📚 Sources ({len(documents)} documents):")
+    for i, doc in enumerate(documents, 1):
+        print(f"  {i}. {format_source(doc)}")
+    print()
+
+
+def log_generation_timing(start_time: float, context_time: float | None,
+                          first_token_time: float | None, end_time: float) -> None:
+    """Log retrieval time, time-to-first-token and total generation time of a streamed answer"""
+    parts = []
+    if context_time is not None:
+        parts.append(f"retrieval {context_time - start_time:.2f}s")
+    if first_token_time is not None:
+        parts.append(f"first token {first_token_time - start_time:.2f}s")
+        parts.append(f"generation {end_time - first_token_time:.2f}s")
+    parts.append(f"total {end_time - start_time:.2f}s")
+    print(f"\n⏱ {' | '.join(parts)}")
+
+
+def log_batch_summary(counts: dict, elapsed_seconds: float, output_path: str) -> None:
+    """Log how many batch queries were answered, failed or skipped as already answered"""
+    print_header("BATCH SUMMARY")
+    finished = counts["answered"] + counts["failed"]
+    rate = f" ({finished / elapsed_seconds:.2f} queries/sec)" if elapsed_seconds > 0 and finished else ""
+    print(f"  Answered: {counts['answered']} queries in {elapsed_seconds:.1f}s{rate}")
+    if counts["failed"]:
+        print(f"  ❌ Failed: {counts['failed']} queries (retried on the next run)")
+    if counts["skipped"]:
+        print(f"  Skipped (already answered): {counts['skipped']} queries")
+    print(f"✓ Results written to {output_path}")
+
+
+def log_stage_utilization(utilization: dict[str, dict], wall_seconds: float) -> None:
+    """Log how busy each ingestion stage was, and the run's wall time against the stages run one after another"""
+    ran = {name: stats for name, stats in utilization.items() if stats["items"]}
+    if not ran:
+        return
+    print_header("STAGE UTILIZATION")
+    print(f"  {'stage':<16}{'workers':>8}{'items':>7}{'busy':>10}{'active':>10}{'utilization':>13}")
+    for name, stats in ran.items():
+        print(f"  {name:<16}{stats['workers']:>8}{stats['items']:>7}{stats['busy']:>9.1f}s{stats['active']:>9.1f}s"
+              f"{stats['utilization']:>13.0%}")
+    print(f"⏱ Ingestion took {wall_seconds:.1f}s; its stages were active for "
+          f"{sum(stats['active'] for stats in ran.values()):.1f}s in total, the longest for "
+          f"{max(stats['active'] for stats in ran.values()):.1f}s")
+
+
+def log_latency_summary(summary: dict[str, dict]) -> None:
+    """Log p50/p95/p99 of every recorded span, query phases in the order they run"""
+    if not summary:
+        return
+    print_header("LATENCY SUMMARY (ms)")
+    print(f"  {'span':<26}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, stats in sorted(summary.items(), key=lambda item: SPAN_ORDER.get(item[0], len(SPAN_ORDER))):
+        print(f"  {name:<26}{stats['count']:>7}{stats['p50'] * 1000:>10.1f}"
+              f"{stats['p95'] * 1000:>10.1f}{stats['p99'] * 1000:>10.1f}")
+
+
+def log_histogram_summary(summary: dict[str, dict]) -> None:
+    """Log mean, p50/p95 and max of every histogram with samples (e.g. query embedding batch sizes)"""
+    summary = {name: stats for name, stats in summary.items() if stats["count"]}
+    if not summary:
+        return
+    print_header("DISTRIBUTIONS")
+    print(f"  {'histogram':<30}{'count':>7}{'mean':>9}{'p50':>9}{'p95':>9}{'max':>9}")
+    for name, stats in sorted(summary.items()):
+        print(f"  {name:<30}{stats['count']:>7}{stats['mean']:>9.2f}{stats['p50']:>9.2f}"
+              f"{stats['p95']:>9.2f}{stats['max']:>9.2f}")
+
+
 def print_usage():
     """Print usage instructions"""
     print("Usage:")
     print("  python3 main.py \"What is RAG?\"")
     print("  python3 main.py What is retrieval augmented generation")
-    print("  python3 main.py  # Interactive mode")
\ No newline at end of file
+    print("  python3 main.py  # Interactive mode")
+    print("\nOptions:")
+    print("  --workers N  Extract and chunk PDFs and transcripts with N processes")
+    print("  --serve      Keep the RAG chain warm in a local retrieval server")
+    print("  --remote     Send queries to a running retrieval server")
+    print("  --no-stream  Print answers only once they are complete")
+    print("  --batch FILE Answer every query in a JSONL/CSV file, resumable; results go to <FILE>_answers.jsonl")
+    print("               or to --output PATH")
+    print("  --filter F=V Only search chunks whose category, source or source_file is V; repeat a field to")
+    print("               accept several values, e.g. --filter category=video_transcript --filter source=a.pdf")
\ No newline at end of file
@@ -0,0 +1,384 @@
+import os
+import json
+import time
+import shutil
+from typing import Iterable, Iterator
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from utils.mmr_utils import normalize_rows, max_marginal_relevance
+from config import (MEMMAP_DTYPE, MEMMAP_IVF_NPROBE)
+
+STORE_FORMAT = 3
+STORAGE_DTYPES = {"int8": np.int8, "float16": np.float16, "float32": np.float32}
+INT8_MAX = 127
+SEARCH_BLOCK_ROWS = 8192  # Rows dequantized per step, bounds the float32 scratch memory of a scan
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64  # Training vectors per IVF list
+
+META_FILE = "meta.json"
+VECTORS_FILE = "vectors.npy"
+UNSORTED_VECTORS_FILE = "vectors.unsorted.npy"
+SCALES_FILE = "scales.npy"
+DOCUMENTS_FILE = "documents.jsonl"
+DOCUMENT_OFFSETS_FILE = "documents.offsets.npy"
+IVF_CENTROIDS_FILE = "ivf_centroids.npy"
+IVF_OFFSETS_FILE = "ivf_offsets.npy"
+IVF_ROWS_FILE = "ivf_rows.npy"
+SOURCE_IDS_FILE = "source_ids.npy"  # Chunk file of every vector row, as its position in meta["source_files"]
+CHUNK_IDS_FILE = "chunk_ids.txt"  # Chunk ID of every vector row, one per line
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> tuple[np.ndarray, np.ndarray | None]:
+    """Unit-length rows in the storage dtype, plus the per-row scale of int8 rows"""
+    unit = normalize_rows(np.asarray(vectors, dtype=np.float32))
+    if dtype != "int8":
+        return unit.astype(STORAGE_DTYPES[dtype]), None
+    scales = np.abs(unit).max(axis=1) / INT8_MAX
+    scales[scales == 0] = 1.0
+    return np.rint(unit / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def dequantize(rows: np.ndarray, scales: np.ndarray | None) -> np.ndarray:
+    vectors = np.asarray(rows, dtype=np.float32)
+    return vectors * scales[:, None] if scales is not None else vectors
+
+
+def ivf_list_count(vector_count: int) -> int:
+    return max(1, int(np.sqrt(vector_count)))
+
+
+def assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray, scales: np.ndarray = None) -> np.ndarray:
+    """Index of the most similar centroid for every row, computed block by block"""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+        end = min(start + SEARCH_BLOCK_ROWS, len(vectors))
+        block = dequantize(vectors[start:end], scales[start:end] if scales is not None else None)
+        assignments[start:end] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(sample: np.ndarray, list_count: int, rng: np.random.Generator,
+                    iterations: int = KMEANS_ITERATIONS) -> np.ndarray:
+    """Spherical k-means: unit-length centroids maximizing the cosine similarity to their members"""
+    centroids = sample[rng.choice(len(sample), list_count, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_to_centroids(sample, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=list_count)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+        centroids[filled] = np.add.reduceat(sample[order], starts, axis=0)
+        # Lists that lost all members restart from a random training vector
+        empty = np.flatnonzero(counts == 0)
+        centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        centroids = normalize_rows(centroids)
+    return centroids.astype(np.float32)
+
+
+class MemmapStoreWriter:
+    """Writes a memmap store into <store_dir>.tmp, which replaces store_dir once finish() completes"""
+
+    def __init__(self, store_dir: str, count: int, dimension: int, dtype: str = MEMMAP_DTYPE):
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unknown vector dtype {dtype!r}, expected one of {', '.join(STORAGE_DTYPES)}")
+        self.store_dir = store_dir
+        self.tmp_dir = f"{store_dir.rstrip(os.sep)}.tmp"
+        self.count = count
+        self.dimension = dimension
+        self.dtype = dtype
+        self.written = 0
+
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+        self._vectors = np.lib.format.open_memmap(os.path.join(self.tmp_dir, UNSORTED_VECTORS_FILE), mode="w+",
+                                                  dtype=STORAGE_DTYPES[dtype], shape=(count, dimension))
+        self._scales = np.ones(count, dtype=np.float32) if dtype == "int8" else None
+        self._source_ids = np.zeros(count, dtype=np.int32)
+        self._source_files = {}  # source_file -> its ID
+        self._chunk_ids = []
+        self._documents = open(os.path.join(self.tmp_dir, DOCUMENTS_FILE), "wb")
+        self._offsets = [0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self._documents.close()
+            self._vectors = None
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def append(self, ids: list[str], embeddings, documents: list[str], metadatas: list[dict]) -> None:
+        rows, scales = quantize(embeddings, self.dtype)
+        end = self.written + len(rows)
+        if end > self.count:
+            raise ValueError(f"More than the {self.count} announced vectors were written")
+        self._vectors[self.written:end] = rows
+        if scales is not None:
+            self._scales[self.written:end] = scales
+        for row, (chunk_id, document, metadata) in enumerate(zip(ids, documents, metadatas), start=self.written):
+            source_file = str((metadata or {}).get("source_file", ""))
+            self._source_ids[row] = self._source_files.setdefault(source_file, len(self._source_files))
+            self._chunk_ids.append(chunk_id)
+            line = json.dumps({"id": chunk_id, "page_content": document or "", "metadata": metadata or {}},
+                              ensure_ascii=False).encode("utf-8") + b"\n"
+            self._documents.write(line)
+            self._offsets.append(self._offsets[-1] + len(line))
+        self.written = end
+
+    def finish(self, ivf: bool, seed: int = 0, **metadata) -> dict:
+        """Save the indexes (and the IVF index if requested), then swap the new store in; returns its metadata"""
+        if self.written != self.count:
+            raise ValueError(f"Expected {self.count} vectors, got {self.written} (did the collection change?)")
+        self._documents.close()
+        self._save(DOCUMENT_OFFSETS_FILE, np.array(self._offsets, dtype=np.int64))
+        self._vectors.flush()
+
+        list_count = 0
+        if ivf and self.count:
+            list_count = self._build_ivf(np.random.default_rng(seed))
+        else:
+            os.replace(os.path.join(self.tmp_dir, UNSORTED_VECTORS_FILE), os.path.join(self.tmp_dir, VECTORS_FILE))
+        self._vectors = None
+        if self._scales is not None:
+            self._save(SCALES_FILE, self._scales)
+        self._save(SOURCE_IDS_FILE, self._source_ids)
+        with open(os.path.join(self.tmp_dir, CHUNK_IDS_FILE), "w", encoding="utf-8") as f:
+            f.write("\n".join(self._chunk_ids))
+
+        meta = {"format": STORE_FORMAT, "dtype": self.dtype, "dimension": self.dimension, "count": self.count,
+                "metric": "cosine", "ivf_lists": list_count, "source_files": list(self._source_files),
+                "exported_at": time.time(), **metadata}
+        with open(os.path.join(self.tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+        # Readers of the old store keep their open memory maps; new ones see the complete new store
+        old_dir = f"{self.store_dir.rstrip(os.sep)}.old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(self.store_dir):
+            os.replace(self.store_dir, old_dir)
+        os.replace(self.tmp_dir, self.store_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        return meta
+
+    def _build_ivf(self, rng: np.random.Generator) -> int:
+        list_count = min(ivf_list_count(self.count), self.count)
+        sample_rows = np.sort(rng.choice(self.count, min(self.count, list_count * KMEANS_SAMPLE_PER_LIST),
+                                         replace=False))
+        sample = dequantize(self._vectors[sample_rows],
+                            self._scales[sample_rows] if self._scales is not None else None)
+        centroids = train_centroids(sample, list_count, rng)
+
+        # Store every list as one contiguous slice, so a probe reads its rows sequentially
+        assignments = assign_to_centroids(self._vectors, centroids, self._scales)
+        order = np.argsort(assignments, kind="stable")
+        sorted_vectors = np.lib.format.open_memmap(os.path.join(self.tmp_dir, VECTORS_FILE), mode="w+",
+                                                   dtype=self._vectors.dtype, shape=self._vectors.shape)
+        for start in range(0, self.count, SEARCH_BLOCK_ROWS):
+            sorted_vectors[start:start + SEARCH_BLOCK_ROWS] = self._vectors[order[start:start + SEARCH_BLOCK_ROWS]]
+        sorted_vectors.flush()
+        del sorted_vectors
+        os.remove(os.path.join(self.tmp_dir, UNSORTED_VECTORS_FILE))
+        if self._scales is not None:
+            self._scales = self._scales[order]
+        self._source_ids = self._source_ids[order]
+        self._chunk_ids = [self._chunk_ids[row] for row in order]
+
+        self._save(IVF_CENTROIDS_FILE, centroids)
+        self._save(IVF_OFFSETS_FILE, np.concatenate([[0], np.cumsum(np.bincount(assignments,
+                                                                                minlength=list_count))]))
+        self._save(IVF_ROWS_FILE, order.astype(np.int64))  # Vector row -> document row
+        return list_count
+
+    def _save(self, name: str, array: np.ndarray) -> None:
+        np.save(os.path.join(self.tmp_dir, name), array)
+
+
+def row_range_blocks(ranges: list[tuple[int, int]]) -> Iterator[slice]:
+    """Split row ranges into slices of at most SEARCH_BLOCK_ROWS rows"""
+    for range_start, range_end in ranges:
+        for start in range(range_start, range_end, SEARCH_BLOCK_ROWS):
+            yield slice(start, min(start + SEARCH_BLOCK_ROWS, range_end))
+
+
+def read_store_meta(store_dir: str) -> dict | None:
+    """Metadata of an exported store, or None if there is none"""
+    try:
+        with open(os.path.join(store_dir, META_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+class MemmapVectorStore(VectorStore):
+    """Read-only vector store over a memory-mapped matrix of quantized, unit-length vectors.
+
+    Scores are cosine similarities. Stores without an IVF index are scanned
+    brute force, block by block; with one, only the nprobe lists whose
+    centroids are closest to the query are scanned. Written by
+    embed/export_memmap.py from the Chroma collection.
+    """
+
+    def __init__(self, store_dir: str, embedding: Embeddings, nprobe: int = MEMMAP_IVF_NPROBE):
+        self.store_dir = store_dir
+        self.meta = read_store_meta(store_dir)
+        if self.meta is None:
+            raise FileNotFoundError(f"No vector store exported to {store_dir} (run python3 -m embed.export_memmap)")
+        if self.meta["format"] != STORE_FORMAT:
+            raise ValueError(f"{store_dir} was exported in an unsupported format, export it again")
+
+        self._embedding = embedding
+        self.nprobe = nprobe
+        self.count = self.meta["count"]
+        self.vectors = np.load(os.path.join(store_dir, VECTORS_FILE), mmap_mode="r")
+        self.scales = np.load(os.path.join(store_dir, SCALES_FILE)) if self.meta["dtype"] == "int8" else None
+        self._document_offsets = np.load(os.path.join(store_dir, DOCUMENT_OFFSETS_FILE), mmap_mode="r")
+        self._documents = open(os.path.join(store_dir, DOCUMENTS_FILE), "rb")
+        self._source_ids = np.load(os.path.join(store_dir, SOURCE_IDS_FILE), mmap_mode="r")
+        self._source_file_ids = {source_file: index for index, source_file in enumerate(self.meta["source_files"])}
+        self._chunk_rows = None  # chunk ID -> vector row, read on first use
+
+        self.centroids = self._list_offsets = self._document_rows = None
+        if self.meta["ivf_lists"]:
+            self.centroids = np.load(os.path.join(store_dir, IVF_CENTROIDS_FILE))
+            self._list_offsets = np.load(os.path.join(store_dir, IVF_OFFSETS_FILE))
+            self._document_rows = np.load(os.path.join(store_dir, IVF_ROWS_FILE), mmap_mode="r")
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def _probe_ranges(self, query: np.ndarray) -> list[tuple[int, int]]:
+        """Row ranges of the nprobe lists closest to the query"""
+        centroid_scores = self.centroids @ query
+        if len(centroid_scores) > self.nprobe:
+            lists = np.argpartition(centroid_scores, len(centroid_scores) - self.nprobe)[-self.nprobe:]
+        else:
+            lists = np.arange(len(centroid_scores))
+        return sorted((int(self._list_offsets[index]), int(self._list_offsets[index + 1])) for index in lists)
+
+    def _rows_of_sources(self, source_files: Iterable[str]) -> np.ndarray:
+        """Vector rows of the chunks that came from the given chunk files"""
+        source_ids = [self._source_file_ids[name] for name in source_files if name in self._source_file_ids]
+        return np.flatnonzero(np.isin(self._source_ids, source_ids))
+
+    def _rows_of_chunks(self, chunk_ids: Iterable[str]) -> np.ndarray:
+        """Vector rows of the given chunk IDs"""
+        if self._chunk_rows is None:
+            with open(os.path.join(self.store_dir, CHUNK_IDS_FILE), "r", encoding="utf-8") as f:
+                self._chunk_rows = {chunk_id: row for row, chunk_id in enumerate(f.read().split("\n"))}
+        return np.array(sorted({self._chunk_rows[chunk_id] for chunk_id in chunk_ids if chunk_id in self._chunk_rows}),
+                        dtype=np.int64)
+
+    def _scan(self, queries: np.ndarray, blocks: Iterable, k: int) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Top k rows and scores per query over blocks of rows, given as slices or row arrays"""
+        candidate_rows, candidate_scores = [], []
+        for block in blocks:
+            rows = np.arange(block.start, block.stop) if isinstance(block, slice) else block
+            scores = np.asarray(self.vectors[block], dtype=np.float32) @ queries.T
+            if self.scales is not None:
+                scores *= self.scales[block, None]
+            if len(rows) > k:
+                top = np.argpartition(scores, len(rows) - k, axis=0)[-k:]
+                candidate_scores.append(np.take_along_axis(scores, top, axis=0))
+                candidate_rows.append(rows[top])
+            else:
+                candidate_scores.append(scores)
+                candidate_rows.append(np.broadcast_to(rows[:, None], scores.shape))
+
+        if not candidate_rows:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in queries]
+        rows, scores = np.concatenate(candidate_rows), np.concatenate(candidate_scores)
+        best = np.argsort(-scores, axis=0, kind="stable")[:k]
+        return [(rows[best[:, column], column], scores[best[:, column], column]) for column in range(len(queries))]
+
+    def search(self, query_embeddings, k: int, source_files: Iterable[str] = None,
+               chunk_ids: Iterable[str] = None) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Rows and cosine similarities of the k most similar vectors for each query, best first.
+
+        With source_files or chunk_ids, only chunks of those chunk files and
+        the chunks with those IDs are searched, brute force over their rows.
+        """
+        queries = normalize_rows(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        k = min(k, self.count)
+        if k <= 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in queries]
+        if source_files is not None or chunk_ids is not None:
+            rows = np.union1d(self._rows_of_sources(source_files or ()), self._rows_of_chunks(chunk_ids or ()))
+            return self._scan(queries, (rows[start:start + SEARCH_BLOCK_ROWS]
+                                        for start in range(0, len(rows), SEARCH_BLOCK_ROWS)), k)
+        if self.centroids is None:
+            # One pass over the matrix answers all queries
+            return self._scan(queries, row_range_blocks([(0, self.count)]), k)
+        return [self._scan(query[None, :], row_range_blocks(self._probe_ranges(query)), k)[0] for query in queries]
+
+    def get_vectors(self, rows) -> np.ndarray:
+        """Dequantized (unit-length) vectors of the given rows"""
+        rows = np.asarray(rows, dtype=np.int64)
+        return dequantize(self.vectors[rows], self.scales[rows] if self.scales is not None else None)
+
+    def get_documents(self, rows) -> list[Document]:
+        documents = []
+        for row in rows:
+            document_row = int(self._document_rows[row]) if self._document_rows is not None else int(row)
+            start, end = int(self._document_offsets[document_row]), int(self._document_offsets[document_row + 1])
+            # pread does not move a shared file position, so concurrent queries can read at once
+            record = json.loads(os.pread(self._documents.fileno(), end - start, start))
+            documents.append(Document(id=record["id"], page_content=record["page_content"],
+                                      metadata=record["metadata"]))
+        return documents
+
+    def query(self, query_embeddings: list[list[float]], n_results: int, include: Iterable[str] = (),
+              source_files: Iterable[str] = None, chunk_ids: Iterable[str] = None) -> dict:
+        """Same result layout as chromadb's Collection.query (distances are cosine distances)"""
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": [],
+                   "embeddings": [] if "embeddings" in include else None}
+        for rows, scores in self.search(query_embeddings, n_results, source_files, chunk_ids):
+            documents = self.get_documents(rows)
+            results["ids"].append([doc.id for doc in documents])
+            results["documents"].append([doc.page_content for doc in documents])
+            results["metadatas"].append([doc.metadata for doc in documents])
+            results["distances"].append((1 - scores).tolist())
+            if results["embeddings"] is not None:
+                results["embeddings"].append(self.get_vectors(rows))
+        return results
+
+    def similarity_search_with_score_by_vector(self, embedding: list[float], k: int = 4,
+                                               **kwargs) -> list[tuple[Document, float]]:
+        rows, scores = self.search([embedding], k)[0]
+        return list(zip(self.get_documents(rows), scores.tolist()))
+
+    def similarity_search_by_vector(self, embedding: list[float], k: int = 4, **kwargs) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list[tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list[Document]:
+        return self.similarity_search_by_vector(self._embedding.embed_query(query), k)
+
+    def max_marginal_relevance_search_by_vector(self, embedding: list[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5, **kwargs) -> list[Document]:
+        rows, _ = self.search([embedding], fetch_k)[0]
+        selected = max_marginal_relevance(embedding, self.get_vectors(rows), k, lambda_mult)
+        return self.get_documents(rows[selected])
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5,
+                                      **kwargs) -> list[Document]:
+        return self.max_marginal_relevance_search_by_vector(self._embedding.embed_query(query), k, fetch_k,
+                                                            lambda_mult)
+
+    def _select_relevance_score_fn(self):
+        # Cosine similarity in [-1, 1] to a relevance score in [0, 1]
+        return lambda score: (score + 1) / 2
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("MemmapVectorStore is read-only; embed into Chroma and export it again")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("MemmapVectorStore is read-only; export one with python3 -m embed.export_memmap")
+
@@ -0,0 +1,32 @@
+import numpy as np
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length so dot products are cosine similarities"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def max_marginal_relevance(query_embedding, candidate_embeddings, k: int, lambda_mult: float) -> list[int]:
+    """Greedy MMR selection over a candidate embedding matrix; returns candidate indices in selection order.
+
+    Relevance to the query is computed once, and each step folds the newest
+    pick into a running max similarity-to-selected vector with a single
+    matrix-vector product, so a step costs O(fetch_k * dim).
+    """
+    candidates = normalize_rows(np.asarray(candidate_embeddings, dtype=np.float32))
+    k = min(k, len(candidates))
+    if k <= 0:
+        return []
+
+    relevance = candidates @ normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+    redundancy = np.full(len(candidates), -np.inf, dtype=np.float32)
+    selected = [int(np.argmax(relevance))]
+
+    while len(selected) < k:
+        np.maximum(redundancy, candidates @ candidates[selected[-1]], out=redundancy)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+
+    return selected
@@ -0,0 +1,68 @@
+import time
+from functools import cache
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from utils.instrumentation import record_span
+from config import (MODEL_BACKEND, CHAT_MODEL, TEMPERATURE)
+
+FAKE_EMBEDDING_SIZE = 768  # Same dimension as nomic-embed-text
+FAKE_ANSWER = "This is a deterministic answer from the fake chat model used for offline benchmarks."
+
+
+@cache
+def create_embeddings(model_name: str) -> Embeddings:
+    """Ollama embeddings, or deterministic hash-based vectors for the fake backend.
+
+    One instance per model for the whole process, so every caller shares the
+    same pooled keep-alive HTTP client instead of reconnecting to Ollama.
+    """
+    if MODEL_BACKEND == "fake":
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        return DeterministicFakeEmbedding(size=FAKE_EMBEDDING_SIZE)
+
+    from langchain_ollama import OllamaEmbeddings
+    return OllamaEmbeddings(model=model_name)
+
+
+def create_chat_model(callbacks: list = None) -> BaseChatModel:
+    """ChatOllama for CHAT_MODEL, or a fake model that always streams the same answer"""
+    if MODEL_BACKEND == "fake":
+        from langchain_core.language_models import FakeListChatModel
+        return FakeListChatModel(responses=[FAKE_ANSWER], callbacks=callbacks)
+
+    from langchain_ollama import ChatOllama
+    return ChatOllama(model=CHAT_MODEL, temperature=TEMPERATURE, callbacks=callbacks)
+
+
+class LLMLatencyCallback(BaseCallbackHandler):
+    """Records time to the first generated token and to the complete answer of every LLM call"""
+
+    # Handle events on the calling thread, async runs included, so timings are not delayed by an executor hop
+    run_inline = True
+
+    def __init__(self):
+        self._runs = {}  # run_id -> (start time, first token seen)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._runs[run_id] = [time.perf_counter(), False]
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._runs[run_id] = [time.perf_counter(), False]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None and not run[1]:
+            run[1] = True
+            record_span("query.llm_first_token", time.perf_counter() - run[0])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            record_span("query.llm_completion", time.perf_counter() - run[0])
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            record_span("query.llm_completion", time.perf_counter() - run[0], error=True)
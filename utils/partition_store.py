@@ -0,0 +1,360 @@
+import os
+import re
+import json
+import uuid
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from utils.chunk_store import parse_chunk_id
+from utils.filter_utils import normalize_filter, entry_matches
+from utils.memmap_store import MemmapVectorStore
+from utils.mmr_utils import max_marginal_relevance
+from utils.instrumentation import span, submit_in_context
+from config import (COLLECTION_NAME, MEMMAP_STORE_DIR, PARTITION_SEARCH_WORKERS)
+
+# Searches of the partitions a query spans run here in parallel
+_partition_executor = ThreadPoolExecutor(max_workers=PARTITION_SEARCH_WORKERS, thread_name_prefix="partition")
+
+
+def partition_collection_name(key: str) -> str:
+    """Collection of a partition: readable, unique per key and within Chroma's naming rules"""
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", key).strip("_")[:40]
+    return f"{COLLECTION_NAME}__{slug}_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]}"
+
+
+def is_own_collection(name: str) -> bool:
+    return name == COLLECTION_NAME or name.startswith(f"{COLLECTION_NAME}__")
+
+
+def partition_store_dir(collection_name: str, root_dir: str = MEMMAP_STORE_DIR) -> str:
+    """Memmap export of a collection; the unpartitioned collection keeps the top-level directory"""
+    return root_dir if collection_name == COLLECTION_NAME else os.path.join(root_dir, collection_name)
+
+
+class PartitionIndex:
+    """Collection, category and source of every chunk file in the vector store.
+
+    All chunks of a chunk file share these values, so a metadata filter
+    resolves to a set of chunk files, and from there to the partitions that
+    have to be searched. Chunks dropped as duplicates are not stored, so a
+    chunk file with duplicates also lists the kept chunks they stand for,
+    which are searched in their place. Written by the embed step.
+    """
+
+    def __init__(self, partition_by: str | None = None, files: dict = None, collections: dict = None):
+        self.partition_by = partition_by
+        self.files = files or {}  # source_file -> {"collection", "category", "source"[, "kept_ids"]}
+        self.collections = collections or {}  # collection name -> revision, changed whenever its chunks change
+
+    @classmethod
+    def load(cls, path: str) -> "PartitionIndex | None":
+        """The saved index, or None if missing or unreadable"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Warning: Cannot read partition index {path}: {e}")
+            return None
+        return cls(data.get("partition_by"), data.get("files"), data.get("collections"))
+
+    def save(self, path: str) -> None:
+        """Atomically write the index"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"partition_by": self.partition_by, "files": self.files, "collections": self.collections}, f,
+                      ensure_ascii=False, indent=4)
+        os.replace(tmp_path, path)
+
+    def collection_name(self, metadata: dict) -> str:
+        if self.partition_by is None:
+            return COLLECTION_NAME
+        return partition_collection_name(str(metadata.get(self.partition_by) or "unknown"))
+
+    def add_file(self, metadata: dict) -> str:
+        """Record the chunk file a chunk came from; returns the collection its chunks are stored in"""
+        entry = self.files.get(metadata["source_file"])
+        if entry is None:
+            entry = self.files[metadata["source_file"]] = {"collection": self.collection_name(metadata),
+                                                           "category": metadata.get("category"),
+                                                           "source": metadata.get("source")}
+            self.collections.setdefault(entry["collection"], "")
+        return entry["collection"]
+
+    def add_duplicates(self, metadata: dict, kept_ids: Iterable[str]) -> None:
+        """Record the kept chunks that a chunk file's duplicates stand for.
+
+        A chunk file whose chunks are all duplicates is recorded in the
+        collection of the first of them.
+        """
+        kept_ids = sorted(chunk_id for chunk_id in kept_ids if parse_chunk_id(chunk_id)[0] in self.files)
+        if not kept_ids:
+            return
+        entry = self.files.get(metadata["source_file"])
+        if entry is None:
+            entry = self.files[metadata["source_file"]] = {"collection": self.collection_of_chunk(kept_ids[0]),
+                                                           "category": metadata.get("category"),
+                                                           "source": metadata.get("source")}
+        entry["kept_ids"] = kept_ids
+
+    def clear_duplicates(self) -> None:
+        for entry in self.files.values():
+            entry.pop("kept_ids", None)
+
+    def collection_of_chunk(self, chunk_id: str) -> str | None:
+        entry = self.files.get(parse_chunk_id(chunk_id)[0])
+        if entry is not None:
+            return entry["collection"]
+        return COLLECTION_NAME if self.partition_by is None else None
+
+    def mark_changed(self, collection_name: str) -> None:
+        self.collections[collection_name] = uuid.uuid4().hex
+
+    def remove_files(self, source_files: Iterable[str]) -> list[str]:
+        """Forget chunk files without stored chunks; returns the collections left without any"""
+        for source_file in source_files:
+            self.files.pop(source_file, None)
+        used = {entry["collection"] for entry in self.files.values()}
+        empty = [name for name in self.collections if name not in used]
+        for name in empty:
+            del self.collections[name]
+        return empty
+
+    def matching_files(self, metadata_filter: dict[str, list[str]]) -> set[str]:
+        """Chunk files whose chunks pass a normalized filter"""
+        return {source_file for source_file, entry in self.files.items()
+                if entry_matches({**entry, "source_file": source_file}, metadata_filter)}
+
+    def plan(self, metadata_filter: dict[str, list[str]] | None) -> dict[str, tuple[set[str], set[str]] | None]:
+        """Collections to search for a normalized filter, with the (chunk files, chunk IDs) to restrict each one to.
+
+        None means the whole collection matches and is searched unfiltered;
+        collections without a matching chunk are left out. The chunk IDs are
+        kept chunks that duplicates of matching chunk files stand for, which
+        may belong to other chunk files and collections.
+        """
+        if metadata_filter is None:
+            return dict.fromkeys(self.collections)
+        matched = self.matching_files(metadata_filter)
+        files_by_collection = {}
+        for source_file, entry in self.files.items():
+            files_by_collection.setdefault(entry["collection"], []).append(source_file)
+        plan = {}
+        for name, source_files in files_by_collection.items():
+            matching = matched.intersection(source_files)
+            if matching:
+                plan[name] = None if len(matching) == len(source_files) else (matching, set())
+        for source_file in matched:
+            for chunk_id in self.files[source_file].get("kept_ids", ()):
+                name = self.collection_of_chunk(chunk_id)
+                if name is None:
+                    continue
+                if name not in plan:
+                    plan[name] = (set(), set())
+                if plan[name] is not None:
+                    plan[name][1].add(chunk_id)
+        return plan
+
+
+class PartitionedCollection:
+    """Write side of the partitioned store, with the Chroma collection methods the embed step uses.
+
+    Upserted chunks go to the collection of their partition, which is
+    recorded in the partition index; deletes and metadata updates are routed
+    by the chunk file in each chunk ID.
+    """
+
+    def __init__(self, persist_dir: str, index: PartitionIndex):
+        import chromadb
+        self.client = chromadb.PersistentClient(path=persist_dir)
+        self.index = index
+        self._collections = {}
+
+    def _collection(self, name: str):
+        if name not in self._collections:
+            self._collections[name] = self.client.get_or_create_collection(name, embedding_function=None)
+        return self._collections[name]
+
+    def _route(self, ids: list[str]) -> dict[str, list[int]]:
+        """Positions of the IDs per collection; chunks of unknown files are looked for in every collection"""
+        positions_by_collection = {}
+        for position, chunk_id in enumerate(ids):
+            name = self.index.collection_of_chunk(chunk_id)
+            for collection_name in [name] if name is not None else list(self.index.collections):
+                positions_by_collection.setdefault(collection_name, []).append(position)
+        return positions_by_collection
+
+    def upsert(self, ids: list[str], embeddings, documents: list[str], metadatas: list[dict]) -> None:
+        positions_by_collection = {}
+        for position, metadata in enumerate(metadatas):
+            positions_by_collection.setdefault(self.index.add_file(metadata), []).append(position)
+        for name, positions in positions_by_collection.items():
+            self._collection(name).upsert(ids=[ids[position] for position in positions],
+                                          embeddings=[embeddings[position] for position in positions],
+                                          documents=[documents[position] for position in positions],
+                                          metadatas=[metadatas[position] for position in positions])
+            self.index.mark_changed(name)
+
+    def delete(self, ids: list[str]) -> None:
+        for name, positions in self._route(ids).items():
+            self._collection(name).delete(ids=[ids[position] for position in positions])
+            self.index.mark_changed(name)
+
+    def update(self, ids: list[str], metadatas: list[dict]) -> None:
+        for name, positions in self._route(ids).items():
+            self._collection(name).update(ids=[ids[position] for position in positions],
+                                          metadatas=[metadatas[position] for position in positions])
+            self.index.mark_changed(name)
+
+    def drop(self, names: Iterable[str]) -> None:
+        """Delete collections, e.g. partitions left without chunks"""
+        for name in names:
+            self._collections.pop(name, None)
+            try:
+                self.client.delete_collection(name)
+            except Exception as e:  # chromadb raises different errors for missing collections across versions
+                print(f"Warning: Cannot delete collection {name}: {e}")
+
+    def reset(self) -> None:
+        """Delete the collection and every partition collection, and empty the index"""
+        self.drop([collection.name for collection in self.client.list_collections()
+                   if is_own_collection(collection.name)])
+        self.index.files.clear()
+        self.index.collections.clear()
+
+
+def query_collection(collection, query_embeddings: list[list[float]], n_results: int, include: Iterable[str],
+                     scope: tuple[set[str], set[str]] = None) -> dict:
+    """Collection.query on a Chroma collection or memmap store, optionally only over the chunks of some chunk
+    files plus some chunks by ID"""
+    if isinstance(collection, MemmapVectorStore):
+        source_files, chunk_ids = scope if scope is not None else (None, None)
+        return collection.query(query_embeddings, n_results, include, source_files, chunk_ids)
+    where = None
+    if scope is not None:
+        conditions = [{field: {"$in": sorted(values)}}
+                      for field, values in zip(("source_file", "chunk_id"), scope) if values]
+        where = conditions[0] if len(conditions) == 1 else {"$or": conditions}
+    return collection.query(query_embeddings=query_embeddings, n_results=n_results, include=list(include),
+                            where=where)
+
+
+def merge_query_results(results: list[dict], query_count: int, n_results: int, include: list[str]) -> dict:
+    """Combine Collection.query results of several collections into the n_results closest per query"""
+    keys = ["ids", "distances"] + [key for key in ("documents", "metadatas", "embeddings") if key in include]
+    merged = {key: [] if key in keys else None for key in ("ids", "documents", "metadatas", "distances", "embeddings")}
+    for query in range(query_count):
+        closest = sorted(
+            (distance, result_index, position)
+            for result_index, result in enumerate(results)
+            for position, distance in enumerate(result["distances"][query])
+        )[:n_results]
+        for key in keys:
+            values = [results[result_index][key][query][position] for _, result_index, position in closest]
+            merged[key].append(np.array(values) if key == "embeddings" else values)
+    return merged
+
+
+class PartitionedVectorStore(VectorStore):
+    """Searches the partitions a metadata filter selects and merges their closest chunks.
+
+    The partition index leaves out partitions without a matching chunk file
+    before any vector is scored, and partitions matching only in part are
+    searched with their matching chunk files as a filter, so a filtered query
+    costs what its partitions cost. Queries spanning several partitions
+    search them in parallel. Distances are Chroma's (L2) or the memmap
+    store's (cosine), whichever backend the partitions use.
+    """
+
+    def __init__(self, partitions: dict, index: PartitionIndex, embedding: Embeddings, metric: str = "l2"):
+        self.partitions = partitions  # collection name -> Chroma collection or MemmapVectorStore
+        self.index = index
+        self.metric = metric
+        self._embedding = embedding
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def _search_partition(self, name: str, query_embeddings: list[list[float]], n_results: int, include: list[str],
+                          scope: tuple[set[str], set[str]] | None) -> dict:
+        with span("query.partition_search", partition=name, filtered=scope is not None):
+            return query_collection(self.partitions[name], query_embeddings, n_results, include, scope)
+
+    def query(self, query_embeddings: list[list[float]], n_results: int, include: Iterable[str] = (),
+              filter: dict = None) -> dict:
+        """Collection.query over the partitions selected by a metadata filter"""
+        include = list(dict.fromkeys([*include, "distances"]))
+        plan = [(name, scope) for name, scope in self.index.plan(normalize_filter(filter)).items()
+                if name in self.partitions]
+        if len(plan) == 1:
+            results = [self._search_partition(plan[0][0], query_embeddings, n_results, include, plan[0][1])]
+        else:
+            futures = [submit_in_context(_partition_executor, self._search_partition, name, query_embeddings,
+                                         n_results, include, scope)
+                       for name, scope in plan]
+            results = [future.result() for future in futures]
+        return merge_query_results(results, len(query_embeddings), n_results, include)
+
+    def similarity_search_with_score_by_vector(self, embedding: list[float], k: int = 4, filter: dict = None,
+                                               **kwargs) -> list[tuple[Document, float]]:
+        results = self.query([embedding], k, ["documents", "metadatas"], filter)
+        return [
+            (Document(id=chunk_id, page_content=content, metadata=metadata or {}), distance)
+            for chunk_id, content, metadata, distance in zip(results["ids"][0], results["documents"][0],
+                                                             results["metadatas"][0], results["distances"][0])
+        ]
+
+    def similarity_search_by_vector(self, embedding: list[float], k: int = 4, filter: dict = None,
+                                    **kwargs) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: dict = None,
+                                     **kwargs) -> list[tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: dict = None, **kwargs) -> list[Document]:
+        return self.similarity_search_by_vector(self._embedding.embed_query(query), k, filter)
+
+    def max_marginal_relevance_search_by_vector(self, embedding: list[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5, filter: dict = None,
+                                                **kwargs) -> list[Document]:
+        results = self.query([embedding], fetch_k, ["documents", "metadatas", "embeddings"], filter)
+        if not results["ids"][0]:
+            return []
+        selected = max_marginal_relevance(embedding, results["embeddings"][0], k, lambda_mult)
+        return [Document(id=results["ids"][0][index], page_content=results["documents"][0][index],
+                         metadata=results["metadatas"][0][index] or {}) for index in selected]
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5,
+                                      filter: dict = None, **kwargs) -> list[Document]:
+        return self.max_marginal_relevance_search_by_vector(self._embedding.embed_query(query), k, fetch_k,
+                                                            lambda_mult, filter)
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn if self.metric == "cosine" else self._euclidean_relevance_score_fn
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("PartitionedVectorStore is read-only; chunks are written by the embed step")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("PartitionedVectorStore is read-only; chunks are written by the embed step")
+
+
+def query_vector_store(vector_store: VectorStore, query_embeddings: list[list[float]], n_results: int,
+                       include: Iterable[str], metadata_filter: dict = None) -> dict:
+    """Collection.query on the vector store of any backend; metadata filters need a PartitionedVectorStore"""
+    if isinstance(vector_store, PartitionedVectorStore):
+        return vector_store.query(query_embeddings, n_results, include, metadata_filter)
+    if metadata_filter:
+        raise ValueError("Metadata filters need the partition index (run python3 -m embed.embed to build it)")
+    collection = vector_store if isinstance(vector_store, MemmapVectorStore) else vector_store._collection
+    return query_collection(collection, query_embeddings, n_results, include)
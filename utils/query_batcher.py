@@ -0,0 +1,100 @@
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+from utils.instrumentation import metrics
+from config import (QUERY_EMBED_BATCH_WINDOW_MS, QUERY_EMBED_MAX_BATCH)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+QUEUE_WAIT_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100)
+
+
+class QueryBatchingEmbeddings(Embeddings):
+    """Embeddings wrapper that merges concurrent query embeddings into one batched model call.
+
+    The first query starts a window of window_ms; every query arriving before
+    it closes (up to max_batch) is embedded in the same embed_documents call
+    and each caller gets its own vector back. Document embeddings are already
+    batched and go straight to the underlying model.
+    """
+
+    def __init__(self, underlying: Embeddings, window_ms: float = QUERY_EMBED_BATCH_WINDOW_MS,
+                 max_batch: int = QUERY_EMBED_MAX_BATCH):
+        self.underlying = underlying
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.batch_sizes = metrics.histogram("query_embed_batch_size", BATCH_SIZE_BUCKETS,
+                                             "Queries embedded per batched model call")
+        self.queue_waits = metrics.histogram("query_embed_queue_wait_ms", QUEUE_WAIT_BUCKETS_MS,
+                                             "Time a query waited for its embedding batch to be sent")
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def _submit(self, text: str) -> Future:
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="query-embed-batcher", daemon=True)
+                self._worker.start()
+        future = Future()
+        self._queue.put((text, time.perf_counter(), future))
+        return future
+
+    def _collect(self) -> list:
+        """Block for the first query, then gather the others arriving within the window"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            # Queries whose caller gave up (cancelled or timed out) are not embedded
+            batch = [item for item in self._collect() if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            sent = time.perf_counter()
+            for _, queued_at, _ in batch:
+                self.queue_waits.observe((sent - queued_at) * 1000)
+
+            # The same query asked by several callers at once is embedded once
+            texts = list(dict.fromkeys(text for text, _, _ in batch))
+            self.batch_sizes.observe(len(texts))
+            try:
+                vectors = dict(zip(texts, self.underlying.embed_documents(texts)))
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for text, _, future in batch:
+                future.set_result(vectors[text])
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._submit(text).result()
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await asyncio.wrap_future(self._submit(text))
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.underlying.embed_documents(texts)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.underlying.aembed_documents(texts)
+
+
+def with_query_batching(embeddings: Embeddings) -> Embeddings:
+    """Wrap embeddings with the query micro-batcher unless its window is set to 0 in config"""
+    if not QUERY_EMBED_BATCH_WINDOW_MS or QUERY_EMBED_MAX_BATCH <= 1:
+        return embeddings
+    return QueryBatchingEmbeddings(embeddings)
@@ -1,6 +1,36 @@
-from utils.log_utils import print_header
+import time
+from utils.log_utils import (print_header, log_sources, log_generation_timing, log_latency_summary,
+                             log_histogram_summary)
+from utils.instrumentation import trace, metrics
+from config import STREAM_ANSWERS
 
-def execute_query(rag_chain, query: str):
+def stream_query(rag_chain, prefixed_query: str, answer_label: str = "Answer:") -> dict:
+    """Print answer tokens as they arrive, showing sources before generation starts"""
+    start_time = time.perf_counter()
+    context_time = first_token_time = None
+    answer_parts = []
+    context = []
+
+    with trace("query", streamed=True):
+        for chunk in rag_chain.stream({"input": prefixed_query}):
+            if "context" in chunk:
+                context = chunk["context"]
+                context_time = time.perf_counter()
+                log_sources(context)
+            if chunk.get("answer"):
+                if first_token_time is None:
+                    first_token_time = time.perf_counter()
+                    print(f"{answer_label} ", end="", flush=True)
+                print(chunk["answer"], end="", flush=True)
+                answer_parts.append(chunk["answer"])
+
+    end_time = time.perf_counter()
+    print()
+    log_generation_timing(start_time, context_time, first_token_time, end_time)
+    return {"answer": "".join(answer_parts), "context": context}
+
+
+def execute_query(rag_chain, query: str, stream: bool = STREAM_ANSWERS):
     """Execute a single query and display results"""
     print_header("RAG QUERY EXECUTION")
     print(f"\nQuery: {query}\n")
@@ -9,7 +39,13 @@ def execute_query(rag_chain, query: str):
     prefixed_query = f"search_query: {query}"
     
     try:
-        response = rag_chain.invoke({"input": prefixed_query})
+        # Chains without a stream interface (e.g. the remote client) answer in one piece
+        if stream and hasattr(rag_chain, "stream"):
+            stream_query(rag_chain, prefixed_query)
+            return
+
+        with trace("query", streamed=False):
+            response = rag_chain.invoke({"input": prefixed_query})
         print(f"Answer: {response['answer']}")
         
         # Optional: Show source documents
@@ -20,7 +56,7 @@ def execute_query(rag_chain, query: str):
         print(f"❌ Error executing query: {e}")
         
 
-def run_interactive_mode(rag_chain):
+def run_interactive_mode(rag_chain, stream: bool = STREAM_ANSWERS):
     """Run interactive mode allowing multiple queries"""
     print_header("INTERACTIVE RAG MODE")
     print("Enter your queries (type 'quit' or 'exit' or Ctrl+Cto stop):")
@@ -43,8 +79,13 @@ def run_interactive_mode(rag_chain):
             print(f"\n🔍 Searching for: {user_query}")
 	    # Add search_query prefix for nomic-embed-text model
             prefixed_query = f"search_query: {user_query}"
-            response = rag_chain.invoke({"input": prefixed_query})
-            print(f"\n💡 Answer: {response['answer']}\n")
+            if stream and hasattr(rag_chain, "stream"):
+                stream_query(rag_chain, prefixed_query, answer_label="\n💡 Answer:")
+                print()
+            else:
+                with trace("query", streamed=False):
+                    response = rag_chain.invoke({"input": prefixed_query})
+                print(f"\n💡 Answer: {response['answer']}\n")
             print("-" * 60)
             
         except KeyboardInterrupt:
@@ -52,7 +93,10 @@ def run_interactive_mode(rag_chain):
             break
         except Exception as e:
             print(f"❌ Error: {e}")
-            
+
+    log_latency_summary(metrics.summary())
+    log_histogram_summary(metrics.histogram_summary())
+
 def show_sample_queries():
     """Display sample queries for user reference"""
     sample_queries = [
@@ -0,0 +1,180 @@
+import time
+import queue
+import threading
+from typing import Any, Callable, Iterator
+
+from utils.instrumentation import span
+from config import INGEST_QUEUE_SIZE
+
+_END_OF_QUEUE = object()
+
+
+class PipelineStage:
+    """Worker threads taking items from the stage's input queue.
+
+    Items put before the run are always accepted; items sent by other stages
+    wait while queue_size of them are buffered, so a slow stage holds back
+    the stages feeding it. Busy time is the time spent on items, not waiting
+    for input or for room downstream.
+    """
+
+    def __init__(self, name: str, fn: Callable, workers: int, downstream: tuple, queue_size: int, sink: bool):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.downstream = downstream
+        self.sink = sink
+        self.queue = queue.Queue()
+        self.slots = threading.Semaphore(queue_size)
+        self.open_producers = 0
+        self.items = 0
+        self.busy = 0.0
+        self.first_start = None
+        self.last_end = None
+        self.lock = threading.Lock()
+
+    def record(self, start: float, end: float, blocked: float = 0.0) -> None:
+        with self.lock:
+            self.items += 1
+            self.busy += end - start - blocked
+            self.first_start = start if self.first_start is None else min(self.first_start, start)
+            self.last_end = end if self.last_end is None else max(self.last_end, end)
+
+
+class StagePipeline:
+    """Runs every item through its stages as soon as the stage before is done with it.
+
+    Each stage has its own worker threads (which may hand the work on to a
+    process pool) and bounded queues between stages, so e.g. one source is
+    embedded while the next is still being extracted. A sink stage takes all
+    of its items as one stream, for consumers that batch across items.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.wall = 0.0
+
+    def add_stage(self, name: str, fn: Callable[[Any, Callable], None], workers: int = 1, downstream: tuple = (),
+                  queue_size: int = INGEST_QUEUE_SIZE) -> None:
+        """fn(item, emit) processes one item; emit(stage, item) sends an item on to a downstream stage"""
+        self.stages[name] = PipelineStage(name, fn, max(1, workers), downstream, queue_size, sink=False)
+
+    def add_sink(self, name: str, fn: Callable[[Iterator], Any], queue_size: int = INGEST_QUEUE_SIZE) -> None:
+        """fn(items) consumes every item of the stage in one call; run() returns its result"""
+        self.stages[name] = PipelineStage(name, fn, 1, (), queue_size, sink=True)
+
+    def put(self, name: str, item) -> None:
+        """Queue an item for a stage before the run"""
+        self.stages[name].queue.put((item, False))
+
+    def emit(self, name: str, item) -> None:
+        stage = self.stages[name]
+        stage.slots.acquire()
+        stage.queue.put((item, True))
+
+    def _take(self, stage: PipelineStage):
+        item, counted = stage.queue.get()
+        if counted:
+            stage.slots.release()
+        return item
+
+    def _close(self, stage: PipelineStage) -> None:
+        """Tell the stages downstream that one of their producers is done"""
+        for name in stage.downstream:
+            downstream = self.stages[name]
+            with downstream.lock:
+                downstream.open_producers -= 1
+                last = downstream.open_producers == 0
+            if last:
+                for _ in range(downstream.workers):
+                    downstream.queue.put((_END_OF_QUEUE, False))
+
+    def _work(self, stage: PipelineStage, finished: list) -> None:
+        blocked = 0.0
+
+        def emit(name, item):
+            nonlocal blocked
+            wait_start = time.perf_counter()
+            self.emit(name, item)
+            blocked += time.perf_counter() - wait_start
+
+        while (item := self._take(stage)) is not _END_OF_QUEUE:
+            start, blocked = time.perf_counter(), 0.0
+            try:
+                with span(f"stage.{stage.name}"):
+                    stage.fn(item, emit)
+            except Exception as e:
+                print(f"❌ Error in stage {stage.name} for {item}: {e}")
+            stage.record(start, time.perf_counter(), blocked)
+        with stage.lock:
+            finished.append(None)
+            last = len(finished) == stage.workers
+        if last:
+            self._close(stage)
+
+    def _consume(self, stage: PipelineStage, outcome: dict) -> None:
+        waited, ended = 0.0, False
+
+        def items():
+            nonlocal waited, ended
+            while True:
+                wait_start = time.perf_counter()
+                item = self._take(stage)
+                waited += time.perf_counter() - wait_start
+                if item is _END_OF_QUEUE:
+                    ended = True
+                    return
+                stage.items += 1
+                yield item
+
+        start = time.perf_counter()
+        try:
+            with span(f"stage.{stage.name}"):
+                outcome["result"] = stage.fn(items())
+        except BaseException as e:
+            outcome["error"] = e
+            # Keep taking items, so the stages feeding this one can finish
+            while not ended and self._take(stage) is not _END_OF_QUEUE:
+                pass
+        end = time.perf_counter()
+        stage.busy, stage.first_start, stage.last_end = end - start - waited, start, end
+
+    def run(self):
+        """Run all stages until every item has passed through; returns the sink's result"""
+        for stage in self.stages.values():
+            for name in stage.downstream:
+                self.stages[name].open_producers += 1
+        for stage in self.stages.values():
+            if stage.open_producers == 0:
+                for _ in range(stage.workers):
+                    stage.queue.put((_END_OF_QUEUE, False))
+
+        outcome = {}
+        threads = []
+        start = time.perf_counter()
+        for stage in self.stages.values():
+            if stage.sink:
+                threads.append(threading.Thread(target=self._consume, args=(stage, outcome), daemon=True))
+            else:
+                finished = []
+                threads += [threading.Thread(target=self._work, args=(stage, finished), daemon=True)
+                            for _ in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.wall = time.perf_counter() - start
+
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome.get("result")
+
+    def utilization(self) -> dict[str, dict]:
+        """Per stage: workers, items, busy and active (first start to last finish) seconds, and utilization,
+        the busy share of the time its workers had during the run"""
+        return {
+            name: {"workers": stage.workers, "items": stage.items, "busy": stage.busy,
+                   "active": (stage.last_end - stage.first_start) if stage.first_start is not None else 0.0,
+                   "utilization": stage.busy / (stage.workers * self.wall) if self.wall else 0.0}
+            for name, stage in self.stages.items()
+        }